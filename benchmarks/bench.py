@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmarks of every InterOp parser and of InteropDataset end-to-end.
+
+Runs on each run directory in sampledata and on synthetic runs scaled up to instrument sizes we
+have no samples for. Synthetic runs are written by illuminate.synthetic for a flowcell of the
+requested size (lanes x surfaces x swaths x tiles, over the cycles of the requested reads).
+
+For each binary, the best wall-clock time of --repeat parses is reported with the peak memory
+allocated while parsing (tracemalloc, which numpy reports to), its size and its record count.
+"dataset" is InteropDataset plus all its accessors in turn, "load_all" the same via load_all().
+
+Results can be saved as JSON (--save) and compared with a saved baseline (--compare): the exit
+status is then 1 if any time or peak memory grew by more than --tolerance times the baseline.
+
+Usage: bench.py [options]
+
+  -h --help             Show this screen.
+  -r --repeat=<n>       Parses of each binary; the fastest counts [default: 3]
+  --samples-only        Skip synthetic runs.
+  --synthetic-only      Skip sample runs.
+  --preset=<names>      Comma-separated synthetic run sizes (see PRESETS) [default: miseq,hiseq]
+  --lanes=<n>           Override number of lanes of the synthetic runs.
+  --tiles=<n>           Override number of tiles per swath of the synthetic runs.
+  --cycles=<n>          Override number of cycles (as a single read) of the synthetic runs.
+  --backend=<name>      Parser backend, pandas or numpy [default: pandas]
+  --workdir=<dir>       Write synthetic runs to dir (and keep them) rather than a temporary directory.
+  --save=<file>         Write results to file as JSON.
+  --compare=<file>      Compare results with those saved in file.
+  --tolerance=<ratio>   Slowdown (or memory growth) counted as a regression [default: 1.5]
+"""
+
+from __future__ import print_function
+
+import glob, json, os, platform, shutil, sys, tempfile, time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None      # python 2: no peak memory figures.
+
+from docopt import docopt
+
+import numpy
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from illuminate import InteropDataset, InteropFileNotFoundError
+from illuminate.base_parser_class import count_records
+from illuminate.interop import PARSER_CLASSES, get_parser_class
+from illuminate.filemaps import BINFILE_DIR_NAME, BIN_FILEMAP
+from illuminate.synthetic import write_run
+from illuminate.utils import select_file_from_aliases
+
+# runs keep their binaries in an InterOp directory, except some (e.g. the NovaSeq sample) in the run folder.
+SAMPLE_RUNS = sorted(set([os.path.dirname(path) for path in
+                          glob.glob(os.path.join(REPO_DIR, 'sampledata', '*', '*', BINFILE_DIR_NAME))] +
+                         [os.path.dirname(path) for path in
+                          glob.glob(os.path.join(REPO_DIR, 'sampledata', '*', '*', '*MetricsOut.bin'))]))
+
+# flowcell layouts, read lengths and binary versions (newest supported if not given) of synthetic runs.
+PRESETS = { 'miseq':      { 'lanes': 1, 'surfaces': 2, 'swaths': 1, 'tiles': 14, 'reads': [151, 6, 151],
+                            'versions': { 'quality': 4, 'corint': 2, 'index': 1 } },
+            'hiseq':      { 'lanes': 8, 'surfaces': 2, 'swaths': 2, 'tiles': 16, 'reads': [101, 7, 101],
+                            'versions': { 'quality': 5, 'corint': 2, 'index': 1 } },
+            'nextseq':    { 'lanes': 4, 'surfaces': 2, 'swaths': 3, 'tiles': 12, 'reads': [151, 8, 151],
+                            'versions': { 'quality': 5 } },
+            'novaseq-s4': { 'lanes': 4, 'surfaces': 2, 'swaths': 6, 'tiles': 78, 'reads': [151, 8, 8, 151] } }
+
+
+#### Synthetic runs
+
+def make_synthetic_run(rundir, layout):
+    "writes a synthetic run of the given layout into rundir: RunInfo.xml plus every binary we parse."
+    flowcell_layout = { 'lanecount': layout['lanes'], 'surfacecount': layout['surfaces'],
+                        'swathcount': layout['swaths'], 'tilecount': layout['tiles'] }
+    read_config = [{ 'read_num': num + 1, 'cycles': cycles, 'is_index': int(cycles < 10) }
+                   for num, cycles in enumerate(layout['reads'])]
+    return write_run(rundir, flowcell_layout, read_config, versions=layout.get('versions'))
+
+def get_layout(preset, args):
+    "returns layout of preset, with any --lanes / --tiles / --cycles overrides."
+    layout = dict(PRESETS[preset])
+    if args['--lanes']:
+        layout['lanes'] = int(args['--lanes'])
+    if args['--tiles']:
+        layout['tiles'] = int(args['--tiles'])
+    if args['--cycles']:
+        layout['reads'] = [int(args['--cycles'])]
+    return layout
+
+
+#### Measurements
+
+def measure(func, repeat):
+    """calls func repeat times; returns (its last result, best wall-clock seconds, peak MB allocated
+    during one more call, or None without tracemalloc)."""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    return result, best, peak
+
+def get_bindir(rundir):
+    "returns the directory holding the binaries of the run in rundir: its InterOp directory, or itself."
+    bindir = os.path.join(rundir, BINFILE_DIR_NAME)
+    return bindir if os.path.isdir(bindir) else rundir
+
+def bench_run(rundir, repeat, backend):
+    "returns dict of benchmark name -> results for the run in rundir."
+    results = {}
+    bindir = get_bindir(rundir)
+    meta = InteropDataset(rundir).Metadata()
+    kwargs = { 'backend': backend }
+    # without RunInfo.xml, parsers keep their default layout and read config.
+    if meta.flowcell_layout:
+        kwargs['flowcell_layout'] = meta.flowcell_layout
+    if meta.read_config:
+        kwargs['read_config'] = meta.read_config
+
+    for codename in PARSER_CLASSES:
+        path = select_file_from_aliases(codename, BIN_FILEMAP, bindir)
+        if path is None:
+            continue
+        parser_class = get_parser_class(codename)
+        try:
+            parser, seconds, peak = measure(lambda: parser_class(path, **kwargs), repeat)
+        except Exception as e:
+            results[codename] = { 'error': '%s: %s' % (e.__class__.__name__, e) }
+            continue
+        results[codename] = { 'seconds': seconds, 'peak_mb': peak, 'bytes': os.path.getsize(path),
+                              'records': count_records(parser.data) }
+
+    def run_dataset(load_all=False):
+        dataset = InteropDataset(rundir, backend=backend)
+        dataset.bindir = bindir
+        if load_all:
+            dataset.load_all()
+        for accessor in ('TileMetrics', 'QualityMetrics', 'IndexMetrics', 'ErrorMetrics',
+                         'CorrectedIntensityMetrics', 'ExtractionMetrics', 'ControlMetrics'):
+            try:
+                getattr(dataset, accessor)()
+            except (Exception, InteropFileNotFoundError):
+                pass    # missing or unparseable binaries are reported by the per-parser benchmarks.
+
+    for name, load_all in (('dataset', False), ('load_all', True)):
+        seconds, peak = measure(lambda: run_dataset(load_all), repeat)[1:]
+        results[name] = { 'seconds': seconds, 'peak_mb': peak }
+    return results
+
+
+#### Reporting
+
+def print_results(case, results):
+    print(case)
+    for name in sorted(results):
+        result = results[name]
+        if 'error' in result:
+            print('  %-12s  %s' % (name, result['error']))
+            continue
+        line = '  %-12s %9.3f s' % (name, result['seconds'])
+        if result['peak_mb'] is not None:
+            line += ' %9.1f MB peak' % result['peak_mb']
+        if 'records' in result:
+            line += ' %12i records %10.1f MB/s' % (result['records'], result['bytes'] / 1e6 / max(result['seconds'], 1e-9))
+        print(line)
+
+def compare_results(results, baseline, tolerance):
+    "prints benchmarks that got slower (or used more memory) than tolerance allows; returns their number."
+    # differences below these are mostly noise.
+    floors = { 'seconds': 0.01, 'peak_mb': 1.0 }
+    regressions = 0
+    for case in sorted(results):
+        for name, result in sorted(results[case].items()):
+            old = baseline.get(case, {}).get(name)
+            if old is None or 'seconds' not in old or 'seconds' not in result:
+                continue
+            for key, label in (('seconds', 'time'), ('peak_mb', 'peak memory')):
+                if result.get(key) is None or not old.get(key):
+                    continue
+                ratio = result[key] / old[key]
+                if ratio > tolerance and result[key] > floors[key]:
+                    print('REGRESSION %s %s: %s %.3g -> %.3g (x%.2f)' % (case, name, label, old[key], result[key], ratio))
+                    regressions += 1
+    return regressions
+
+def main(args):
+    repeat = int(args['--repeat'])
+    backend = args['--backend']
+    if backend == 'pandas':
+        import pandas   # so that the first benchmark doesn't pay for importing it.
+
+    cases = []
+    if not args['--synthetic-only']:
+        cases.extend((os.path.relpath(rundir, REPO_DIR), rundir) for rundir in SAMPLE_RUNS)
+
+    workdir = None
+    if not args['--samples-only']:
+        workdir = args['--workdir'] or tempfile.mkdtemp(prefix='illuminate-bench-')
+        for preset in args['--preset'].split(','):
+            layout = get_layout(preset, args)
+            name = 'synthetic-%s-%iL-%iT-%iC' % (preset, layout['lanes'],
+                       layout['surfaces'] * layout['swaths'] * layout['tiles'], sum(layout['reads']))
+            rundir = os.path.join(workdir, name)
+            start = time.time()
+            make_synthetic_run(rundir, layout)
+            print('(wrote %s in %.1f s)' % (rundir, time.time() - start))
+            cases.append((name, rundir))
+
+    results = {}
+    try:
+        for case, rundir in cases:
+            results[case] = bench_run(rundir, repeat, backend)
+            print_results(case, results[case])
+    finally:
+        if workdir is not None and not args['--workdir']:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args['--save']:
+        with open(args['--save'], 'w') as fh:
+            json.dump({ 'python': platform.python_version(), 'numpy': numpy.__version__,
+                        'platform': platform.platform(), 'backend': backend, 'repeat': repeat,
+                        'results': results }, fh, indent=1, sort_keys=True)
+
+    if args['--compare']:
+        with open(args['--compare']) as fh:
+            baseline = json.load(fh)['results']
+        if compare_results(results, baseline, float(args['--tolerance'])):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(docopt(__doc__)))
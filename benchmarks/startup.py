@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Startup benchmark for the illuminate package and command line.
+
+Times commands that shouldn't need more than the metadata (importing the package, --help, --meta)
+in fresh interpreters, and lists any of the heavy dependencies they end up importing anyway.
+
+Usage: startup.py [options] [<datapath>]
+
+  -h --help             Show this screen.
+  -n --repeat=<n>       Number of runs of each command [default: 10]
+  --limit=<ms>          Exit with status 1 if the median time of --meta exceeds this [default: 150]
+
+<datapath> defaults to a MiSeq run from sampledata.
+"""
+
+from __future__ import print_function
+
+import os, subprocess, sys, time
+
+from docopt import docopt
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DATAPATH = os.path.join(REPO_DIR, 'sampledata', 'MiSeq-samples', '2014-02_11_50kit_single_read')
+
+# dependencies that only parsing binaries (or building DataFrames) should import.
+HEAVY_MODULES = ['numpy', 'pandas', 'bitstring']
+
+def get_commands(datapath):
+    "returns list of (label, python arguments) of the commands to time."
+    return [ ('import illuminate', ['-c', 'import illuminate']),
+             ('illuminate --help', ['-m', 'illuminate', '--help']),
+             ('illuminate --meta', ['-m', 'illuminate', '--meta', datapath]) ]
+
+def time_command(args, repeat):
+    "returns list of wall clock times (in ms) of repeat runs of python with args."
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            start = time.time()
+            subprocess.check_call([sys.executable] + args, cwd=REPO_DIR, stdout=devnull)
+            times.append((time.time() - start) * 1000)
+    return times
+
+def find_heavy_imports(args):
+    "returns the HEAVY_MODULES imported by python with args, according to -X importtime."
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime'] + args, cwd=REPO_DIR,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    stderr = proc.communicate()[1]
+    imported = set(line.rsplit('|', 1)[-1].strip() for line in stderr.splitlines() if line.startswith('import time:'))
+    return [name for name in HEAVY_MODULES if name in imported]
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+def main(args):
+    datapath = os.path.abspath(args['<datapath>'] or DEFAULT_DATAPATH)
+    repeat = int(args['--repeat'])
+    limit = float(args['--limit'])
+
+    meta_median = None
+    print('%-20s %10s %10s   %s' % ('command', 'min (ms)', 'median', 'heavy imports'))
+    for label, command in get_commands(datapath):
+        times = time_command(command, repeat)
+        heavy = find_heavy_imports(command) if sys.version_info >= (3, 7) else ['?']
+        print('%-20s %10.1f %10.1f   %s' % (label, min(times), median(times), ', '.join(heavy) or '-'))
+        if label == 'illuminate --meta':
+            meta_median = median(times)
+
+    if meta_median > limit:
+        print('FAIL: illuminate --meta took %.1f ms (limit: %.1f ms)' % (meta_median, limit))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(docopt(__doc__)))
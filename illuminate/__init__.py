@@ -1,14 +1,39 @@
-from .interop import InteropDataset, print_sample_dataset
-from .exceptions import InteropFileNotFoundError
-from .metadata import InteropMetadata
-from .base_parser_class import InteropBinParser
-from .tile_metrics import InteropTileMetrics
-from .quality_metrics import InteropQualityMetrics
-from .index_metrics import InteropIndexMetrics
-from .error_metrics import InteropErrorMetrics
-from .control_metrics import InteropControlMetrics
-from .corint_metrics import InteropCorrectedIntensityMetrics
-from .extraction_metrics import InteropExtractionMetrics
+import importlib, sys
+
+from .exceptions import InteropFileNotFoundError, InteropReadError
 
 __version__='0.6.5'
 
+# Public names and the modules defining them. These modules (and numpy and bitstring
+# with them) are only imported when one of their names is first used, which keeps `import illuminate`
+# and the command line quick to start.
+_LAZY_ATTRIBUTES = { 'InteropDataset': '.interop',
+                     'print_sample_dataset': '.interop',
+                     'summarize_runs': '.batch',
+                     'InteropMetadata': '.metadata',
+                     'InteropBinParser': '.base_parser_class',
+                     'InteropTileMetrics': '.tile_metrics',
+                     'InteropQualityMetrics': '.quality_metrics',
+                     'InteropIndexMetrics': '.index_metrics',
+                     'InteropErrorMetrics': '.error_metrics',
+                     'InteropControlMetrics': '.control_metrics',
+                     'InteropCorrectedIntensityMetrics': '.corint_metrics',
+                     'InteropExtractionMetrics': '.extraction_metrics' }
+
+__all__ = ['InteropFileNotFoundError', 'InteropReadError'] + sorted(_LAZY_ATTRIBUTES)
+
+def __getattr__(name):
+    "Imports the module defining public name on first access (see _LAZY_ATTRIBUTES)."
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
+
+if sys.version_info < (3, 7):
+    # no module __getattr__ before python 3.7: import everything up front.
+    for _name in _LAZY_ATTRIBUTES:
+        __getattr__(_name)
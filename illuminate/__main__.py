@@ -1,23 +1,29 @@
 from __future__ import print_function, absolute_import
 
 import os, sys, time
-from bitstring import ReadError
+from functools import partial
 
-from docopt import docopt
-from .interop import InteropDataset 
-from .exceptions import InteropFileNotFoundError
+# docopt, the dataset classes and their dependencies are imported where first needed, 
+# so that e.g. --help or --meta don't pay for importing numpy or bitstring.
+from .exceptions import InteropFileNotFoundError, InteropReadError
 from . import __version__
 
 __doc__="""ILLUMINATE
 
 Usage: illuminate [options] <datapath>
-       illuminate [options] [--csv | --json] <datapath>
+       illuminate [options] [--csv | --json | --jsonl | --parquet | --arrow] <datapath>
+       illuminate batch [options] <rootdir>
+       illuminate inventory [options] [--index-file=<file>] <rootdir>
+       illuminate ingest [options] [--prune] <storefile> <rootdir>
 
 By default, illuminate prints a summary of most commonly desired characteristics rather
 than raw data (e.g. cluster density from --tile, Q30 percentage scores from --quality.)
 
-Raw data can be output to --csv or --json, either to STDOUT or to file(s). If no --outpath
-specified, data will be sent to STDOUT with two newlines separating each metric section.
+Raw data can be output to --csv, --json or --jsonl (JSON Lines), either to STDOUT or to file(s). 
+If no --outpath specified, data will be sent to STDOUT with two newlines separating each metric 
+section. Output is written as it is formatted, a chunk of rows at a time.
+Columnar outputs (--parquet, or --arrow for Arrow IPC / Feather) are written as typed, compressed
+files to --outpath, which they require. They need pyarrow.
 
 The --outpath / -o param should contain an already existing directory which the user has
 permissions to create new directories within.
@@ -31,6 +37,20 @@ produces:  /data/dump/name/quality.metrics.csv, /data/dump/name/extraction.metri
 ...where `name` is either a user-supplied --name parameter or the RunID given by the 
 sequencer (as recorded in RTA_Run_Info).
 
+`illuminate batch` summarizes every run under rootdir (directories holding a RunInfo.xml or 
+an InterOp directory) in --workers processes, printing each run's summary as a line of JSON 
+as soon as it is done (see illuminate.batch.summarize_run).
+
+`illuminate inventory` lists every run under rootdir with its run ID, model, flowcell layout,
+reads and the XML files and InterOp binaries it has (see illuminate.inventory.inventory_run),
+as lines of JSON written to STDOUT or to an index file (--index-file), reading metadata in --workers
+processes. Binaries aren't parsed.
+
+`illuminate ingest` adds summaries of the runs under rootdir to a SQLite summary store 
+(see illuminate.store.SummaryStore), summarizing in --workers processes only those runs that are 
+new to it or have changed since, or that failed last time. --prune also removes the runs it holds 
+from under rootdir that are gone from there.
+
   -h --help             Show this screen.
   --version             Show version.
   -v, --verbose         Increase verbosity           
@@ -38,8 +58,19 @@ sequencer (as recorded in RTA_Run_Info).
   -d, --debug           Increase verbosity and prefix output with Unix timestamps. 
   -i, --interactive     Load dataset into iPython for interactive fun.
   -n --name=name        Set a name for this dataset. [default: meta.runID]
+  --mmap                Read binaries through a memory map rather than into memory.
+  --cache=<cachedir>    Keep decoded binaries in cachedir to skip parsing unchanged ones next time.
+  --numpy               Summarize with numpy only; pandas is loaded just for --csv / --json output.
+  --profile             Afterwards, print time, bytes, records and peak memory of each parser by phase.
+  --watch               Keep watching an active run, re-parsing binaries as they grow and printing 
+                        (or writing) updated output for them. Default metrics: --tile --quality --error
+  --interval=<s>        Seconds between checks for changed binaries with --watch [default: 5]
   
   --all             Parse and print (or dump) everything
+  --workers=<n>     Number of binaries parsed concurrently with --all [default: 4]
+  --index-file=<file>  Write the inventory to an index file rather than STDOUT
+  --prune           Remove runs no longer under rootdir from the summary store
+  --processes       Parse concurrently in worker processes rather than threads
   --meta            Print flowcell_layout and read_config
 
   --tile            Parse tile metrics
@@ -52,6 +83,9 @@ sequencer (as recorded in RTA_Run_Info).
 
   --csv             Output raw data from parser as CSV 
   --json            Output raw data from parser as JSON
+  --jsonl           Output raw data from parser as JSON Lines (a JSON object per row)
+  --parquet         Output raw data from parser as Parquet (to --outpath)
+  --arrow           Output raw data from parser as Arrow IPC / Feather (to --outpath)
   
   -o, --outpath=<outpath> Output parser results to directory
   -t, --timestamp   Generate filename(s) containing Unix timestamps (format: timestamp.metric.format)
@@ -68,6 +102,23 @@ sequencer (as recorded in RTA_Run_Info).
 VERBOSITY = 1
 DEBUG = False
 
+# (codename, InteropDataset accessor, title, option) of each binary, in order of output.
+METRICS = [ ('tile', 'TileMetrics', "TILE METRICS", '--tile'),
+            ('quality', 'QualityMetrics', "QUALITY METRICS", '--quality'),
+            ('index', 'IndexMetrics', "INDEXING METRICS", '--index'),
+            ('error', 'ErrorMetrics', "ERROR METRICS", '--error'),
+            ('corint', 'CorrectedIntensityMetrics', "CORRECTED INTENSITY", '--corint'),
+            ('extraction', 'ExtractionMetrics', "EXTRACTION METRICS", '--extraction'),
+            ('control', 'ControlMetrics', "CONTROL METRICS", '--control') ]
+
+# metrics --watch follows if none are selected.
+WATCH_DEFAULT_METRICS = ['--tile', '--quality', '--error']
+
+# (option, filename suffix) of each output format; parquet and arrow can only be written to --outpath.
+OUTPUT_FORMATS = [ ('--csv', 'csv'), ('--json', 'json'), ('--jsonl', 'jsonl'),
+                   ('--parquet', 'parquet'), ('--arrow', 'arrow') ]
+COLUMNAR_FORMATS = ['parquet', 'arrow']
+
 DEFAULT_FNAME = '%s.%s'  #codename, suffix
 TIMESTAMP_FNAME = '%i.%s.%s'   # timestamp, codename, suffix
 
@@ -94,11 +145,15 @@ def check_output_basedir(loc):
         dmesg('Fatal: %s exists but is not a directory.' % loc, 1)
         sys.exit()
 
+def get_output_format(args):
+    "returns filename suffix of the output format selected in args, or None for printed summaries."
+    for option, suffix in OUTPUT_FORMATS:
+        if args.get(option):
+            return suffix
+    return None
+
 def construct_filename(codename, args):
-    if args['--json']:
-        suffix = 'json'
-    else:
-        suffix = 'csv'
+    suffix = get_output_format(args) or 'csv'
 
     outdir = os.path.join(check_output_basedir(args['--outpath']), args['--name'])
     if not os.path.exists(outdir):
@@ -110,18 +165,22 @@ def construct_filename(codename, args):
         filename = DEFAULT_FNAME % (codename, suffix)
     return os.path.join(outdir, filename)
 
-def write_data(output, codename, args):
+def write_data(writer, codename, args):
+    """streams output of writer(file object) (e.g. parser.write_csv) to the file named by 
+    construct_filename, or to STDOUT without --outpath."""
     if args['--outpath']:
         outpath = construct_filename(codename, args)
-        datafile = open(outpath, 'wb')
+        datafile = open(outpath, 'w')
         try:
-            datafile.write(output+'\n')
+            writer(datafile)
+            datafile.write('\n')
             dmesg('wrote %s' % outpath, 1)
         except(Exception) as e:
             dmesg('Error writing to file: %r' % e, 0)
         datafile.close()
     else:
-        print(output)
+        writer(sys.stdout)
+        sys.stdout.write('\n')
 
 def calculate_verbosity(args):
     global VERBOSITY
@@ -135,7 +194,7 @@ def calculate_verbosity(args):
 def run_metrics_object(InteropObject, title, args):
     dmesg('%s: running' % title, 2)
     try:
-        if args['--csv'] or args['--json']:
+        if get_output_format(args):
             dump(InteropObject, args)
         else:
             dmesg(title, 1)
@@ -143,7 +202,7 @@ def run_metrics_object(InteropObject, title, args):
             dmesg('%s' % InteropObject(), 1)
     except(InteropFileNotFoundError):
         dmesg('%s: File not found\n' % title, 1)
-    except(ReadError):
+    except(InteropReadError):
         dmesg('%s: Data file incomplete or unparseable\n' % title, 1)
 
     dmesg('%s: finished' % title, 2)
@@ -152,19 +211,121 @@ def dump(InteropObject, args):
     try:
         metricobj = InteropObject()
         if args['--csv']:
-            write_data(metricobj.to_csv(), metricobj.codename, args)
+            write_data(metricobj.write_csv, metricobj.codename, args)
         elif args['--json']:
-            write_data(metricobj.to_json(), metricobj.codename, args)
+            write_data(metricobj.write_json, metricobj.codename, args)
+        elif args.get('--jsonl'):
+            write_data(metricobj.write_jsonl, metricobj.codename, args)
+        elif args.get('--parquet'):
+            write_columnar(metricobj.to_parquet, metricobj.codename, args)
+        elif args.get('--arrow'):
+            write_columnar(metricobj.to_arrow, metricobj.codename, args)
 
     except AttributeError:
         dmesg('Metadata has no CSV or JSON output.\n', 2)
 
+def write_columnar(writer, codename, args):
+    "writes a columnar file with writer(path) (e.g. parser.to_parquet) to the file named by construct_filename."
+    outpath = construct_filename(codename, args)
+    try:
+        writer(outpath)
+        dmesg('wrote %s' % outpath, 1)
+    except ImportError as e:
+        dmesg('Error writing to file: %s output needs pyarrow (%s)' % (get_output_format(args), e), 0)
+
 def print_meta(metaobj, args):
     dmesg('Name:   %s' % args['--name'], 1)
     dmesg('Run ID: %s' % metaobj.runID, 1)
     dmesg('%s\n' % metaobj, 1)
 
+def print_profile(ID):
+    "prints the stats (see InteropBinParser.phase) of every parser the dataset has used."
+    from .base_parser_class import format_stats
+    dmesg('PROFILE', 1)
+    dmesg('-------', 1)
+    for attr, codename in ID.parsers:
+        parser = getattr(ID, attr)
+        if parser is not None:
+            dmesg('%s (%s)' % (codename, os.path.basename(parser.filename)), 1)
+            for line in format_stats(parser.stats):
+                dmesg(line, 1)
+
+def watch(ID, args):
+    """polls the dataset's binaries every --interval seconds; re-parses those that changed (only their
+    new records, see InteropBinParser.update) and runs their output again. Stops on Ctrl-C."""
+    interval = float(args['--interval'])
+    selected = [(codename, accessor, title) for codename, accessor, title, option in METRICS
+                if args['--all'] or args[option]]
+    dmesg('watching %s every %g s (Ctrl-C to stop)' % (ID.bindir, interval), 1)
+    try:
+        while True:
+            time.sleep(interval)
+            changed = ID.changed_binaries()
+            updates = [(codename, accessor, title) for codename, accessor, title in selected if codename in changed]
+            if not updates:
+                continue
+            if args['--timestamp']:
+                args['--timestamp'] = timestamp()
+            dmesg('[%s] changed: %s\n' % (time.strftime('%Y-%m-%d %H:%M:%S'), 
+                                          ', '.join(codename for codename, accessor, title in updates)), 1)
+            for codename, accessor, title in updates:
+                run_metrics_object(partial(getattr(ID, accessor), reload=True), title, args)
+    except KeyboardInterrupt:
+        dmesg('stopped watching %s' % ID.bindir, 1)
+
+def run_batch(args):
+    "prints JSON summaries of the runs under <rootdir>, one per line, as they complete."
+    import json
+    from .batch import find_runs, summarize_runs
+    start = time.time()
+    runs = find_runs(args['<rootdir>'])
+    failed = 0
+    for summary in summarize_runs(runs, workers=int(args['--workers']), use_mmap=args['--mmap'], 
+                                  cache_dir=args['--cache']):
+        if summary['error'] or summary['errors']:
+            failed += 1
+        print(json.dumps(summary, sort_keys=True))
+        sys.stdout.flush()
+    if VERBOSITY:
+        sys.stderr.write('summarized %i runs (%i with errors) in %.1f s\n' % (len(runs), failed, time.time() - start))
+
+def run_inventory(args):
+    "prints (or writes to --index-file) inventory entries of the runs under <rootdir>, one per line of JSON."
+    import json
+    from .inventory import scan, write_index
+    start = time.time()
+    entries = scan(args['<rootdir>'], workers=int(args['--workers']))
+    if args['--index-file']:
+        count = write_index(entries, args['--index-file'])
+        dmesg('wrote %s' % args['--index-file'], 1)
+    else:
+        count = 0
+        for entry in entries:
+            print(json.dumps(entry, sort_keys=True))
+            count += 1
+    if VERBOSITY:
+        sys.stderr.write('inventoried %i runs in %.1f s\n' % (count, time.time() - start))
+
+def run_ingest(args):
+    "adds the runs under <rootdir> to the summary store in <storefile>; prints counts of runs ingested."
+    from .store import SummaryStore
+    start = time.time()
+    store = SummaryStore(args['<storefile>'])
+    counts = store.ingest_tree(args['<rootdir>'], workers=int(args['--workers']), prune=args['--prune'],
+                               use_mmap=args['--mmap'])
+    store.close()
+    dmesg('%(added)i added, %(updated)i updated, %(unchanged)i unchanged, %(failed)i failed' % counts, 1)
+    if 'removed' in counts:
+        dmesg('%(removed)i removed' % counts, 1)
+    dmesg('in %.1f s' % (time.time() - start), 2)
+
+def open_dataset(args):
+    from .interop import InteropDataset
+    return InteropDataset(args['<datapath>'], use_mmap=args['--mmap'], cache_dir=args['--cache'],
+                          backend='numpy' if args.get('--numpy') else 'pandas')
+
 def collect_args():
+    from docopt import docopt
     args = docopt(__doc__, version=__version__)
     main(args)
 
@@ -172,14 +333,35 @@ def main(args):
 
     if args['--interactive']:
         from IPython import embed
-        myDataset = InteropDataset(args['<datapath>']) 
+        myDataset = open_dataset(args)
         embed()
         sys.exit()
     else:
         calculate_verbosity(args)
 
+        if args.get('batch'):
+            run_batch(args)
+            return
+        if args.get('inventory'):
+            run_inventory(args)
+            return
+        if args.get('ingest'):
+            run_ingest(args)
+            return
+
+        if get_output_format(args) in COLUMNAR_FORMATS and not args['--outpath']:
+            dmesg('Fatal: --%s output needs an --outpath.' % get_output_format(args), 0)
+            sys.exit(1)
+
+        if args.get('--profile'):
+            try:
+                import tracemalloc
+                tracemalloc.start()
+            except ImportError:
+                pass    # python 2: no peak memory figures.
+
         try:
-            ID = InteropDataset(args['<datapath>'])
+            ID = open_dataset(args)
         except(IOError, e):
             dmesg(e, 1)
             sys.exit()
@@ -187,26 +369,33 @@ def main(args):
         if args['--name']=='meta.runID':
             args['--name'] = ID.meta.runID
 
+        if args.get('--watch'):
+            if not (args['--all'] or any(args[option] for codename, accessor, title, option in METRICS)):
+                for option in WATCH_DEFAULT_METRICS:
+                    args[option] = True
+            # binaries as they are now are parsed below; later changes are picked up by watch().
+            ID.changed_binaries()
+
         if args['--all'] or args['--meta']:
             print_meta(ID.meta, args)
             
         if args['--timestamp']:
             args['--timestamp'] = timestamp()
 
-        if args['--all'] or args['--tile']:
-            run_metrics_object(ID.TileMetrics, "TILE METRICS", args)
-        if args['--all'] or args['--quality']:
-            run_metrics_object(ID.QualityMetrics, "QUALITY METRICS", args)
-        if args['--all'] or args['--index']:
-            run_metrics_object(ID.IndexMetrics, "INDEXING METRICS", args)
-        if args['--all'] or args['--error']:
-            run_metrics_object(ID.ErrorMetrics, "ERROR METRICS", args)
-        if args['--all'] or args['--corint']:
-            run_metrics_object(ID.CorrectedIntensityMetrics, "CORRECTED INTENSITY", args)
-        if args['--all'] or args['--extraction']:
-            run_metrics_object(ID.ExtractionMetrics, "EXTRACTION METRICS", args)
-        if args['--all'] or args['--control']:
-            run_metrics_object(ID.ControlMetrics, "CONTROL METRICS", args)
+        if args['--all']:
+            # parse all binaries up front, concurrently; the printouts below then reuse the parsers.
+            executor = 'process' if args['--processes'] else 'thread'
+            dmesg('loaded %s' % ID.load_all(executor, max_workers=int(args['--workers'])), 2)
+
+        for codename, accessor, title, option in METRICS:
+            if args['--all'] or args[option]:
+                run_metrics_object(getattr(ID, accessor), title, args)
+
+        if args.get('--watch'):
+            watch(ID, args)
+
+        if args.get('--profile'):
+            print_profile(ID)
 
 if __name__=='__main__':
     collect_args()
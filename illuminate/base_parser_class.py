@@ -1,6 +1,14 @@
 # -*- coding: utf-8 -*-
 
-from bitstring import BitString
+import json
+import mmap
+import shutil
+import struct
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy
 try:
     from cStringIO import StringIO
 except(ImportError):
@@ -9,6 +17,14 @@ try:
     from functools import reduce
 except:
     pass
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None      # python 2: no allocation figures in parser stats.
+
+from .exceptions import InteropReadError
+from .cache import load_cached, save_cached
+from .coordinates import TileCoordinates
 
 #### SEQUENCER VAGARIES: flowcell_layout and read_config
 #
@@ -26,41 +42,700 @@ READ_CONFIG_DEFAULTS = [{'read_num': 1, 'cycles': 151, 'is_index': 0},
                         {'read_num': 2, 'cycles': 6, 'is_index': 1}, 
                         {'read_num': 3, 'cycles': 151, 'is_index': 0}]
 
+# Default number of records per chunk yielded by InteropBinParser.iter_chunks()
+DEFAULT_CHUNK_RECORDS = 100000
+
+# Bytes of JSON values per column that write_json() keeps in memory before spilling them to disk.
+JSON_SPOOL_BYTES = 1 << 18
+
+# Forms of parsed data: 'pandas' keeps self.data as a dict of numpy arrays and builds DataFrames
+# and summaries with pandas; 'numpy' keeps self.data as a structured array, computes summaries 
+# with numpy, and only imports pandas if a DataFrame (.df, .idf, to_csv...) is asked for.
+BACKENDS = ('pandas', 'numpy')
+
+# Phases of work that parsers time into parser.stats (see InteropBinParser.phase):
+#   read: reading the binary into memory (or mapping it; pages of a map are then read during decode)
+#   decode: decoding records into arrays, filtering them and putting them in backend form
+#   cache: loading decoded records from (or saving them to) a cache_dir
+#   summarize: _process_data(), e.g. quality cube, tile summaries, index sums
+#   dataframe: building .df
+#   index_frame: building .idf (make_coordinate_plane)
+#   cube: laying fields out as dense arrays (get_cube)
+PHASES = ('read', 'decode', 'cache', 'summarize', 'dataframe', 'index_frame', 'cube')
+
+def new_stats():
+    "Returns empty parser stats: bytes read, records decoded, and per-phase figures (see InteropBinParser.phase)."
+    return { 'bytes': 0, 'records': 0, 'phases': {} }
+
+def format_stats(stats):
+    "Returns parser stats as lines of text: a line per phase, in PHASES order, then a line of totals."
+    lines = []
+    total = 0.0
+    for name in PHASES:
+        phase = stats['phases'].get(name)
+        if phase is None:
+            continue
+        total += phase['seconds']
+        line = '  %-12s %9.4f s %4i call(s)' % (name, phase['seconds'], phase['calls'])
+        if phase['peak_mb'] is not None:
+            line += ' %9.1f MB peak' % phase['peak_mb']
+        lines.append(line)
+    lines.append('  %-12s %9.4f s %12i bytes %10i records' % ('total', total, stats['bytes'], stats['records']))
+    return lines
+
+def is_structured(data):
+    "Returns True if data is a structured array (as opposed to a dict of columns)."
+    return getattr(data, 'dtype', None) is not None and data.dtype.names is not None
+
+def data_columns(data):
+    "Returns list of (name, column) pairs of a dict of columns or a structured array."
+    if is_structured(data):
+        return [(name, data[name]) for name in data.dtype.names]
+    return list(data.items())
+
+def get_field_names(data):
+    "Returns list of the field names of a dict of columns or a structured array."
+    if is_structured(data):
+        return list(data.dtype.names)
+    return list(data.keys())
+
+def concat_chunks(chunks):
+    """Joins a list of chunks (dicts of numpy arrays, as yielded by iter_chunks, or structured arrays) 
+    into one dict of arrays (or one structured array)."""
+    if len(chunks) == 1:
+        return chunks[0]
+    if is_structured(chunks[0]):
+        return numpy.concatenate(chunks)
+    return dict((name, numpy.concatenate([chunk[name] for chunk in chunks])) for name in chunks[0])
+
+def slice_data(data, start, stop, names=None):
+    """Returns records start to stop of a dict of columns or a structured array, as a dict of columns
+    (restricted to names, if given)."""
+    return dict((name, column[start:stop]) for name, column in data_columns(data) if names is None or name in names)
+
+def count_records(data):
+    "Returns number of records in a dict of columns or a structured array (as found in self.data)."
+    if is_structured(data):
+        return len(data)
+    for column in data.values():
+        return len(column)
+    return 0
+
+def dict_to_records(data):
+    "Packs a dict of equal-length columns into a structured array with one field per column."
+    columns = [(name, numpy.asarray(column)) for name, column in data.items()]
+    records = numpy.empty(count_records(data), dtype=[(name, column.dtype) for name, column in columns])
+    for name, column in columns:
+        records[name] = column
+    return records
+
+def make_record_filters(lanes=None, tiles=None, cycles=None):
+    """Returns dict of record field -> sorted tuple of wanted values, for the filters that were given.
+    Each filter may be a single number or any iterable of numbers (e.g. a range of cycles)."""
+    filters = {}
+    for field, values in (('lane', lanes), ('tile', tiles), ('cycle', cycles)):
+        if values is None:
+            continue
+        if numpy.isscalar(values):
+            values = [values]
+        filters[field] = tuple(sorted(set(int(value) for value in values)))
+    return filters
+
+def make_column_selection(columns=None):
+    "Returns sorted tuple of the field names in columns, or None (meaning all fields) if columns is None."
+    if columns is None:
+        return None
+    if isinstance(columns, str):
+        columns = [columns]
+    return tuple(sorted(set(columns)))
+
+# Record layout format of a UTF-8 string preceded by its length in bytes (uint16), as used by
+# the variable-length records of Index and Control metrics.
+STRING = 'str'
+
+_read_string_length = struct.Struct('<H').unpack_from
+
+def scan_records(buf, offset, layout, max_records=None):
+    """Decodes records of variable length from buf, starting at byte offset, until the end of buf or 
+    until max_records complete records have been found. layout is a list of (name, format) tuples 
+    in on-disk order; formats are numpy formats or STRING. 
+
+    A single pass over buf only follows the string lengths to find where each record (and each 
+    string in it) starts. Numeric fields are then gathered from those offsets with numpy. Each 
+    distinct string is decoded once: string columns are object arrays sharing those str objects.
+
+    Returns (dict of numpy arrays, byte offset just past the last complete record)."""
+
+    # Anchor 0 is the start of a record, anchor j the end of its j-th string. Each field sits 
+    # a fixed number of bytes past one of these anchors.
+    numeric_fields = []     # (name, dtype, anchor, delta)
+    string_fields = []      # (name, delta from previous anchor to its length prefix)
+    delta = 0
+    for name, fmt in layout:
+        if fmt == STRING:
+            string_fields.append((name, delta))
+            delta = 0
+        else:
+            numeric_fields.append((name, numpy.dtype(fmt), len(string_fields), delta))
+            delta += numpy.dtype(fmt).itemsize
+    trailing = delta
+
+    end = len(buf)
+    anchors = [[] for _ in range(len(string_fields) + 1)]
+    codes = [[] for _ in string_fields]
+    tables = [{} for _ in string_fields]
+
+    count = 0
+    pos = offset
+    while max_records is None or count < max_records:
+        record_anchors = [pos]
+        record_codes = []
+        for j, (name, delta) in enumerate(string_fields):
+            length_pos = record_anchors[-1] + delta
+            if length_pos + 2 > end:
+                break
+            start = length_pos + 2
+            stop = start + _read_string_length(buf, length_pos)[0]
+            if stop > end:
+                break
+            record_codes.append(tables[j].setdefault(buf[start:stop], len(tables[j])))
+            record_anchors.append(stop)
+        else:
+            if record_anchors[-1] + trailing <= end:
+                for j, anchor in enumerate(record_anchors):
+                    anchors[j].append(anchor)
+                for j, code in enumerate(record_codes):
+                    codes[j].append(code)
+                pos = record_anchors[-1] + trailing
+                count += 1
+                continue
+        # incomplete record: the binary is still being written (or truncated).
+        break
+
+    data = {}
+    raw = numpy.frombuffer(buf, dtype=numpy.uint8) if end else numpy.zeros(0, dtype=numpy.uint8)
+    for name, dtype, anchor, delta in numeric_fields:
+        starts = numpy.array(anchors[anchor], dtype=numpy.intp) + delta
+        column = raw[starts[:, None] + numpy.arange(dtype.itemsize)]
+        data[name] = column.view(dtype).ravel().astype(dtype.newbyteorder('='))
+    for j, (name, delta) in enumerate(string_fields):
+        strings = sorted(tables[j], key=tables[j].get)
+        categories = numpy.empty(len(strings), dtype=object)
+        categories[:] = [string.decode('utf-8') for string in strings]
+        data[name] = categories[numpy.array(codes[j], dtype=numpy.intp)]
+    del raw
+
+    # keep layout order, as for fixed-length records.
+    return dict((name, data[name]) for name, fmt in layout), pos
+
+def encode_records(layout, data, recordlen=None):
+    """Inverse of decode_records() and scan_records(): returns the bytes of the records in data (a dict
+    of columns or a structured array) as laid out on disk by layout, a list of (name, format) tuples.
+    Fixed-length records are zero-padded to recordlen bytes if given. Used to write test binaries."""
+    count = count_records(data)
+
+    if STRING not in [fmt for name, fmt in layout]:
+        names, formats, offsets = [], [], []
+        offset = 0
+        for name, fmt in layout:
+            names.append(name)
+            formats.append(fmt)
+            offsets.append(offset)
+            offset += numpy.dtype(fmt).itemsize
+        dtype = numpy.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                             'itemsize': max(offset, recordlen or 0)})
+        records = numpy.zeros(count, dtype=dtype)
+        for name in names:
+            records[name] = data[name]
+        return records.tobytes()
+
+    # variable-length records: join the bytes of each field record by record.
+    fields = []
+    for name, fmt in layout:
+        if fmt == STRING:
+            strings = [value if isinstance(value, bytes) else value.encode('utf-8') for value in data[name]]
+            fields.append([struct.pack('<H', len(value)) + value for value in strings])
+        else:
+            raw = numpy.asarray(data[name], dtype=fmt).tobytes()
+            size = numpy.dtype(fmt).itemsize
+            fields.append([raw[i*size:(i+1)*size] for i in range(count)])
+    return b''.join(b''.join(record) for record in zip(*fields))
+
 class InteropBinParser(object):
     "Generic binary parser for ILMN files typically found in InterOp directory. Subclass (do not use directly)."
 
-    __version = 0.6      # version of this base class
+    __version = 0.7      # version of this base class
+
+    # Parsers of fixed-length records only need to declare their record layout as a list of 
+    # (field name, numpy format) tuples in on-disk order, e.g. [('lane', '<u2'), ('value', '<f4')].
+    # The whole record block is then decoded in one go by decode_records(). Parsers whose 
+    # layout depends on the file version override get_record_layout() instead.
+    #
+    # Parsers of variable-length records (Index, Control) include STRING fields in their layout
+    # (so records are decoded by scan_records()) and override parse_header().
+    record_layout = None
+
+    # Fields this parser's summaries need in self.df; decoded even when columns= leaves them out.
+    required_columns = ()
 
     def __init__(self, bitstring_or_filename, **kwargs):
-        "Takes either a filename or a BitString object. Optional: flowcell_layout {}, read_config [{},]"
+        """Takes either a filename or a BitString object. Optional: flowcell_layout {}, read_config [{},]
+
+        use_mmap=True reads the binary through a read-only memory map, so records are decoded as 
+        zero-copy views of the mapped file instead of from an in-memory copy of it. The map is 
+        released once parsing is done.
+
+        parse=False skips parsing at instantiation; records can then be streamed with iter_chunks().
+
+        cache_dir=path keeps decoded records of binaries read from file in that directory; later 
+        parses of an unchanged binary memory-map them from there instead of decoding (see cache.py).
+
+        lanes=, tiles=, cycles= (a number or an iterable of numbers each) keep only the matching 
+        records. They are applied to the raw records as they are decoded, before anything else 
+        is built from them. Filters on fields a binary doesn't have (e.g. cycles for TileMetrics) 
+        are ignored.
+
+        columns=[field names] limits the fields decoded into .data and .df to those named, plus 
+        any the parser's summaries need (required_columns). Other fields are never read from 
+        the binary.
+
+        backend='numpy' keeps .data as a structured array and computes summaries without pandas, 
+        which is then only imported if .df or .idf (or an output built from them) is asked for.
+        The default backend='pandas' builds them as soon as the binary is parsed.
+
+        Time spent in each phase of work (reading, decoding, summarizing, building DataFrames...), 
+        bytes read and records decoded add up in .stats over the life of the parser (see phase()).
+        stats_callback=func is called as func(parser, phase name, seconds, peak MB) after each phase."""
 
         self.flowcell_layout = kwargs.get('flowcell_layout', FLOWCELL_LAYOUT_DEFAULTS)
         self.read_config = kwargs.get('read_config', READ_CONFIG_DEFAULTS)
+        self.use_mmap = kwargs.get('use_mmap', False)
+        self.cache_dir = kwargs.get('cache_dir', None)
+        self.filters = make_record_filters(kwargs.get('lanes'), kwargs.get('tiles'), kwargs.get('cycles'))
+        self.columns = make_column_selection(kwargs.get('columns'))
+        self.backend = kwargs.get('backend', 'pandas')
+        if self.backend not in BACKENDS:
+            raise ValueError("backend must be one of %s, not %r" % (', '.join(BACKENDS), self.backend))
+        self.stats = new_stats()
+        self.stats_callback = kwargs.get('stats_callback', None)
+        self._phase_stack = []
 
         # see if it's a filename or a bitstring (aka bitstream)
         try:
             bitstring_or_filename.all(1)    # attempts to perform the "are these bits all 1s" method
-            self.bs = bitstring_or_filename
+            self.filename = None
+            self._bs = bitstring_or_filename
+            self.buf = bitstring_or_filename.tobytes()
         except AttributeError:              # assume it's a filename, then.
-            self.bs = BitString(bytes=open(bitstring_or_filename, 'rb').read())
-            
+            self.filename = bitstring_or_filename
+            self._bs = None
+            self.buf = None                 # read (or mapped) when first needed.
+
+        # byte offset just past the last record parsed (None until parsing starts); see update().
+        self.offset = None
+
+        # DataFrames of self.data, built on first access (see df and idf), and its tile coordinates.
+        self._df = None
+        self._idf = None
+        self._coords = None
 
         self.num_tiles = reduce(lambda x, y: x*y, self.flowcell_layout.values())
         self.num_reads = len(self.read_config)
 
         self._init_variables()
 
-        if self.bs is None:
-            raise Exception("bitstring empty; cannot parse metrics for %s" % self.__class__.__name__)
-        else:
+        if kwargs.get('parse', True):
             self.parse_binary() 
 
+            if self.use_mmap:
+                # decoded columns are copies, so the mapping is no longer needed.
+                self.close()
+
+    def _read_file(self, filename, use_mmap=False):
+        "Returns contents of filename as bytes, or as a read-only mmap if use_mmap is set."
+        with open(filename, 'rb') as fh:
+            if not use_mmap:
+                return fh.read()
+            try:
+                return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty files cannot be mapped.
+                return b''
+
+    def load(self, use_mmap=None):
+        "Makes the raw binary available as self.buf (reading or mapping the file if necessary) and returns it."
+        if self.buf is None:
+            if self.filename is None:
+                raise Exception("bitstring empty; cannot parse metrics for %s" % self.__class__.__name__)
+            with self.phase('read'):
+                self.buf = self._read_file(self.filename, self.use_mmap if use_mmap is None else use_mmap)
+            self.stats['bytes'] += len(self.buf)
+        return self.buf
+
+    def close(self):
+        """Drops this parser's reference to the raw binary. A memory map is unmapped as soon as 
+        no decoded views of it remain."""
+        self.buf = None
+        self._bs = None
+
+    def __getstate__(self):
+        "Pickles parsed results without the raw binary (which may be a memory map), e.g. for process pools."
+        state = self.__dict__.copy()
+        state['buf'] = None
+        state['_bs'] = None
+        state['stats_callback'] = None
+        return state
+
+    @property
+    def bs(self):
+        """BitString of the binary, created on first use (only variable-length parsers need it).
+        Note that this is a copy of the binary even when use_mmap is set."""
+        if self._bs is None:
+            from bitstring import BitString
+            self._bs = BitString(bytes=self.load())
+        return self._bs
+
     def parse_binary(self):
-        "Stub method for binary parsing."
-        print("""InteropBinParser: Generic Binary Parser class
+        """Consumes iter_chunks() in a single chunk to fill self.data with one numpy array per field, 
+        then hands off to _process_data() to build the DataFrame(s) and summaries.
+        With a cache_dir, decoded records are taken from (or saved to) the cache."""
+        use_cache = self.cache_dir is not None and self.filename is not None
+
+        cached = False
+        if use_cache:
+            with self.phase('cache'):
+                cached = load_cached(self, self.cache_dir)
+        if not cached:
+            self.load()
+        with self.phase('decode'):
+            if cached:
+                # the cache holds all records and fields.
+                self.data = self.project_fields(self.filter_records(self.data))
+            else:
+                self.data = concat_chunks(list(self.iter_chunks(None)))
+                if use_cache and not self.filters and self.columns is None:
+                    with self.phase('cache'):
+                        save_cached(self, self.cache_dir)
+            self.data = self.make_data(self.data)
+        self.stats['records'] += count_records(self.data)
+        self._build_results()
+
+    def iter_chunks(self, n_records=DEFAULT_CHUNK_RECORDS, as_frame=False):
+        """Returns a generator yielding the binary's records n_records at a time (all at once if n_records 
+        is None), each chunk being a dict of numpy arrays shaped like self.data, or a DataFrame if as_frame=True.
+
+        Unless the binary was already loaded, the file is read through a memory map, so chunks can be 
+        aggregated in bounded memory. An empty binary yields a single empty chunk."""
+
+        self.load(use_mmap=True)
+        self.header_len = self.parse_header()
+        self._header = bytes(self.buf[:self.header_len])
+        self.offset = self.header_len
+        return self._iter_records(self.buf, self.header_len, n_records, as_frame)
+
+    def _iter_records(self, buf, offset, n_records=None, as_frame=False):
+        """Generator decoding records from buf, starting at byte offset, n_records at a time. Keeps 
+        self.offset at the byte offset just past the last complete record yielded."""
+
+        layout = self.get_record_layout()
+        if STRING in [fmt for name, fmt in layout]:
+            for chunk in self._iter_variable_records(buf, offset, layout, n_records, as_frame):
+                yield chunk
+            return
 
-        Override this method with your own parsing method.
-        """)
+        records = self.decode_records(offset, self.recordlen, buf)
+
+        if n_records is None:
+            n_records = max(len(records), 1)
+
+        for start in range(0, max(len(records), 1), n_records):
+            chunk = records[start:start+n_records]
+            self.offset = offset + (start + len(chunk)) * self.recordlen
+            yield self._make_chunk(self.records_to_dict(self.filter_records(chunk)), as_frame)
+
+    def _iter_variable_records(self, buf, offset, layout, n_records=None, as_frame=False):
+        "Generator version of scan_records() for _iter_records(); yields at least one (maybe empty) chunk."
+        yielded = False
+        while True:
+            chunk, end = scan_records(buf, offset, layout, n_records)
+            if end == offset and yielded:
+                break
+            self.offset = offset = end
+            yield self._make_chunk(self.filter_records(chunk), as_frame)
+            yielded = True
+            if n_records is None or count_records(chunk) < n_records:
+                break
+
+    def update(self):
+        """Parses only the records appended to the binary since it was last parsed (as happens during
+        an active run), extends self.data with them and recomputes the parser's summaries. 
+        Returns the number of new records.
+
+        Falls back to a full re-parse if the binary looks like it was replaced rather than appended to."""
+
+        if self.filename is None:
+            return 0
+
+        # mapping the file means only the pages holding new records get read from disk.
+        buf = self._read_file(self.filename, use_mmap=True)
+
+        if self.offset is None or len(buf) < self.offset or bytes(buf[:self.header_len]) != self._header:
+            self.close()
+            self._init_variables()
+            self.parse_binary()
+            if self.use_mmap:
+                self.close()
+            return count_records(self.data)
+
+        self.stats['bytes'] += len(buf) - self.offset
+        with self.phase('decode'):
+            new_data = concat_chunks(list(self._iter_records(buf, self.offset)))
+            count = count_records(new_data)
+            if count:
+                self.data = concat_chunks([self.data, self.make_data(new_data)])
+        self.stats['records'] += count
+        if count:
+            # summaries are vectorized over the extended arrays, so recomputing them is cheap next to decoding.
+            self._build_results()
+        return count
+
+    def has_selection(self, lanes=None, tiles=None, cycles=None, columns=None):
+        "Returns True if this parser was built with exactly these record filters and columns."
+        return self.filters == make_record_filters(lanes, tiles, cycles) and \
+               self.columns == make_column_selection(columns)
+
+    def filter_records(self, records):
+        """Returns the records (a structured array, or a dict of arrays) matching this parser's 
+        lanes/tiles/cycles filters. Returns records untouched if there are no filters."""
+        fields = records.dtype.names if hasattr(records, 'dtype') else records.keys()
+        filters = [(field, values) for field, values in self.filters.items() if field in fields]
+        if not filters:
+            return records
+
+        mask = numpy.ones(len(records[filters[0][0]]), dtype=bool)
+        for field, values in filters:
+            mask &= numpy.in1d(records[field], values)
+
+        if hasattr(records, 'dtype'):
+            return records[mask]
+        return dict((name, numpy.asarray(column)[mask]) for name, column in records.items())
+
+    def get_frame_columns(self):
+        "Returns set of field names going into self.df, or None for all of them."
+        if self.columns is None:
+            return None
+        return set(self.columns) | set(self.required_columns)
+
+    def get_decode_columns(self):
+        """Returns set of field names to decode from the binary, or None for all of them: those going 
+        into self.df, plus those needed to apply filters."""
+        frame_columns = self.get_frame_columns()
+        if frame_columns is None:
+            return None
+        return frame_columns | set(self.filters)
+
+    def project_fields(self, chunk):
+        "Returns dict of columns restricted to the fields to be decoded."
+        names = self.get_decode_columns()
+        if names is None:
+            return chunk
+        return dict((name, column) for name, column in chunk.items() if name in names)
+
+    def _make_chunk(self, chunk, as_frame=False):
+        "Applies per-record processing to a freshly decoded chunk, optionally turning it into a DataFrame."
+        chunk = self.project_fields(chunk)
+        chunk = self._process_chunk(chunk)
+        if as_frame:
+            return self.make_dataframe(chunk)
+        return chunk
+
+    def _process_chunk(self, chunk):
+        "Place to transform decoded columns record-by-record (e.g. timestamps). Returns the chunk."
+        return chunk
+
+    def make_data(self, data):
+        "Returns decoded columns (a dict of arrays) in the form self.data takes with this parser's backend."
+        if self.backend == 'numpy':
+            return dict_to_records(data)
+        return data
+
+    def _build_results(self):
+        """Drops DataFrames of earlier data and hands off to _process_data() for the summaries.
+        With the pandas backend, DataFrames are then built right away."""
+        self._df = None
+        self._idf = None
+        self._coords = None
+        with self.phase('summarize'):
+            self._process_data()
+        if self.backend == 'pandas':
+            self._df = self.df
+            with self.phase('index_frame'):
+                self._idf = self.make_index_frame()
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager timing the work done inside it into self.stats['phases'][name]: seconds 
+        (less those of phases nested inside it), number of calls and peak MB allocated above what was 
+        allocated at its start. Peaks are only measured while tracemalloc is tracing (None otherwise).
+        Then calls stats_callback, if any."""
+        tracing = tracemalloc is not None and tracemalloc.is_tracing()
+        if tracing and self._phase_stack and hasattr(tracemalloc, 'reset_peak'):
+            # the peak is reset below, so keep the enclosing phase's peak so far.
+            parent = self._phase_stack[-1]
+            parent['peak'] = max(parent['peak'], tracemalloc.get_traced_memory()[1])
+        if tracing and hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        frame = { 'start': time.time(), 'nested': 0.0, 'peak': 0,
+                  'memory': tracemalloc.get_traced_memory()[0] if tracing else 0 }
+        self._phase_stack.append(frame)
+        try:
+            yield
+        finally:
+            self._phase_stack.pop()
+            elapsed = time.time() - frame['start']
+            if self._phase_stack:
+                self._phase_stack[-1]['nested'] += elapsed
+
+            peak_mb = None
+            if tracing:
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                peak_mb = max(peak - frame['memory'], 0) / 1e6
+
+            stats = self.stats['phases'].setdefault(name, { 'seconds': 0.0, 'calls': 0, 'peak_mb': None })
+            stats['seconds'] += elapsed - frame['nested']
+            stats['calls'] += 1
+            if peak_mb is not None:
+                stats['peak_mb'] = max(stats['peak_mb'] or 0, peak_mb)
+            if self.stats_callback is not None:
+                self.stats_callback(self, name, elapsed - frame['nested'], peak_mb)
+
+    @property
+    def df(self):
+        """DataFrame of self.data (restricted to the selected columns). With backend='numpy' it is 
+        built (and pandas imported) on first access."""
+        if self._df is None:
+            with self.phase('dataframe'):
+                self._df = self.make_dataframe(self.data)
+        return self._df
+
+    @df.setter
+    def df(self, df):
+        self._df = df
+
+    @property
+    def idf(self):
+        "DataFrame indexed by coordinates (see make_coordinate_plane), for parsers that have one."
+        if self._idf is None:
+            with self.phase('index_frame'):
+                self._idf = self.make_index_frame()
+            if self._idf is None:
+                raise AttributeError("%s has no coordinate plane (.idf)" % self.__class__.__name__)
+        return self._idf
+
+    @idf.setter
+    def idf(self, idf):
+        self._idf = idf
+
+    @property
+    def coords(self):
+        """TileCoordinates (see coordinates.py) of self.data: its flowcell_layout and read_config, plus
+        any lanes, tiles or cycles of the records beyond them. Worked out on first access."""
+        if self._coords is None:
+            self._coords = TileCoordinates(self.flowcell_layout, self.read_config,
+                                           lanes=self.data['lane'], tiles=self.data['tile'],
+                                           cycles=self.data['cycle'] if 'cycle' in get_field_names(self.data) else None)
+        return self._coords
+
+    def get_cube(self, fields, fill=numpy.nan, add=False):
+        """Returns dense numpy array (cycle x lane x tile) of field `fields` of self.data, laid out on
+        .coords, or (cycle x lane x tile x field) of a list of fields (e.g. one per channel). Slots
+        without records hold fill; several records in one slot are summed with add=True (otherwise the
+        last one stays). Slice it by read, lane, tile, surface or swath with self.coords.select()."""
+        if 'cycle' not in get_field_names(self.data):
+            raise ValueError("%s records have no cycle to lay out a cube on" % self.__class__.__name__)
+        if isinstance(fields, (list, tuple)):
+            values = numpy.column_stack([self.data[name] for name in fields]) if fields \
+                        else numpy.zeros((count_records(self.data), 0))
+        else:
+            values = self.data[fields]
+        with self.phase('cube'):
+            return self.coords.make_array(self.data['lane'], self.data['tile'], self.data['cycle'],
+                                          values, fill=fill, add=add)
+
+    def make_index_frame(self):
+        "Override to return the DataFrame served as .idf; parsers without one return None."
+        return None
+
+    def make_dataframe(self, data):
+        "Returns a DataFrame built from self.data or a chunk of it (restricted to the selected columns)."
+        import pandas
+        names = self.get_frame_columns()
+        data = dict((name, column) for name, column in data_columns(data) if names is None or name in names)
+        return pandas.DataFrame(data)
+
+    def parse_header(self):
+        """Reads file version (byte 0) and record length (byte 1) into apparent_file_version and 
+        recordlen; returns the length of the header in bytes. Override for longer headers."""
+        self.apparent_file_version, self.recordlen = self.read_bytes(0, 2)
+        self.check_version(self.apparent_file_version)
+        return 2
+
+    def read_bytes(self, offset, count):
+        "Returns list of count unsigned bytes starting at offset. Raises InteropReadError past end of data."
+        if offset + count > len(self.buf):
+            raise InteropReadError("[%s] Binary too short to read %i byte(s) at offset %i" % 
+                                   (self.__class__.__name__, count, offset))
+        return list(struct.unpack_from('<%iB' % count, self.buf, offset))
+
+    def get_record_layout(self):
+        "Returns list of (name, format) tuples describing one record. Override for version-dependent layouts."
+        return self.record_layout
+
+    def record_dtype(self, recordlen):
+        """Maps the record layout onto a numpy structured dtype whose itemsize is the record length 
+        declared in the binary's header (so any trailing bytes we don't know about are skipped).
+        Fields that aren't to be decoded (see columns=) are left out, so they're skipped too."""
+        decode_columns = self.get_decode_columns()
+        names, formats, offsets = [], [], []
+        offset = 0
+        for name, fmt in self.get_record_layout():
+            if decode_columns is None or name in decode_columns:
+                names.append(name)
+                formats.append(fmt)
+                offsets.append(offset)
+            offset += numpy.dtype(fmt).itemsize
+
+        if offset > recordlen:
+            raise InteropReadError("[%s] Record length %i in header is shorter than expected layout (%i bytes)" %
+                                   (self.__class__.__name__, recordlen, offset))
+
+        return numpy.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': recordlen})
+
+    def decode_records(self, offset, recordlen, buf=None):
+        """Decodes all complete records in buf (default: self.buf) from offset onward in a single 
+        numpy.frombuffer call. Returns a structured array (a view onto buf). Incomplete trailing 
+        records are ignored."""
+        if buf is None:
+            buf = self.buf
+        dtype = self.record_dtype(recordlen)
+        count = max(len(buf) - offset, 0) // recordlen
+        return numpy.frombuffer(buf, dtype=dtype, count=count, offset=offset)
+
+    def records_to_dict(self, records):
+        """Splits a structured array of records into a dict of (contiguous, native-endian) numpy arrays, 
+        one per field. Floats are widened to float64 so that sums and means keep full precision."""
+        out = {}
+        for name in records.dtype.names:
+            column = records[name]
+            if column.dtype.kind == 'f':
+                out[name] = column.astype(numpy.float64)
+            else:
+                out[name] = column.astype(column.dtype.newbyteorder('='))
+        return out
+
+    def _process_data(self):
+        "Place to build DataFrames and summaries from self.data once records are decoded."
+        pass
         
     def _init_variables(self):
         "Place to initialize the instance variables required by specific parsers."
@@ -74,59 +749,164 @@ class InteropBinParser(object):
 
     def make_coordinate_plane(self, df, flatten=False):
         """Rework a dataframe containing lane / tile / cycle columns into a new dataframe using 
-           lane-tile-cycle as a combined index -- sort of a coordinate plane."""
-           
-        if flatten:
-            df = df.copy()
-            # recast the coordinate system as a descriptive index composed like so:
-            # cycle * 1000000 + lane * 10000 + tile
-            
-            df.lane = df.lane.mul(10000)
-            df.cycle = df.cycle.mul(1000000)
+           lane-tile-cycle as a combined index -- sort of a coordinate plane.
 
-            # ...that way the index stays human-readable and still easily sorted and sliced.
+           With flatten=True, the index is a single integer composed like so:
+           cycle * 1000000 + lane * 10000 + tile
+           ...that way the index stays human-readable and still easily sorted and sliced.
 
-        idf = df.set_index(['cycle','lane','tile'])
+           Rows are put in order with numpy on the coordinate columns, rather than by sorting the index."""
+        import pandas
 
+        cycle, lane, tile = [numpy.asarray(df[name], dtype=numpy.int64) for name in ('cycle', 'lane', 'tile')]
         if flatten:
-            idf.index = idf.index.map(sum)
+            key = cycle * 1000000 + lane * 10000 + tile
+            order = numpy.argsort(key, kind='mergesort')
+            idf = df.drop(['cycle', 'lane', 'tile'], axis=1).take(order)
+            idf.index = pandas.Index(key[order])
+            return idf
 
-        return idf.sort_index()
+        order = numpy.lexsort((tile, lane, cycle))
+        return df.take(order).set_index(['cycle', 'lane', 'tile'])
 
     def to_dict(self):
         "Parser subclasses should override this, make it more specifically relevant."
         return self.data
 
+    def iter_frames(self, n_records=DEFAULT_CHUNK_RECORDS, columns=None):
+        """Generator yielding the rows of .df n_records at a time, as DataFrames indexed by row number 
+        (restricted to columns, if given). Unless .df was already built, each is built from its slice 
+        of self.data, so the whole DataFrame never needs to exist."""
+        import pandas
+        count = count_records(self.data)
+        for start in range(0, max(count, 1), n_records):
+            stop = min(start + n_records, count)
+            if self._df is not None:
+                frame = self._df.iloc[start:stop]
+                if columns is not None:
+                    frame = frame[columns]
+            else:
+                frame = self.make_dataframe(slice_data(self.data, start, stop, columns))
+                frame.index = pandas.RangeIndex(start, stop)
+            yield frame
+
+    def get_frame_column_order(self):
+        "Returns list of the columns of .df, in order."
+        if self._df is not None:
+            return list(self._df.columns)
+        return list(self.make_dataframe(slice_data(self.data, 0, 0)).columns)
+
+    def write_csv(self, fh, n_records=DEFAULT_CHUNK_RECORDS):
+        """Writes the rows of .df to file object fh as comma-separated values, n_records at a time.
+        First line contains row headers; first column ('line') the row number."""
+        for num, frame in enumerate(self.iter_frames(n_records)):
+            frame.to_csv(fh, header=num == 0, index_label='line')
+
+    def write_json(self, fh, n_records=DEFAULT_CHUNK_RECORDS):
+        """Writes .df to file object fh as a json document ({column: {row number: value}}, as to_json()).
+        Each chunk of n_records rows is built once; the values of each of its columns are appended to a
+        temporary file per column (in memory up to JSON_SPOOL_BYTES), which are then copied to fh."""
+        names = self.get_frame_column_order()
+        spools = [tempfile.SpooledTemporaryFile(max_size=JSON_SPOOL_BYTES, mode='w+') for name in names]
+        try:
+            for frame in self.iter_frames(n_records):
+                for name, spool in zip(names, spools):
+                    # '{"0":...,"1":...}' -> its values, joined to those of the previous chunk.
+                    values = frame[name].to_json()[1:-1]
+                    if values:
+                        spool.write(',' + values if spool.tell() else values)
+
+            fh.write('{')
+            for num, (name, spool) in enumerate(zip(names, spools)):
+                fh.write('%s%s:{' % (',' if num else '', json.dumps(name)))
+                spool.seek(0)
+                shutil.copyfileobj(spool, fh)
+                fh.write('}')
+            fh.write('}')
+        finally:
+            for spool in spools:
+                spool.close()
+
+    def write_jsonl(self, fh, n_records=DEFAULT_CHUNK_RECORDS):
+        "Writes the rows of .df to file object fh as JSON Lines (one object per row), n_records at a time."
+        for frame in self.iter_frames(n_records):
+            if len(frame):
+                lines = frame.to_json(orient='records', lines=True)
+                fh.write(lines if lines.endswith('\n') else lines + '\n')
+
     def to_csv(self):
         """Transforms object's DataFrame into comma-separated / newline delineated data. 
         First line contains row headers.
         """ 
         output = StringIO()
-        self.df.to_csv(output, index_label='line')
+        self.write_csv(output)
         return output.getvalue()
 
     def to_json(self):
         "Transforms object's DataFrame into a json document."
-        return self.df.to_json()
+        if self._df is not None:
+            return self._df.to_json()
+        output = StringIO()
+        self.write_json(output)
+        return output.getvalue()
+
+    def to_arrow(self, path=None, compression='lz4'):
+        """Returns a pyarrow Table of self.data (restricted to the selected columns), keeping the types
+        of its numpy columns. Built from the columns directly, so pandas isn't needed. Strings (e.g. 
+        index sequences), which repeat a lot, are dictionary-encoded.
 
-def make_test_data(codename, infile, outfile, n=1):
-    '''Takes a "complete" binary source and returns a bitstring suitable
-        for creating a much smaller, parsable binary suitable for testing.
+        With path, also writes the table there as an Arrow IPC (Feather v2) file, compressed with
+        compression ('lz4', 'zstd' or 'uncompressed'). Requires pyarrow."""
+        import pyarrow
+        names = self.get_frame_columns()
+        columns = [(name, column) for name, column in data_columns(self.data) if names is None or name in names]
+        arrays = []
+        for name, column in columns:
+            column = numpy.ascontiguousarray(column)
+            if column.dtype == object:
+                arrays.append(pyarrow.array(column, type=pyarrow.string()).dictionary_encode())
+            else:
+                arrays.append(pyarrow.array(column))
+        table = pyarrow.Table.from_arrays(arrays, names=[name for name, column in columns])
+        if path is not None:
+            from pyarrow import feather
+            feather.write_feather(table, path, compression=compression)
+        return table
 
-    Currently supported metrics: 'quality'
+    def to_parquet(self, path, compression='snappy'):
+        """Writes the table of to_arrow() to path as a Parquet file, compressed with compression
+        ('snappy', 'zstd', 'gzip' or 'none'). Returns path. Requires pyarrow."""
+        from pyarrow import parquet
+        parquet.write_table(self.to_arrow(), path, compression=compression)
+        return path
+
+def make_test_data(codename, infile=None, outfile=None, n=1, **kwargs):
+    '''Writes a small binary suitable for testing and returns its path.
+
+    With infile, the binary is the header and first n records of that "complete" binary.
+    Without, it is a synthetic binary of any supported version, flowcell layout and read config
+    (see synthetic.make_binary, which takes the keyword arguments).
 
     :param codename: (required) metrics codename (e.g. 'tile', 'quality')
-    :param infile: (required) path to file to be used as source data.
-    :param outfile: (optional) path to file to be written (default: ./QualityMetricsTest.bin)
-    :param n: (optional) integer describing number of complete records to write.
+    :param infile: (optional) path to file to be used as source data.
+    :param outfile: (optional) path to file to be written (default: ./<codename>MetricsTest.bin)
+    :param n: (optional) integer describing number of complete records to copy from infile.
     '''
-    record_length = { 'quality': 153730 }
+    from .interop import get_parser_class
+    from .synthetic import make_binary
+
+    if outfile is None:
+        outfile = '%sMetricsTest.bin' % codename.capitalize()
 
-    bs = BitString(bytes=open(infile, 'rb').read())
+    if infile is None:
+        binary = make_binary(codename, **kwargs)[0]
+    else:
+        parser = get_parser_class(codename)(infile, parse=False)
+        next(parser.iter_chunks(n))
+        binary = bytes(parser.buf[:parser.offset])
+        parser.close()
 
-    buf = bs.read(record_length[codename] * n)
-    outbin = open(outfile, 'wb')
-    buf.tofile(outbin)
-    outbin.close()
+    with open(outfile, 'wb') as outbin:
+        outbin.write(binary)
 
     return outfile
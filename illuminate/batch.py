@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+#
+# Batch summaries of many runs.
+#
+# summarize_runs() fans run directories out over a pool of worker processes. Each worker parses
+# a run's binaries (with the numpy backend, so no DataFrames get built) and hands back only a small
+# dict of plain python values, which the parent yields as soon as it arrives.
+
+import multiprocessing, os, time
+
+import numpy
+
+from .exceptions import InteropFileNotFoundError
+from .filemaps import BINFILE_DIR_NAME, XML_FILEMAP
+from .interop import InteropDataset
+
+# keyword arguments of the InteropDataset of each run, unless given otherwise.
+DEFAULT_DATASET_KWARGS = { 'backend': 'numpy' }
+
+
+def find_runs(rootdir):
+    """Returns sorted list of the run directories under rootdir (rootdir itself included): those
+    holding a RunInfo.xml or an InterOp directory. Directories within a run aren't searched."""
+    runs = []
+    for dirpath, dirnames, filenames in os.walk(rootdir):
+        if BINFILE_DIR_NAME in dirnames or XML_FILEMAP['runinfo'][0] in filenames:
+            runs.append(dirpath)
+            dirnames[:] = []
+        else:
+            dirnames.sort()
+    return sorted(runs)
+
+def to_builtin(value):
+    "Returns value with numpy scalars and arrays (also within dicts, lists and tuples) turned into python ones."
+    if isinstance(value, dict):
+        return dict((to_builtin(key), to_builtin(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [to_builtin(item) for item in value]
+    if isinstance(value, (numpy.generic, numpy.ndarray)):
+        return value.tolist()
+    return value
+
+def get_read_numbers(cycles, read_config):
+    "returns index into read_config of the read of each of cycles (numbered from 1), len(read_config) past the last."
+    tiers = numpy.cumsum([read['cycles'] for read in read_config])
+    return numpy.searchsorted(tiers, numpy.asarray(cycles) - 1, side='right')
+
+def summarize_error(parser):
+    "Mean error rate (%) of the run, of each lane and of each read (by index into read_config)."
+    rate = numpy.asarray(parser.data['rate'], dtype=numpy.float64)
+    lanes = numpy.asarray(parser.data['lane'])
+    reads = get_read_numbers(parser.data['cycle'], parser.read_config)
+    return { 'mean_rate': rate.mean() if len(rate) else None,
+             'lanes': dict((lane, rate[lanes == lane].mean()) for lane in numpy.unique(lanes)),
+             'reads': dict((num, rate[reads == num].mean()) for num in numpy.unique(reads)
+                           if num < len(parser.read_config)) }
+
+# (key of the summary, InteropDataset accessor, function of the parser returning its summary).
+SUMMARIES = [ ('tile', 'TileMetrics', lambda parser: parser.to_dict()),
+              ('quality', 'QualityMetrics', lambda parser: parser.to_dict()),
+              ('index', 'IndexMetrics', lambda parser: parser.to_dict()),
+              ('error_rate', 'ErrorMetrics', summarize_error) ]
+
+def describe_error(error):
+    return '%s: %s' % (error.__class__.__name__, error)
+
+def summarize_run(path, **kwargs):
+    """Returns a summary of the run in path, as a dict of plain python values:
+
+        path, run_id, flowcell_layout, read_config: from the run's metadata
+        tile: TileMetrics.to_dict()
+        quality: % >= Q30 per read (QualityMetrics.to_dict())
+        index: clusters per index (IndexMetrics.to_dict())
+        error_rate: mean error rate of the run and of each lane
+        seconds: time taken
+
+    A binary that is missing has a summary of None; one that fails to parse has none, and its error
+    goes into 'errors' (key -> message). If the run can't be read at all, 'error' says why.
+    Keyword arguments go to InteropDataset (default: backend='numpy')."""
+    start = time.time()
+    summary = { 'path': path, 'error': None, 'errors': {} }
+    try:
+        dataset = InteropDataset(path, **dict(DEFAULT_DATASET_KWARGS, **kwargs))
+        summary.update({ 'run_id': dataset.meta.runID,
+                         'flowcell_layout': dataset.meta.flowcell_layout,
+                         'read_config': dataset.meta.read_config })
+        for key, accessor, summarize in SUMMARIES:
+            try:
+                summary[key] = summarize(getattr(dataset, accessor)())
+            except InteropFileNotFoundError:
+                summary[key] = None
+            except Exception as e:
+                summary['errors'][key] = describe_error(e)
+    except (Exception, InteropFileNotFoundError) as e:
+        summary['error'] = describe_error(e)
+    summary['seconds'] = time.time() - start
+    return to_builtin(summary)
+
+def map_runs(func, runs, workers=None, **kwargs):
+    """Generator yielding func(*run, **kwargs) of each of runs (tuples of arguments, starting with the
+    run's path), in order of completion.
+
+    Runs are handled in a pool of `workers` processes (default: one per CPU), or one after the other
+    in this process if workers=1. Only a window of twice as many runs as workers are handed to the
+    pool at a time, and runs are taken from `runs` as others complete, so a generator of runs (e.g.
+    a directory walk) goes on while results come back. A run failing (even taking its worker process
+    down) only makes its own result { 'path': path, 'error': message }; the others carry on. Runs
+    not yet started when the generator is closed are cancelled."""
+    if workers == 1:
+        for run in runs:
+            yield func(*run, **kwargs)
+        return
+
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    executor = ProcessPoolExecutor(max_workers=workers)
+    runs = iter(runs)
+    window = 2 * (workers or multiprocessing.cpu_count())
+    pending = {}
+    failed = []
+
+    def submit_next():
+        "hands the next of runs to the pool; returns False once there are none left."
+        for run in runs:
+            try:
+                pending[executor.submit(func, *run, **kwargs)] = run[0]
+            except Exception as e:      # e.g. the pool broke down.
+                failed.append({ 'path': run[0], 'error': describe_error(e) })
+            return True
+        return False
+
+    try:
+        while True:
+            while len(pending) < window and submit_next():
+                pass
+            while failed:
+                yield failed.pop(0)
+            if not pending:
+                break
+            done = [(future, pending.pop(future)) for future in wait(pending, return_when=FIRST_COMPLETED)[0]]
+            # keep the pool busy while the caller handles these.
+            while len(pending) < window and submit_next():
+                pass
+            for future, path in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = { 'path': path, 'error': describe_error(e) }
+                yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown()
+
+def summarize_runs(paths, workers=None, **kwargs):
+    """Generator yielding summarize_run(path, **kwargs) of each of paths, in order of completion, 
+    from `workers` processes (see map_runs)."""
+    for summary in map_runs(summarize_run, [(path,) for path in paths], workers, **kwargs):
+        summary.setdefault('errors', {})
+        yield summary
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+#
+# On-disk cache of decoded InterOp binaries.
+#
+# Each parsed binary gets its own directory within the cache directory, holding one .npy file
+# per field of the parser's data (memory-mapped on load, so nothing is decoded twice) and a
+# meta.json recording the fingerprint of the source binary and the parser state needed to
+# rebuild summaries without touching the binary again.
+#
+# A cache entry is valid while the source binary has the same size and either the same mtime
+# or (e.g. after a copy that didn't preserve mtime) the same SHA1 of its contents.
+
+import binascii, hashlib, json, os, shutil, tempfile
+
+import numpy
+
+CACHE_VERSION = 3           # bump to invalidate caches written in an older layout.
+META_FILENAME = 'meta.json'
+HASH_BLOCKSIZE = 1 << 20
+
+
+def file_sha1(path):
+    "returns hex SHA1 of contents of file at path."
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(HASH_BLOCKSIZE), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def cache_entry_path(cache_dir, parser):
+    "returns path of the cache directory for the binary read by parser."
+    source = os.path.abspath(parser.filename)
+    key = hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, '%s-%s' % (parser.codename, key))
+
+def _read_meta(entry):
+    with open(os.path.join(entry, META_FILENAME)) as fh:
+        return json.load(fh)
+
+def _write_meta(entry, meta):
+    with open(os.path.join(entry, META_FILENAME), 'w') as fh:
+        json.dump(meta, fh)
+
+def _is_fresh(entry, meta, parser):
+    "checks source binary against the fingerprint in meta; refreshes meta's mtime if only that changed."
+    stat = os.stat(parser.filename)
+    if meta.get('cache_version') != CACHE_VERSION or meta.get('parser') != parser.__class__.__name__:
+        return False
+    if meta['size'] != stat.st_size:
+        return False
+    if meta['mtime'] == stat.st_mtime:
+        return True
+    if meta['sha1'] != file_sha1(parser.filename):
+        return False
+    meta['mtime'] = stat.st_mtime
+    _write_meta(entry, meta)
+    return True
+
+def load_cached(parser, cache_dir):
+    """Fills parser.data (and its header-derived state) from cache_dir if it holds a fresh entry
+    for parser's binary. Returns True on a cache hit, False otherwise."""
+    entry = cache_entry_path(cache_dir, parser)
+    try:
+        meta = _read_meta(entry)
+        if not _is_fresh(entry, meta, parser):
+            return False
+
+        data = {}
+        for name, kind in meta['columns']:
+            column = numpy.load(os.path.join(entry, '%s.npy' % name), mmap_mode='r')
+            # strings and datetimes are stored as fixed-width numpy types; parsers keep them as objects.
+            data[name] = column.astype(object) if kind == 'O' else column
+    except (IOError, OSError, ValueError, KeyError):
+        return False
+
+    # re-read the header from its cached copy, so version-dependent state is restored.
+    parser.buf = binascii.unhexlify(meta['header'])
+    parser.header_len = parser.parse_header()
+    parser._header = parser.buf
+    parser.offset = meta['offset']
+    parser.buf = None
+
+    parser.data = data
+    return True
+
+def save_cached(parser, cache_dir):
+    """Writes parser.data to cache_dir along with the fingerprint of parser's binary.
+    The entry is built in a temporary directory and moved into place, so readers never see half of it."""
+    stat = os.stat(parser.filename)
+    meta = { 'cache_version': CACHE_VERSION,
+             'parser': parser.__class__.__name__,
+             'source': os.path.abspath(parser.filename),
+             'size': stat.st_size,
+             'mtime': stat.st_mtime,
+             'sha1': file_sha1(parser.filename),
+             'header': binascii.hexlify(parser._header).decode('ascii'),
+             'offset': parser.offset,
+             'columns': [] }
+
+    tmpdir = None
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        tmpdir = tempfile.mkdtemp(dir=cache_dir)
+
+        for name, column in parser.data.items():
+            column = numpy.asarray(column)
+            kind = column.dtype.kind
+            if kind == 'O':
+                column = numpy.asarray(column.tolist())
+                if column.dtype.kind == 'O':
+                    column = column.astype('datetime64[us]')
+            numpy.save(os.path.join(tmpdir, '%s.npy' % name), column)
+            meta['columns'].append([name, kind])
+        _write_meta(tmpdir, meta)
+
+        entry = cache_entry_path(cache_dir, parser)
+        if os.path.isdir(entry):
+            shutil.rmtree(entry)
+        os.rename(tmpdir, entry)
+    except (IOError, OSError):
+        # a cache that can't be written just means parsing again next time.
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
@@ -4,10 +4,7 @@
 # 3/28/2013
 # by nthmost (naomi.most@invitae.com)
 
-import pandas
-from bitstring import ReadError
-
-from .base_parser_class import InteropBinParser
+from .base_parser_class import InteropBinParser, STRING
 
 
 class InteropControlMetrics(InteropBinParser):
@@ -16,55 +13,30 @@ class InteropControlMetrics(InteropBinParser):
     supported_versions = [1]
     codename = 'control'
 
-    def _init_variables(self):
-        self.data = { 'lane': [], 
-                      'tile': [], 
-                      'read': [], 
-                      'control_str': [], 
-                      'index_str': [], 
-                      'clusters': [] 
-                    }
+    # Control Metrics (ControlMetricsOut.bin)
+    # Contains pull out information for Illumina in-line sample controls
+    # Format:
+    #   byte 0: file version number (1) bytes (variable length): record:
+    #   2 bytes: lane number (uint16)
+    #   2 bytes: tile number (uint16)
+    #   2 bytes: read number (uint16)
+    #   2 bytes: number bytes X for control name(uint16)
+    #   X bytes: control name string (string in UTF8Encoding) 
+    #   2 bytes: number bytes Y for index name(uint16)
+    #   Y bytes: index name string (string in UTF8Encoding) 
+    #   4 bytes: num of clusters identified as control (uint32)
+
+    record_layout = [('lane', '<u2'), ('tile', '<u2'), ('read', '<u2'), 
+                     ('control_str', STRING), ('index_str', STRING), ('clusters', '<u4')]
 
-    def parse_binary(self):
-    
-        bs = self.bs
-
-        # Control Metrics (ControlMetricsOut.bin)
-        # Contains pull out information for Illumina in-line sample controls
-        # Format:
-        #   byte 0: file version number (1) bytes (variable length): record:
-        #   2 bytes: lane number (uint16)
-        #   2 bytes: tile number (uint16)
-        #   2 bytes: read number (uint16)
-        #   2 bytes: number bytes X for control name(uint16)
-        #   X bytes: control name string (string in UTF8Encoding) 
-        #   2 bytes: number bytes Y for index name(uint16)
-        #   Y bytes: index name string (string in UTF8Encoding) 
-        #   4 bytes: num of clusters identified as control (uint32)
+    def _init_variables(self):
+        self.data = {}
 
-        self.apparent_file_version = bs.read('uintle:8')  # version number of binary 
+    def parse_header(self):
+        "Reads the file version (byte 0); returns the length of the header in bytes."
+        self.apparent_file_version = self.read_bytes(0, 1)[0]
         self.check_version(self.apparent_file_version)
-
-        try:
-            while True:
-                lane, tile, read = bs.readlist('3*uintle:16')
-                self.data['lane'].append(lane)
-                self.data['tile'].append(tile)
-                self.data['read'].append(read)
-
-                # next 2 bytes: expected control name length in bytes.
-                nextbytes = bs.read('uintle:16')
-                self.data['control_str'].append(bs.read('bytes:%i' % (nextbytes)))
-
-                # next 2 bytes: expected index name length in bytes.
-                nextbytes = bs.read('uintle:16')
-                self.data['index_str'].append(bs.read('bytes:%i' % (nextbytes)))
-
-                self.data['clusters'].append(bs.read('uintle:32'))
-        except ReadError:
-            pass
-    
-        self.df = pandas.DataFrame(self.data)
+        return 1
 
     def __str__(self):
         #TODO: to_str (improve output)
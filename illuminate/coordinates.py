@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+# Coordinates of the tiles of a flowcell.
+#
+# Illumina tile numbers say where a tile is: the first digit is its surface (1: top, 2: bottom),
+# the second its swath, and the remaining ones its position within the swath. That's two digits on
+# MiSeq, HiSeq and NovaSeq (2314: tile 14 of swath 3 of the bottom surface) and three on NextSeq,
+# whose extra digit is the camera section (11203: tile 3 of section 2 of swath 1, top surface).
+#
+# TileCoordinates lays the (lane, tile) pairs of a run out on dense axes worked out from its
+# flowcell_layout, so each record gets an integer slot, and a metric can be held in an N-dimensional
+# numpy array (cycle x lane x tile [x field]) sliced by read, lane, surface or swath in constant time.
+
+import numpy
+
+
+def get_tile_numbers(flowcell_layout):
+    """Returns array of the tile numbers of one lane: surface, swath and 2-digit tile number
+    (e.g. 1101, 2314), as on MiSeq and HiSeq. A tilecount over 99 takes 3 digits (e.g. 11101)."""
+    digits = 100 if flowcell_layout['tilecount'] < 100 else 1000
+    return numpy.array([(surface * 10 + swath) * digits + tile
+                        for surface in range(1, flowcell_layout['surfacecount'] + 1)
+                        for swath in range(1, flowcell_layout['swathcount'] + 1)
+                        for tile in range(1, flowcell_layout['tilecount'] + 1)], dtype=numpy.int64)
+
+def split_tile_numbers(tiles):
+    "Returns arrays of the surface, swath and position within the swath of each of tile numbers."
+    tiles = numpy.asarray(tiles, dtype=numpy.int64)
+    num_digits = numpy.floor(numpy.log10(numpy.maximum(tiles, 1))).astype(numpy.int64) + 1
+    scale = 10 ** numpy.maximum(num_digits - 2, 0)
+    return tiles // (scale * 10), (tiles // scale) % 10, tiles % scale
+
+
+class TileCoordinates(object):
+    """Dense coordinates of the tiles of a run.
+
+    .lanes and .tiles are the lane and tile numbers along the lane and tile axes of its arrays (the
+    same tiles in each lane), .surfaces and .swaths those of each tile along the tile axis. They
+    come from flowcell_layout; lanes or tiles seen in the data (lanes=, tiles=) that the layout
+    doesn't account for are added to the lane axis, or make the tile axis the sorted tile numbers
+    seen instead (e.g. NextSeq's, whose sections the layout doesn't tell). Slots of tiles without
+    records stay empty.
+
+    The cycle axis spans the cycles of read_config, or more if cycles= go further."""
+
+    def __init__(self, flowcell_layout, read_config=(), lanes=None, tiles=None, cycles=None):
+        self.lanes = numpy.arange(1, flowcell_layout.get('lanecount', 1) + 1)
+        if lanes is not None and len(lanes):
+            self.lanes = numpy.union1d(self.lanes, numpy.asarray(lanes, dtype=numpy.int64))
+
+        self.tiles = get_tile_numbers(flowcell_layout)
+        if tiles is not None and len(tiles):
+            seen = numpy.unique(numpy.asarray(tiles, dtype=numpy.int64))
+            if not numpy.in1d(seen, self.tiles).all():
+                self.tiles = seen
+        self.surfaces, self.swaths, _ = split_tile_numbers(self.tiles)
+
+        self.read_tiers = numpy.cumsum([read['cycles'] for read in read_config]).tolist()
+        self.num_cycles = self.read_tiers[-1] if self.read_tiers else 0
+        if cycles is not None and len(cycles):
+            self.num_cycles = max(self.num_cycles, int(numpy.max(cycles)))
+
+        self._tile_indices = {}
+
+    @property
+    def shape(self):
+        "(cycles, lanes, tiles): shape of the arrays laid out on these coordinates."
+        return (self.num_cycles, len(self.lanes), len(self.tiles))
+
+    def lane_index(self, lane_nums):
+        "Returns position(s) of lane number(s) along the lane axis (-1 for lanes not on it)."
+        return self._positions(self.lanes, lane_nums)
+
+    def tile_index(self, tile_nums):
+        "Returns position(s) of tile number(s) along the tile axis (-1 for tiles not on it)."
+        return self._positions(self.tiles, tile_nums)
+
+    def _positions(self, axis, values):
+        values = numpy.asarray(values, dtype=numpy.int64)
+        if not len(axis):
+            return numpy.full(values.shape, -1, dtype=numpy.intp)
+        positions = numpy.searchsorted(axis, values).clip(0, len(axis) - 1)
+        return numpy.where(axis[positions] == values, positions, -1)
+
+    def count_per_slot(self, lanes, tiles, cycles):
+        "Returns the largest number of records (given by their lanes, tiles and cycles) sharing a slot."
+        slot = self.slots(lanes, tiles)
+        cycle_idx = numpy.asarray(cycles, dtype=numpy.int64) - 1
+        keep = (slot >= 0) & (cycle_idx >= 0) & (cycle_idx < self.num_cycles)
+        if not keep.any():
+            return 0
+        return int(numpy.bincount(cycle_idx[keep] * (len(self.lanes) * len(self.tiles)) + slot[keep]).max())
+
+    def slots(self, lanes, tiles):
+        """Returns array of the dense slot (lane position * number of tiles + tile position) of each
+        (lane, tile) pair of arrays lanes and tiles, -1 for pairs off the axes."""
+        lane_idx = self.lane_index(lanes)
+        tile_idx = self.tile_index(tiles)
+        return numpy.where((lane_idx >= 0) & (tile_idx >= 0), lane_idx * len(self.tiles) + tile_idx, -1)
+
+    def tile_indices(self, surface=None, swath=None):
+        "Returns (cached) array of the positions along the tile axis of the tiles of a surface and/or swath."
+        key = (surface, swath)
+        if key not in self._tile_indices:
+            mask = numpy.ones(len(self.tiles), dtype=bool)
+            if surface is not None:
+                mask &= self.surfaces == surface
+            if swath is not None:
+                mask &= self.swaths == swath
+            self._tile_indices[key] = numpy.flatnonzero(mask)
+        return self._tile_indices[key]
+
+    def read_slice(self, read_num):
+        "Returns slice of the cycle axis covering read read_num (counting from 0, as in read_config order)."
+        start = self.read_tiers[read_num - 1] if read_num > 0 else 0
+        return slice(start, self.read_tiers[read_num])
+
+    def select(self, array, read_num=None, lane=None, tile=None, surface=None, swath=None):
+        """Returns the part of array (laid out on these coordinates: cycle x lane x tile [x ...]) for
+        a read, lane, tile, surface and/or swath, keeping its dimensions."""
+        if read_num is not None:
+            array = array[self.read_slice(read_num)]
+        if lane is not None:
+            position = int(self.lane_index(lane))
+            array = array[:, position:position + 1] if position >= 0 else array[:, :0]
+        if tile is not None:
+            position = int(self.tile_index(tile))
+            array = array[:, :, position:position + 1] if position >= 0 else array[:, :, :0]
+        if surface is not None or swath is not None:
+            array = array[:, :, self.tile_indices(surface, swath)]
+        return array
+
+    def make_array(self, lanes, tiles, cycles, values, fill=numpy.nan, add=False):
+        """Returns array of shape (cycles, lanes, tiles) + values.shape[1:] holding values of the records
+        with these lanes, tiles and cycles (arrays, one item per record) in their slots, and fill in
+        slots without records. Records sharing a slot overwrite each other (the last one stays) or, with
+        add=True, are summed. Records off the axes are left out."""
+        values = numpy.asarray(values)
+        cycle_idx = numpy.asarray(cycles, dtype=numpy.intp) - 1
+        slot = self.slots(lanes, tiles)
+        keep = (slot >= 0) & (cycle_idx >= 0) & (cycle_idx < self.num_cycles)
+        if not keep.all():
+            slot, cycle_idx, values = slot[keep], cycle_idx[keep], values[keep]
+
+        dtype = values.dtype if add else numpy.result_type(values.dtype, numpy.min_scalar_type(fill))
+        array = numpy.full((self.num_cycles, len(self.lanes) * len(self.tiles)) + values.shape[1:],
+                           0 if add else fill, dtype=dtype)
+        if add:
+            numpy.add.at(array, (cycle_idx, slot), values)
+        else:
+            array[cycle_idx, slot] = values
+        return array.reshape(self.shape + values.shape[1:])
@@ -1,7 +1,5 @@
 # -*- coding: utf-8 -*-
 
-import pandas
-
 from .base_parser_class import InteropBinParser
 
 class InteropCorrectedIntensityMetrics(InteropBinParser):
@@ -10,52 +8,14 @@ class InteropCorrectedIntensityMetrics(InteropBinParser):
     supported_versions = [2, 3]
     codename = 'corint'
 
+    # the coordinate plane (.idf) is indexed by these.
+    required_columns = ('cycle', 'lane', 'tile')
+
     def _init_variables(self):
-        self.data = { 
-                 'lane': [], 
-                 'cycle': [], 
-                 'tile': [], 
-                 'avg_intensity': [], 
-                 'avg_corint_A': [], 
-                 'avg_corint_C': [], 
-                 'avg_corint_T': [], 
-                 'avg_corint_G': [],
-                 'avg_corint_called_A': [], 
-                 'avg_corint_called_C': [], 
-                 'avg_corint_called_G': [], 
-                 'avg_corint_called_T': [],
-                 'num_nocalls': [], 
-                 'num_calls_A': [], 
-                 'num_calls_C': [], 
-                 'num_calls_G': [], 
-                 'num_calls_T': [],
-                 'signoise_ratio': [] 
-               }
-
-        self.data_v3 = {
-            'lane': [],
-            'cycle': [],
-            'tile': [],
-            'avg_corint_called_A': [],
-            'avg_corint_called_C': [],
-            'avg_corint_called_G': [],
-            'avg_corint_called_T': [],
-            'num_nocalls': [],
-            'num_calls_A': [],
-            'num_calls_C': [],
-            'num_calls_G': [],
-            'num_calls_T': [],
-        }
-
-
-    def parse_binary(self):
-    
-        bs = self.bs    #convenience assignment
+        self.data = {}
 
-        self.apparent_file_version = bs.read('uintle:8')
-        self.check_version( self.apparent_file_version )
-        
-        recordlen = bs.read('uintle:8')  # length of each record
+    def get_record_layout(self):
+        "returns the record layout for the version of the binary being parsed (v2 or v3)."
 
         # v2 CorrectedIntMetrics.bin / CorrectedIntMetricsOut.bin
         #
@@ -103,84 +63,34 @@ class InteropCorrectedIntensityMetrics(InteropBinParser):
         # 4 bytes: number of T base calls (uint32)
 
         if self.apparent_file_version == 3:
-            try:
-                for i in range(0, int((bs.len) / (recordlen * 8))):  # record length in bits
-
-                    lane, tile, cycle, avg_corint_called_A, avg_corint_called_C, avg_corint_called_G, \
-                    avg_corint_called_T, num_nocalls, num_calls_A, num_calls_C, num_calls_G, num_calls_T = \
-                        bs.readlist('7*uintle:16, 5*uintle:32')
-
-                    self.data_v3['lane'].append(lane)
-                    self.data_v3['tile'].append(tile)
-                    self.data_v3['cycle'].append(cycle)
-                    self.data_v3['avg_corint_called_A'].append(avg_corint_called_A)
-                    self.data_v3['avg_corint_called_C'].append(avg_corint_called_C)
-                    self.data_v3['avg_corint_called_G'].append(avg_corint_called_G)
-                    self.data_v3['avg_corint_called_T'].append(avg_corint_called_T)
-                    self.data_v3['num_nocalls'].append(num_nocalls)
-                    self.data_v3['num_calls_A'].append(num_calls_A)
-                    self.data_v3['num_calls_C'].append(num_calls_C)
-                    self.data_v3['num_calls_G'].append(num_calls_G)
-                    self.data_v3['num_calls_T'].append(num_calls_T)
-
-            except ReadError:
-                # that's all, folks
-                pass
-
-            self.df = pandas.DataFrame(self.data_v3)
-
-        elif self.apparent_file_version == 2:
-            try:
-                for i in range(0, int((bs.len) / (recordlen * 8))):  # record length in bits
-
-                    lane, tile, cycle, avg_intensity, avg_corint_A, avg_corint_C, avg_corint_G, avg_corint_T, \
-                    avg_corint_called_A, avg_corint_called_C, avg_corint_called_G, avg_corint_called_T = \
-                        bs.readlist('12*uintle:16')
-
-                    self.data['lane'].append(lane)
-                    self.data['tile'].append(tile)
-                    self.data['cycle'].append(cycle)
-                    self.data['avg_intensity'].append(avg_intensity)
-                    self.data['avg_corint_A'].append(avg_corint_A)
-                    self.data['avg_corint_C'].append(avg_corint_C)
-                    self.data['avg_corint_G'].append(avg_corint_G)
-                    self.data['avg_corint_T'].append(avg_corint_T)
-                    self.data['avg_corint_called_A'].append(avg_corint_called_A)
-                    self.data['avg_corint_called_C'].append(avg_corint_called_C)
-                    self.data['avg_corint_called_G'].append(avg_corint_called_G)
-                    self.data['avg_corint_called_T'].append(avg_corint_called_T)
-
-                    # 20 bytes / 5 = 4 bytes each following records.
-                    num_nocalls, num_calls_A, num_calls_C, num_calls_G, num_calls_T, signoise_ratio = \
-                        bs.readlist('6*floatle:32')
-                    self.data['num_nocalls'].append(num_nocalls)
-                    self.data['num_calls_A'].append(num_calls_A)
-                    self.data['num_calls_C'].append(num_calls_C)
-                    self.data['num_calls_G'].append(num_calls_G)
-                    self.data['num_calls_T'].append(num_calls_T)
-
-                    # 4 bytes: sig/noise ratio (float)
-                    self.data['signoise_ratio'].append(signoise_ratio)
-
-            except ReadError:
-                # that's all, folks
-                pass
-
-            self.df = pandas.DataFrame(self.data)
+            return [('lane', '<u2'), ('tile', '<u2'), ('cycle', '<u2'), 
+                    ('avg_corint_called_A', '<u2'), ('avg_corint_called_C', '<u2'), 
+                    ('avg_corint_called_G', '<u2'), ('avg_corint_called_T', '<u2'), 
+                    ('num_nocalls', '<u4'), ('num_calls_A', '<u4'), ('num_calls_C', '<u4'), 
+                    ('num_calls_G', '<u4'), ('num_calls_T', '<u4')]
+        else:
+            # 20 bytes / 5 = 4 bytes each for the base call counts, then 4 bytes sig/noise ratio (float)
+            return [('lane', '<u2'), ('tile', '<u2'), ('cycle', '<u2'), ('avg_intensity', '<u2'), 
+                    ('avg_corint_A', '<u2'), ('avg_corint_C', '<u2'), ('avg_corint_G', '<u2'), ('avg_corint_T', '<u2'), 
+                    ('avg_corint_called_A', '<u2'), ('avg_corint_called_C', '<u2'), 
+                    ('avg_corint_called_G', '<u2'), ('avg_corint_called_T', '<u2'), 
+                    ('num_nocalls', '<f4'), ('num_calls_A', '<f4'), ('num_calls_C', '<f4'), 
+                    ('num_calls_G', '<f4'), ('num_calls_T', '<f4'), ('signoise_ratio', '<f4')]
+
+    def _process_data(self):
+        if self.apparent_file_version == 3:
+            self.data_v3 = self.data    # kept for backwards compatibility.
 
+    def make_index_frame(self):
+        "Returns the coordinate plane of .df, served as .idf."
         # place each metric into a coordinate plane so we can sort into reads.
-        self.idf = self.make_coordinate_plane(self.df)
+        return self.make_coordinate_plane(self.df)
 
     def __str__(self):
 
-        if self.apparent_file_version == 2:
-            out = len(self.data['cycle'])
-        else:
-            out = len(self.data_v3['cycle'])
-
         #TODO: to_str (improve output)
-        out = "%i entries in CorrectedIntensityMetrics binary" % out
-        out = "\nSample from lane/cycle/tile start:"
+        out = "%i entries in CorrectedIntensityMetrics binary" % len(self.data['cycle'])
+        out += "\nSample from lane/cycle/tile start:"
         out += "%s\n" % self.idf.head()
         return out
  
@@ -1,7 +1,5 @@
 # -*- coding: utf-8 -*-
 
-import pandas
-
 from .base_parser_class import InteropBinParser
 
 class InteropErrorMetrics(InteropBinParser):
@@ -10,63 +8,32 @@ class InteropErrorMetrics(InteropBinParser):
     supported_versions = [3]
     codename = 'error'
 
+    # Contains cycle error rate as well as counts for perfect reads and read with 1-4 errors
+    # Format:
+    #   byte 0: file version number (3)
+    #   byte 1: length of each record
+    #   bytes (N * 30 + 2) to (N * 30 + 11): record:
+    #       2 bytes: lane number (uint16)
+    #       2 bytes: tile number (uint16)
+    #       2 bytes: cycle number (uint16)
+    #	4 bytes: error rate (float)
+    #	4 bytes: number of perfect reads (uint32)
+    #	4 bytes: number of reads with 1 error (uint32)
+    #	4 bytes: number of reads with 2 errors (uint32)
+    # 	4 bytes: number of reads with 3 errors (uint32)
+    #	4 bytes: number of reads with 4 errors (uint32)
+    #   ...where N is the record index.
+
+    record_layout = [('lane', '<u2'), ('tile', '<u2'), ('cycle', '<u2'), ('rate', '<f4'), 
+                     ('perfect', '<u4'), ('one_err', '<u4'), ('two_err', '<u4'), 
+                     ('three_err', '<u4'), ('four_err', '<u4')]
+
     def _init_variables(self):
-        self.data = { 'lane': [], 
-                      'tile': [], 
-                      'cycle': [], 
-                      'perfect': [], 
-                      'rate': [],
-                      'one_err': [], 
-                      'two_err': [], 
-                      'three_err': [], 
-                      'four_err': [] }
+        self.data = {}
 
         self.results = {}
         self.error_rate_dict = {}
             
-    def parse_binary(self):
-    
-        bs = self.bs
-    
-        # Contains cycle error rate as well as counts for perfect reads and read with 1-4 errors
-        # Format:
-        #   byte 0: file version number (3)
-        #   byte 1: length of each record
-        #   bytes (N * 30 + 2) to (N * 30 + 11): record:
-        #       2 bytes: lane number (uint16)
-        #       2 bytes: tile number (uint16)
-        #       2 bytes: cycle number (uint16)
-        #	4 bytes: error rate (float)
-        #	4 bytes: number of perfect reads (uint32)
-        #	4 bytes: number of reads with 1 error (uint32)
-        #	4 bytes: number of reads with 2 errors (uint32)
-        # 	4 bytes: number of reads with 3 errors (uint32)
-        #	4 bytes: number of reads with 4 errors (uint32)
-        #   ...where N is the record index.
-
-        self.apparent_file_version = bs.read('uintle:8')
-        
-        self.check_version(self.apparent_file_version)
-        
-        recordlen = bs.read('uintle:8')  # length of each record
-
-        for i in range(0,int((bs.len) / (recordlen * 8))):  # record length in bits
-
-            lane, tile, cycle, rate, perfect, one_err, two_err, three_err, four_err = \
-                bs.readlist('3*uintle:16, floatle:32, 5*uintle:32')
-
-            self.data['lane'].append(lane)
-            self.data['tile'].append(tile)
-            self.data['cycle'].append(cycle)
-            self.data['rate'].append(rate)
-            self.data['perfect'].append(perfect)
-            self.data['one_err'].append(one_err)
-            self.data['two_err'].append(two_err)
-            self.data['three_err'].append(three_err)
-            self.data['four_err'].append(four_err)
-
-        self.df = pandas.DataFrame(self.data)
-
     def __str__(self):
         #TODO: to_str (improve output)
         out = "(sum of all types of errors across all reads)\n"
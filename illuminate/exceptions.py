@@ -4,3 +4,8 @@ class InteropFileNotFoundError(BaseException):
     def __init__(self, message):
         BaseException.__init__(self, message)
 
+
+class InteropReadError(IndexError):
+    "Raised when a binary is too short (or otherwise malformed) to be parsed."
+    def __init__(self, message):
+        IndexError.__init__(self, message)
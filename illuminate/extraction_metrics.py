@@ -1,89 +1,70 @@
 # -*- coding: utf-8 -*-
 
-from datetime import datetime, timedelta
+from datetime import datetime
 
-import pandas
+import numpy
 
 from .base_parser_class import InteropBinParser
 
 anno_domini = datetime(1, 1, 1)
 
+# masks out the 2 "kind" bits of a serialized .NET DateTime, leaving 100ns ticks since anno_domini.
+DOTNET_TICKS_MASK = 0x3FFFFFFFFFFFFFFF
+
+# .NET ticks (100ns) from anno_domini to the unix epoch, which numpy datetimes count from.
+DOTNET_TICKS_AT_EPOCH = 621355968000000000
+
+# microseconds since the epoch representable as datetime64[ns] (roughly years 1678 to 2261).
+DATETIME64_NS_MIN_US = -(2**63 // 1000) + 1
+DATETIME64_NS_MAX_US = (2**63 - 1) // 1000
+
+def dotnet_ticks_to_datetime64(ticks):
+    """Converts array of serialized .NET DateTimes (uint64) to datetime64[ns] in one go, truncating to 
+    microseconds. Timestamps outside of datetime64[ns]'s range (e.g. zeroed ones) become NaT."""
+    ticks = (numpy.asarray(ticks, dtype=numpy.uint64) & numpy.uint64(DOTNET_TICKS_MASK)).astype(numpy.int64)
+    us = (ticks - DOTNET_TICKS_AT_EPOCH) // 10
+    out = us.astype('datetime64[us]').astype('datetime64[ns]')
+    out[(us < DATETIME64_NS_MIN_US) | (us > DATETIME64_NS_MAX_US)] = numpy.datetime64('NaT')
+    return out
+
 class InteropExtractionMetrics(InteropBinParser):
 
     __version = 0.2
     supported_versions = [2]
     codename = 'extraction'
 
+    # Extraction Metrics (ExtractionMetricsOut.bin)
+    # Contains extraction metrics such as fwhm (full width at half maximum) scores and raw intensities
+    # Format:
+    #   byte 0: file version number (2)
+    #   byte 1: length of each record
+    #   bytes (N * 38 + 2) - (N *38 + 39): record:
+    #     2 bytes: lane number (uint16)
+    #     2 bytes: tile number (uint16)
+    #     2 bytes: cycle number (uint16)
+    #     4 x 4 bytes: fwhm scores (float) for channel [A, C, G, T] respectively 
+    #     2 x 4 bytes: intensities (uint16) for channel [A, C, G, T] respectively 
+    #     8 bytes: date/time of CIF creation --> serialized C# datetime object 
+    #   ...Where N is the record index
+
+    record_layout = [('lane', '<u2'), ('tile', '<u2'), ('cycle', '<u2'), 
+                     ('fwhm_A', '<f4'), ('fwhm_C', '<f4'), ('fwhm_G', '<f4'), ('fwhm_T', '<f4'), 
+                     ('intensity_A', '<u2'), ('intensity_C', '<u2'), ('intensity_G', '<u2'), ('intensity_T', '<u2'),
+                     ('datetime', '<u8')]
+
     def _init_variables(self):
-        self.data = { 
-                    'lane': [], 
-                    'tile': [], 
-                    'cycle': [], 
-                    'fwhm_A': [], 
-                    'fwhm_C': [], 
-                    'fwhm_G': [], 
-                    'fwhm_T': [], 
-                    'intensity_A': [], 
-                    'intensity_C': [], 
-                    'intensity_G': [], 
-                    'intensity_T': [],
-                    'datetime': [],
-                    }
-        
-    def parse_binary(self):
-        bs = self.bs
-        
-        # Extraction Metrics (ExtractionMetricsOut.bin)
-        # Contains extraction metrics such as fwhm (full width at half maximum) scores and raw intensities
-        # Format:
-        #   byte 0: file version number (2)
-        #   byte 1: length of each record
-        #   bytes (N * 38 + 2) - (N *38 + 39): record:
-        #     2 bytes: lane number (uint16)
-        #     2 bytes: tile number (uint16)
-        #     2 bytes: cycle number (uint16)
-        #     4 x 4 bytes: fwhm scores (float) for channel [A, C, G, T] respectively 
-        #     2 x 4 bytes: intensities (uint16) for channel [A, C, G, T] respectively 
-        #     8 bytes: date/time of CIF creation --> serialized C# datetime object 
-        #   ...Where N is the record index
-
-        self.apparent_file_version = bs.read('uintle:8')
-        self.check_version(self.apparent_file_version)
-        
-        recordlen = bs.read('uintle:8')  # length of each record
-
-        for i in range(0,int((bs.len) / (recordlen * 8))):  # record length in bits
-
-            lane, tile, cycle, fwhm_A, fwhm_C, fwhm_G, fwhm_T, intensity_A, intensity_C, intensity_G, intensity_T = \
-                bs.readlist('3*uintle:16, 4*floatle:32, 4*uintle:16')
-
-            self.data['lane'].append(lane)
-            self.data['tile'].append(tile)
-            self.data['cycle'].append(cycle)
-
-            # 4 x 4 bytes: fwhm scores (float) for channel [A, C, G, T] respectively
-            self.data['fwhm_A'].append(fwhm_A)
-            self.data['fwhm_C'].append(fwhm_C)
-            self.data['fwhm_G'].append(fwhm_G)
-            self.data['fwhm_T'].append(fwhm_T)
-
-            # 2 x 4 bytes: intensities (uint16) for channel [A, C, G, T] respectively
-            self.data['intensity_A'].append(intensity_A)
-            self.data['intensity_C'].append(intensity_C)
-            self.data['intensity_G'].append(intensity_G)
-            self.data['intensity_T'].append(intensity_T)
-    
-            # 8 bytes: date/time of CIF creation
-            datetime_bits = bs.read(64)
-            # first 2 bits of last byte represent "kind" of date
-            # we don't care about "kind", so let's zero those bits
-            datetime_bits.set(0, (56, 57))
-            # the rest is a 62bit integer giving 100ns since midnight Jan 1, 0001
-            microseconds = timedelta(microseconds=datetime_bits.uintle / 10)
-            self.data['datetime'].append(anno_domini + microseconds)
-
-        self.df = pandas.DataFrame(self.data)
-        #self.idf = self.make_coordinate_plane(self.df)
+        self.data = {}
+
+    def _process_chunk(self, chunk):
+        if 'datetime' not in chunk:
+            # not among the selected columns.
+            return chunk
+
+        # 8 bytes: date/time of CIF creation
+        # first 2 bits of last byte represent "kind" of date; we don't care about "kind", 
+        # so let's zero those bits. The rest is a 62bit integer giving 100ns since midnight Jan 1, 0001
+        chunk['datetime'] = dotnet_ticks_to_datetime64(chunk['datetime'])
+        return chunk
 
     def __str__(self): 
         #TODO: to_str (improve output)
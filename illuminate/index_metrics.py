@@ -1,9 +1,8 @@
 # -*- coding: utf-8 -*-
 
-import pandas
-from bitstring import ReadError
+import numpy
 
-from .base_parser_class import InteropBinParser
+from .base_parser_class import InteropBinParser, STRING, count_records
 
 
 class InteropIndexMetrics(InteropBinParser):
@@ -28,24 +27,25 @@ class InteropIndexMetrics(InteropBinParser):
                   self.flowcell_layout['tilecount'] * self.flowcell_layout['surfacecount'] * \
                   len(self.results.keys()) * self.flowcell_layout['lanecount']
                 
+    # needed for the per-index pivot.
+    required_columns = ('index_str', 'project_str', 'name_str', 'clusters')
+
     def _init_variables(self):
-        self.data = {
-            'lane': [], 
-            'tile': [], 
-            'read': [], 
-            'index_str': [], 
-            'clusters': [], 
-            'name_str': [], 
-            'project_str': [] 
-            }
+        self.data = {}
             
         self.total_ix_reads_pf = 0  # sum of all index reads passing filter 
         self.results = {}  # after parsing, keyed by unique indexes.
         # value = sum of PF clusters found per unique index.
 
-    def parse_binary(self):
-    
-        bs = self.bs
+    def parse_header(self):
+        "Reads the file version (byte 0); returns the length of the header in bytes."
+        self.apparent_file_version = self.read_bytes(0, 1)[0]
+        self.check_version(self.apparent_file_version)
+        return 1
+
+    def get_record_layout(self):
+        """returns the record layout for the version of the binary being parsed (v1 or v2).
+        Each record is of variable length. Fun!"""
 
         # Index Metrics (IndexMetrics.bin and IndexMetricOut.bin)
         #   Reports the indexes count. Format:
@@ -62,49 +62,41 @@ class InteropIndexMetrics(InteropBinParser):
         #       2 bytes: number of bytes W for sample project(unint16) 
         #   W bytes: sample project string (string in UTF8Encoding)
 
-        self.apparent_file_version = bs.read('uintle:8')  # version number == "1"
-        
-        self.check_version( self.apparent_file_version )
-        
-        # Each record is of variable length. Fun!
+        if self.apparent_file_version == 2:
+            tile_fmt, clusters_fmt = '<u4', '<u8'
+        else:
+            tile_fmt, clusters_fmt = '<u2', '<u4'
 
-        try:
-            while True:
-                self.data['lane'].append(bs.read('uintle:16'))  # lane number
-                if self.apparent_file_version == 2:
-                    self.data['tile'].append(bs.read('uintle:32'))  # tile number
-                else:
-                    self.data['tile'].append(bs.read('uintle:16'))  # tile number
-                self.data['read'].append(bs.read('uintle:16'))  # read number
+        return [('lane', '<u2'), ('tile', tile_fmt), ('read', '<u2'), ('index_str', STRING),
+                ('clusters', clusters_fmt), ('name_str', STRING), ('project_str', STRING)]
 
-                # next 2 bytes: expected index name length in bytes.
-                nextbytes = bs.read('uintle:16')
-                self.data['index_str'].append(bs.read('bytes:%i' % nextbytes)) # index string
+    def _sum_clusters_by_index(self):
+        """returns list of ((index_str, project_str, name_str), sum of clusters) tuples sorted by key, 
+        computed with numpy."""
+        # combine the codes of each (sorted) string column into one sortable group number per record.
+        group = numpy.zeros(count_records(self.data), dtype=numpy.int64)
+        for name in ('index_str', 'project_str', 'name_str'):
+            values, inverse = numpy.unique(self.data[name], return_inverse=True)
+            group = group * len(values) + inverse.ravel()
 
-                # next 4 or 8 bytes: number of clusters identified as index
-                # (uint32 or uint64)
-                if self.apparent_file_version == 2:
-                    self.data['clusters'].append(bs.read('uintle:64'))
-                else:
-                    self.data['clusters'].append(bs.read('uintle:32'))
+        groups, first, inverse = numpy.unique(group, return_index=True, return_inverse=True)
+        sums = numpy.zeros(len(groups), dtype=numpy.uint64)
+        numpy.add.at(sums, inverse.ravel(), self.data['clusters'].astype(numpy.uint64))
 
-                # next 2 bytes: expected sample name length in bytes.
-                nextbytes = bs.read('uintle:16')
-                self.data['name_str'].append(bs.read('bytes:%i' % nextbytes)) # sample name
-
-                # next 2 bytes: expected sample project string length in bytes.
-                nextbytes = bs.read('uintle:16')
-                self.data['project_str'].append(bs.read('bytes:%i' % nextbytes))
-
-        except ReadError:
-            pass
-
-        self.df = pandas.DataFrame(self.data)
+        keys = zip(self.data['index_str'][first], self.data['project_str'][first], self.data['name_str'][first])
+        return list(zip(keys, sums.tolist()))
 
+    def _process_data(self):
         self.results = {}
 
+        if self.backend == 'numpy':
+            sums = self._sum_clusters_by_index()
+            self.total_ix_reads_pf = sum(clusters for ix, clusters in sums)
+            for ix, clusters in sums:
+                self.results[ix[0]] = {'project': ix[1], 'name': ix[2], 'clusters': clusters}
+
         # data frame is empty if it was a run without any indices
-        if not self.df.empty:
+        elif not self.df.empty:
             self.pivot = self.df.pivot_table('clusters', index=['index_str', 'project_str', 'name_str'], aggfunc='sum')
 
             # pivot now looks something like this, with any luck:
@@ -124,6 +116,9 @@ class InteropIndexMetrics(InteropBinParser):
         return self.results
 
     def __str__(self):    
+        if self.backend == 'numpy':
+            return ''.join('%s  %s  %s  %i\n' % (ix, result['project'], result['name'], result['clusters'])
+                           for ix, result in sorted(self.results.items()))
         out = '%s\n' % self.pivot
         return out 
 
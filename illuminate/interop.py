@@ -13,18 +13,9 @@
 # by nthmost (naomi.most@invitae.com)
 # with lots of help from ECO (eric.olivares@invitae.com)
 
-import time, os
-
-import pandas
+import importlib, time, os
 
 from .metadata import InteropMetadata
-from .index_metrics import InteropIndexMetrics
-from .tile_metrics import InteropTileMetrics
-from .quality_metrics import InteropQualityMetrics
-from .error_metrics import InteropErrorMetrics
-from .corint_metrics import InteropCorrectedIntensityMetrics 
-from .control_metrics import InteropControlMetrics
-from .extraction_metrics import InteropExtractionMetrics
 
 from .utils import select_file_from_aliases
 from .exceptions import InteropFileNotFoundError
@@ -37,6 +28,27 @@ except ImportError:
     pass
 
 
+# binary codename -> (module, class name) of its parser. Parser modules (and numpy with them) are
+# imported by get_parser_class() when a binary is first parsed, so e.g. reading metadata stays cheap.
+PARSER_CLASSES = { 'tile': ('.tile_metrics', 'InteropTileMetrics'),
+                   'quality': ('.quality_metrics', 'InteropQualityMetrics'),
+                   'index': ('.index_metrics', 'InteropIndexMetrics'),
+                   'error': ('.error_metrics', 'InteropErrorMetrics'),
+                   'corint': ('.corint_metrics', 'InteropCorrectedIntensityMetrics'),
+                   'extraction': ('.extraction_metrics', 'InteropExtractionMetrics'),
+                   'control': ('.control_metrics', 'InteropControlMetrics') }
+
+def get_parser_class(codename):
+    "returns parser class for binary 'codename', importing its module if necessary."
+    module_name, class_name = PARSER_CLASSES[codename]
+    return getattr(importlib.import_module(module_name, __package__), class_name)
+
+
+def _parse_binary(parser_class, path, kwargs):
+    "runs parser_class on path; module-level so that process pools can pickle it."
+    return parser_class(path, **kwargs)
+
+
 class InteropDataset(object):
     """Encapsulates the physical files related to this sequencing run. 
        Absolves other classes of having to know about files and directories.
@@ -49,10 +61,31 @@ class InteropDataset(object):
 
     meta = None
 
-    def __init__(self, targetdir):
-        "Supply a path (directory) that should contain XML files, with an InterOp directory within it."
+    # (holder attribute, binary codename) of every binary parser; see PARSER_CLASSES for their classes.
+    parsers = [ ('_tile_metrics', 'tile'),
+                ('_quality_metrics', 'quality'),
+                ('_index_metrics', 'index'),
+                ('_error_metrics', 'error'),
+                ('_corint_metrics', 'corint'),
+                ('_extraction_metrics', 'extraction'),
+                ('_control_metrics', 'control') ]
+
+    def __init__(self, targetdir, use_mmap=False, cache_dir=None, backend='pandas', stats_callback=None):
+        """Supply a path (directory) that should contain XML files, with an InterOp directory within it.
+
+        Optional: use_mmap=True makes every parser read its binary through a memory map.
+        Optional: cache_dir=path keeps decoded binaries in that directory, so reopening a completed
+                  run memory-maps them from there instead of parsing again.
+        Optional: backend='numpy' has parsers keep their data as numpy structured arrays and compute
+                  summaries without pandas (see InteropBinParser).
+        Optional: stats_callback=func is called by every parser after each phase of its work, as
+                  func(parser, phase, seconds, peak MB); see InteropBinParser.phase."""
 
         self.directory = targetdir
+        self.use_mmap = use_mmap
+        self.cache_dir = cache_dir
+        self.backend = backend
+        self.stats_callback = stats_callback
 
         # Without this initial check, we get a silent failure (and an empty dataset),
         # since the whole apparatus is built to be very forgiving of missing files. 
@@ -74,6 +107,119 @@ class InteropDataset(object):
         self._extraction_metrics = None
         self._control_metrics = None
 
+        # codename -> (path, size, mtime) of binaries as last seen by changed_binaries().
+        self._binary_fingerprints = {}
+
+        # codename -> exception raised parsing it, for binaries that failed in the last load_all().
+        self.load_errors = {}
+
+    def _parser_kwargs(self):
+        "keyword arguments handed to every binary parser created by this dataset."
+        return { 'flowcell_layout': self.meta.flowcell_layout,
+                 'read_config': self.meta.read_config,
+                 'use_mmap': self.use_mmap,
+                 'cache_dir': self.cache_dir,
+                 'backend': self.backend,
+                 'stats_callback': self.stats_callback }
+
+    def _get_parser(self, attr, codename, reload=False, filters=None):
+        """Returns parser stored in attribute attr, creating it from the 'codename' binary if needed.
+
+        reload=True on an existing parser of the same binary only parses the records appended
+        since the last parse (see InteropBinParser.update), which keeps polling an active run cheap.
+
+        filters: dict of lanes/tiles/cycles filters and columns selection for the parser. A stored 
+        parser holding a different selection of records or columns is replaced."""
+        filters = filters or {}
+        parser = getattr(self, attr)
+        if parser is not None and not parser.has_selection(**filters):
+            parser = None
+
+        if parser is None or reload:
+            path = self.get_binary_path(codename)
+            if parser is not None and parser.filename == path:
+                parser.update()
+            else:
+                kwargs = self._parser_kwargs()
+                kwargs.update(filters)
+                parser = get_parser_class(codename)(path, **kwargs)
+                setattr(self, attr, parser)
+        return parser
+
+    def load_all(self, executor=None, max_workers=None, **filters):
+        """Parses every binary present in this dataset concurrently, so that loading a whole run takes
+        about as long as its largest binary. Returns when all parsers are done.
+
+        executor: a concurrent.futures Executor, or 'thread' (default) / 'process' to create a pool of
+                  max_workers workers. Processes sidestep the GIL for the pure-python Index and
+                  Control parsers, at the cost of pickling results back.
+
+        Parsers share this dataset's metadata; their results are then returned by the *Metrics()
+        accessors. Binaries that are missing or fail to parse are skipped here, so the accessors
+        raise the usual exceptions for them; the exception each failed one raised goes into
+        .load_errors (codename -> exception). Returns list of codenames that were loaded.
+
+        Optional lanes=, tiles=, cycles= filters and columns= are handed to every parser."""
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+        own_executor = executor is None or executor in ('thread', 'process')
+        executor_is_process = executor == 'process' or isinstance(executor, ProcessPoolExecutor)
+        if executor == 'process':
+            executor = ProcessPoolExecutor(max_workers=max_workers)
+        elif own_executor:
+            executor = ThreadPoolExecutor(max_workers=max_workers or len(self.parsers))
+
+        futures = []
+        loaded = []
+        self.load_errors = {}
+        try:
+            for attr, codename in self.parsers:
+                path = select_file_from_aliases(codename, BIN_FILEMAP, self.bindir)
+                if path is not None:
+                    kwargs = self._parser_kwargs()
+                    kwargs.update(filters)
+                    if executor_is_process:
+                        # callbacks can't cross into worker processes; phases are reported on return.
+                        kwargs['stats_callback'] = None
+                    future = executor.submit(_parse_binary, get_parser_class(codename), path, kwargs)
+                    futures.append((attr, codename, future))
+
+            for attr, codename, future in futures:
+                try:
+                    parser = future.result()
+                    setattr(self, attr, parser)
+                    loaded.append(codename)
+                    if executor_is_process and self.stats_callback is not None:
+                        parser.stats_callback = self.stats_callback
+                        for phase, stats in parser.stats['phases'].items():
+                            self.stats_callback(parser, phase, stats['seconds'], stats['peak_mb'])
+                except Exception as e:
+                    # one binary failing to decode mustn't throw away the others' results.
+                    self.load_errors[codename] = e
+        finally:
+            if own_executor:
+                executor.shutdown()
+        return loaded
+
+    def changed_binaries(self):
+        """Returns list of codenames of the binaries that appeared, grew or were rewritten since the last 
+        call (on the first call, of all binaries present). Only stats the files, so it's cheap to poll 
+        an active run with; reload the parsers of changed binaries to parse just the new records."""
+        changed = []
+        for attr, codename in self.parsers:
+            path = select_file_from_aliases(codename, BIN_FILEMAP, self.bindir)
+            if path is None:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue    # removed since it was found.
+            fingerprint = (path, stat.st_size, stat.st_mtime)
+            if self._binary_fingerprints.get(codename) != fingerprint:
+                self._binary_fingerprints[codename] = fingerprint
+                changed.append(codename)
+        return changed
+
     def get_binary_path(self, codename):
         "returns absolute path to binary file represented by data 'codename'"
         path = select_file_from_aliases(codename, BIN_FILEMAP, self.bindir)
@@ -88,61 +234,40 @@ class InteropDataset(object):
             self.meta = InteropMetadata(self.xmldir)
         return self.meta
     
-    def QualityMetrics(self, reload=False):
-        "Returns InteropQualityMetrics object from the 'quality' binary in this dataset."
-        if self._quality_metrics == None or reload == True:
-            self._quality_metrics = InteropQualityMetrics(self.get_binary_path('quality'), 
-                                    flowcell_layout=self.meta.flowcell_layout,
-                                    read_config=self.meta.read_config )
-        return self._quality_metrics
+    def QualityMetrics(self, reload=False, **filters):
+        """Returns InteropQualityMetrics object from the 'quality' binary in this dataset.
+        Optional lanes=, tiles=, cycles= filters and columns= select what to parse (see InteropBinParser)."""
+        return self._get_parser('_quality_metrics', 'quality', reload, filters)
         
-    def TileMetrics(self, reload=False):
-        "Returns InteropTileMetrics object from the 'tile' binary in this dataset."
-        if self._tile_metrics == None or reload == True:
-            self._tile_metrics = InteropTileMetrics(self.get_binary_path('tile'), 
-                                    flowcell_layout=self.meta.flowcell_layout,
-                                    read_config=self.meta.read_config )
-        return self._tile_metrics
-
-    def IndexMetrics(self, reload=False):
-        "Returns InteropIndexMetrics object from the 'index' binary in this dataset."
-        if self._index_metrics == None or reload == True:
-            self._index_metrics = InteropIndexMetrics(self.get_binary_path('index'), 
-                                    flowcell_layout=self.meta.flowcell_layout,
-                                    read_config=self.meta.read_config )
-        return self._index_metrics
-
-    def ControlMetrics(self, reload=False):
-        "Returns InteropControlMetrics object from the 'control' binary in this dataset."
-        if self._control_metrics == None or reload == True:
-            self._control_metrics = InteropControlMetrics(self.get_binary_path('control'), 
-                                    flowcell_layout=self.meta.flowcell_layout,
-                                    read_config=self.meta.read_config )
-        return self._control_metrics
-
-    def ErrorMetrics(self, reload=False):
-        "Returns InteropErrorMetrics object from the 'error' binary in this dataset."
-        if self._error_metrics == None or reload == True:
-            self._error_metrics = InteropErrorMetrics(self.get_binary_path('error'), 
-                                    flowcell_layout=self.meta.flowcell_layout,
-                                    read_config=self.meta.read_config )
-        return self._error_metrics
-
-    def ExtractionMetrics(self, reload=False):
-        "Returns InteropExtractionMetrics object from the 'extraction' binary in this dataset."
-        if self._extraction_metrics == None or reload == True:
-            self._extraction_metrics = InteropExtractionMetrics(self.get_binary_path('extraction'), 
-                                    flowcell_layout=self.meta.flowcell_layout,
-                                    read_config=self.meta.read_config )
-        return self._extraction_metrics
-
-    def CorrectedIntensityMetrics(self, reload=False):
-        "Returns InteropCorrectedIntensityMetrics object from the 'corint' binary in this dataset."
-        if self._corint_metrics == None or reload == True:
-            self._corint_metrics = InteropCorrectedIntensityMetrics(self.get_binary_path('corint'), 
-                                    flowcell_layout=self.meta.flowcell_layout,
-                                    read_config=self.meta.read_config )
-        return self._corint_metrics
+    def TileMetrics(self, reload=False, **filters):
+        """Returns InteropTileMetrics object from the 'tile' binary in this dataset.
+        Optional lanes=, tiles=, cycles= filters and columns= select what to parse (see InteropBinParser)."""
+        return self._get_parser('_tile_metrics', 'tile', reload, filters)
+
+    def IndexMetrics(self, reload=False, **filters):
+        """Returns InteropIndexMetrics object from the 'index' binary in this dataset.
+        Optional lanes=, tiles=, cycles= filters and columns= select what to parse (see InteropBinParser)."""
+        return self._get_parser('_index_metrics', 'index', reload, filters)
+
+    def ControlMetrics(self, reload=False, **filters):
+        """Returns InteropControlMetrics object from the 'control' binary in this dataset.
+        Optional lanes=, tiles=, cycles= filters and columns= select what to parse (see InteropBinParser)."""
+        return self._get_parser('_control_metrics', 'control', reload, filters)
+
+    def ErrorMetrics(self, reload=False, **filters):
+        """Returns InteropErrorMetrics object from the 'error' binary in this dataset.
+        Optional lanes=, tiles=, cycles= filters and columns= select what to parse (see InteropBinParser)."""
+        return self._get_parser('_error_metrics', 'error', reload, filters)
+
+    def ExtractionMetrics(self, reload=False, **filters):
+        """Returns InteropExtractionMetrics object from the 'extraction' binary in this dataset.
+        Optional lanes=, tiles=, cycles= filters and columns= select what to parse (see InteropBinParser)."""
+        return self._get_parser('_extraction_metrics', 'extraction', reload, filters)
+
+    def CorrectedIntensityMetrics(self, reload=False, **filters):
+        """Returns InteropCorrectedIntensityMetrics object from the 'corint' binary in this dataset.
+        Optional lanes=, tiles=, cycles= filters and columns= select what to parse (see InteropBinParser)."""
+        return self._get_parser('_corint_metrics', 'corint', reload, filters)
 
 #TODO: ImageMetrics
 #    def ImageMetrics(self, reload=False):
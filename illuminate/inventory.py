@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# Inventory of the runs in a sequencing archive.
+#
+# scan() walks the archive with a single directory listing per directory (and one of each run's
+# InterOp directory), resolves the XML and binary filename aliases from those listings rather than
+# checking each alias on disk, and reads each run's metadata in a pool of worker processes. The
+# resulting entries (plain dicts) go into an index file of JSON lines, which read_index() and
+# query_index() read back without touching the archive again.
+
+import json, os, time
+
+try:
+    from os import scandir
+except ImportError:
+    scandir = None      # python 2: os.listdir plus a stat per entry.
+
+from .batch import describe_error, map_runs, to_builtin
+from .filemaps import BIN_FILEMAP, BINFILE_DIR_NAME, XML_FILEMAP
+from .metadata import InteropMetadata
+
+
+def list_dir(path):
+    "returns dict of name -> whether it's a directory, for each entry of directory path."
+    if scandir is None:
+        return dict((name, os.path.isdir(os.path.join(path, name))) for name in os.listdir(path))
+    return dict((entry.name, entry.is_dir()) for entry in scandir(path))
+
+def is_run(listing):
+    "tells whether a directory with this listing is a run: one holding a RunInfo.xml or an InterOp directory."
+    return bool(listing.get(BINFILE_DIR_NAME)) or XML_FILEMAP['runinfo'][0] in listing
+
+def iter_runs(rootdir):
+    """Generator yielding (path, listing) of each run directory under rootdir (rootdir included), in
+    sorted order, listing being list_dir(path). Directories within a run aren't searched; ones that
+    can't be listed are skipped."""
+    try:
+        listing = list_dir(rootdir)
+    except OSError:
+        return
+    if is_run(listing):
+        yield rootdir, listing
+        return
+    for name in sorted(name for name, is_dir in listing.items() if is_dir):
+        for run in iter_runs(os.path.join(rootdir, name)):
+            yield run
+
+def resolve_aliases(filemap, listing):
+    "returns dict of codename -> first of its aliases in filemap found in listing, for those found."
+    found = {}
+    for codename, aliases in filemap.items():
+        for name in aliases:
+            if name in listing:
+                found[codename] = name
+                break
+    return found
+
+def get_instrument(meta):
+    """returns (machine_id, model) of the run of InteropMetadata meta. Without runParameters.xml (which
+    isn't read at all when there's a CompletedJobInfo.xml), they're worked out from RunInfo.xml."""
+    if meta.model:
+        return meta.machine_id, meta.model
+    meta.machine_id = meta.machine_id or meta.rta_run_info['instrument']
+    return meta.machine_id, meta._get_model()
+
+def inventory_run(path, listing=None):
+    """Returns the inventory entry of the run in path, as a dict of plain python values:
+
+        path
+        xml: codename -> filename of its XML files
+        binaries: codename -> filename of its InterOp binaries
+        run_id, model, machine_id, flowcell_layout, read_config: from the run's metadata
+        seconds: time taken
+
+    'error' says why the run couldn't be read, if so (or is None). listing: list_dir(path), if
+    already known."""
+    start = time.time()
+    entry = { 'path': path, 'error': None, 'xml': {}, 'binaries': {} }
+    try:
+        if listing is None:
+            listing = list_dir(path)
+        entry['xml'] = resolve_aliases(XML_FILEMAP, listing)
+        if listing.get(BINFILE_DIR_NAME):
+            entry['binaries'] = resolve_aliases(BIN_FILEMAP, list_dir(os.path.join(path, BINFILE_DIR_NAME)))
+
+        meta = InteropMetadata(path, xml_paths=dict((codename, os.path.join(path, name))
+                                                    for codename, name in entry['xml'].items()))
+        machine_id, model = get_instrument(meta)
+        entry.update({ 'run_id': meta.runID,
+                       'model': model,
+                       'machine_id': machine_id,
+                       'flowcell_layout': meta.flowcell_layout,
+                       'read_config': meta.read_config })
+    except Exception as e:
+        entry['error'] = describe_error(e)
+    entry['seconds'] = time.time() - start
+    return to_builtin(entry)
+
+def scan(rootdir, workers=None):
+    """Generator yielding the inventory entry (see inventory_run) of each run under rootdir, in order
+    of completion. Metadata is read in a pool of `workers` processes (default: one per CPU; workers=1
+    reads it in this process) while the walk of rootdir goes on. A run whose worker process crashed
+    gets an entry of the same shape, with only path and error filled in."""
+    for entry in map_runs(inventory_run, iter_runs(rootdir), workers):
+        for key, value in (('xml', {}), ('binaries', {}), ('seconds', None)):
+            entry.setdefault(key, value)
+        yield entry
+
+def write_index(entries, path):
+    "writes entries (e.g. from scan()) to an index file at path, one line of JSON each. Returns their number."
+    count = 0
+    with open(path, 'w') as fh:
+        for entry in entries:
+            fh.write(json.dumps(entry, sort_keys=True) + '\n')
+            count += 1
+    return count
+
+def read_index(path):
+    "Generator yielding the entries of an index file written by write_index()."
+    with open(path) as fh:
+        for line in fh:
+            if line.strip():
+                yield json.loads(line)
+
+def query_index(path, has=(), **fields):
+    """Generator yielding the entries of the index file at path with binaries of all codenames in
+    `has`, and the given value of each of fields (entries of runs that couldn't be read have no
+    binaries, so they never match `has`), e.g.
+
+        query_index('runs.jsonl', has=['quality', 'index'], model='MiSeq')"""
+    for entry in read_index(path):
+        if all(codename in entry.get('binaries', {}) for codename in has) and \
+           all(entry.get(name) == value for name, value in fields.items()):
+            yield entry
@@ -13,41 +13,187 @@
 # by nthmost (naomi.most@invitae.com)
 # with lots of help from ECO (eric.olivares@invitae.com)
 
-import os
+import copy, os
 import xml.etree.ElementTree as ET
 from collections import OrderedDict
 from datetime import datetime
 
-import xmltodict
-
 from .filemaps import XML_FILEMAP
 from .utils import select_file_from_aliases
 
+# Values read from each XML file, kept for the life of the process: (absolute path, reader) ->
+# ((mtime, size), values). InteropMetadata of a run whose XML files haven't changed since
+# (e.g. each InteropDataset made of the same run) reads none of them again.
+_XML_CACHE = {}
+
+# elements read out of each XML file, as paths of tags below its root element.
+RUN_PATHS = ('Run', 'Run/FlowcellLayout', 'Run/Reads')
+RUNINFO_PATHS = RUN_PATHS
+COMPLETED_PATHS = ('RTARunInfo', 'RTAOutputFolder', 'StartTime', 'CompletionTime', 'Sheet/Type', 'Sheet/Header') + \
+                  tuple('RTARunInfo/' + path for path in RUN_PATHS)
+RUNPARAMS_TAGS = ('Reads', 'RTAVersion', 'RunStartDate', 'RunID', 'RunId', 'ExperimentName', 'FCPosition',
+                  'Barcode', 'ScannerID', 'InstrumentName', 'InstrumentID')
+RUNPARAMS_PATHS = RUNPARAMS_TAGS + tuple('Setup/' + tag for tag in RUNPARAMS_TAGS)   # HiSeq: all within Setup.
+RESEQSTATS_PATHS = ('RunStats',)
+RESEQSTATS_FIELDS = [ ('clusters_raw', 'NumberOfClustersRaw'),
+                      ('clusters_pf', 'NumberOfClustersPF'),
+                      ('unindexed', 'NumberOfUnindexedClusters'),
+                      ('unindexed_pf', 'NumberOfUnindexedClustersPF'),
+                      ('unaligned', 'NumberOfUnalignedClusters'),
+                      ('unaligned_pf', 'NumberOfUnalignedClustersPF'),
+                      ('duplicate', 'NumberOfDuplicateClusters') ]
+
+
+def clear_xml_cache():
+    "empties the process-wide cache of values read from XML files."
+    _XML_CACHE.clear()
+
+def iterparse_elements(filepath, paths):
+    """returns dict of path -> element for the first element at each of paths ('/'-separated tags
+    below the root element, e.g. 'Run/Reads') found in XML file at filepath, with their children.
+
+    The file is read in a single iterparse pass, which stops as soon as all paths are found. Other
+    elements are emptied as they're read, so large files (a sample sheet, a tile list) cost little."""
+    paths = set(paths)
+    found = {}
+    tags = []
+    with open(filepath, 'rb') as fh:
+        for event, elem in ET.iterparse(fh, events=('start', 'end')):
+            if event == 'start':
+                tags.append(elem.tag)
+                continue
+            path = '/'.join(tags[1:])
+            tags.pop()
+            if path in paths:
+                found.setdefault(path, elem)
+                if len(found) == len(paths):
+                    break
+            elif '/'.join(tags[1:]) not in paths:
+                elem.clear()
+    return found
+
+def read_xml(filepath, reader):
+    """returns reader(filepath), a dict of values read from an XML file, cached by the file's path,
+    mtime and size. Callers get a copy of their own, free to modify."""
+    path = os.path.abspath(filepath)
+    stat = os.stat(path)
+    fingerprint = (stat.st_mtime, stat.st_size)
+    cached = _XML_CACHE.get((path, reader))
+    if cached is None or cached[0] != fingerprint:
+        cached = (fingerprint, reader(path))
+        _XML_CACHE[(path, reader)] = cached
+    return copy.deepcopy(cached[1])
+
+def read_run_element(run_ET):
+    """returns dict of runID, rta_run_info, flowcell_layout and read_config read from the <Run> element
+    found in (at least) 2 xml files."""
+    flowcell_ET = run_ET.find('FlowcellLayout')
+
+    # Run / Reads - describes number of cycles per read (and if read is an Index) in sequencing run.
+    read_config = []
+    for read_num, item in enumerate(run_ET.find("Reads")):
+        read_config.append( {'read_num': read_num + 1,
+                             'cycles': int(item.attrib['NumCycles']),
+                             'is_index': True if item.attrib['IsIndexedRead']=='Y' else False } )
+
+    return { 'runID': run_ET.attrib['Id'],
+             'rta_run_info': { 'instrument': run_ET.find('Instrument').text,     # M00612
+                               'flowcell': run_ET.find('Flowcell').text,         # 000000000-A316T
+                               'date': run_ET.find('Date').text },               # 130208
+             'flowcell_layout': { 'lanecount': int(flowcell_ET.attrib['LaneCount']),
+                                  'surfacecount': int(flowcell_ET.attrib['SurfaceCount']),
+                                  'swathcount': int(flowcell_ET.attrib['SwathCount']),
+                                  'tilecount': int(flowcell_ET.attrib['TileCount']) },
+             'read_config': read_config }
+
+def read_RunInfo(filepath):
+    "returns values read from runInfo.xml: those of its <Run> (see read_run_element)."
+    return read_run_element(iterparse_elements(filepath, RUNINFO_PATHS)['Run'])
+
+def read_ResequencingRunStats(filepath):
+    "returns dict of resequencing_stats read from ResequencingRunStatistics.xml."
+    runstats_ET = iterparse_elements(filepath, RESEQSTATS_PATHS).get('RunStats')
+    return { 'resequencing_stats': dict((key, int(runstats_ET.find(tag).text)) for key, tag in RESEQSTATS_FIELDS) }
+
+def read_RunParameters(filepath):
+    """returns values read from runParameters.xml: its read_config, if it has one, and the text of
+    RUNPARAMS_TAGS ('' if absent) from wherever this version of the file keeps them."""
+    elems = iterparse_elements(filepath, RUNPARAMS_PATHS)
+
+    # a dirty hack to figure out which version of this file we're reading.
+    prefix = 'Setup/' if 'Setup/Reads' in elems else ''     # HiSeq; MiSeq, NextSeq and NovaSeq use the root.
+    values = dict((tag, elems[prefix + tag].text if prefix + tag in elems else '') for tag in RUNPARAMS_TAGS)
+
+    # Different format from that in CompletedJobInfo.xml (contains read Number), and two possible
+    # tags (Read, RunInfoRead) for the same thing. So fun.
+    values['Reads'] = [ {'read_num': int(read.attrib['Number']),
+                         'cycles': int(read.attrib['NumCycles']),
+                         'is_index': True if read.attrib['IsIndexedRead']=='Y' else False }
+                        for read in elems.get(prefix + 'Reads', []) ]
+    return values
+
+def read_CompletedJobInfo(filepath):
+    "returns values read from CompletedJobInfo.xml, including those of its <Run> (see read_run_element)."
+    # comments show example data from a real MiSeq run (2013/02)
+    elems = iterparse_elements(filepath, COMPLETED_PATHS)
+
+    values = {
+        # Something to be aware of: RTARunInfo contains a "version" attribute.
+        # (This parser knows how to deal with version 2.)
+        'rta_version': elems.get('RTARunInfo').attrib['Version'],
+        # original location of data output from the sequencer.
+        'output_folder': elems.get('RTAOutputFolder').text,
+        # TODO: xml_datetimes
+        'start_datetime': elems.get('StartTime').text,          # 2013-02-09T15:51:50.0811937-08:00
+        'end_datetime': elems.get('CompletionTime').text,       # 2013-02-09T16:06:44.0124452-08:00
+        # Sheet / Type: MiSeq, HiSeq, etc. Older (early 2012) XML files have no "Type" token.
+        # TODO: deprecate this attribute (can't get it from HiSeq XML)
+        'runtype': elems['Sheet/Type'].text if 'Sheet/Type' in elems else '' }
+
+    # Sheet / Header / *
+    header_ET = elems.get('Sheet/Header')
+    try:
+        values['investigator_name'] = header_ET.find("InvestigatorName").text
+        values['project_name'] = header_ET.find("ProjectName").text
+        values['experiment_name'] = header_ET.find("ExperimentName").text
+    except AttributeError:
+        pass
+
+    # RTARunInfo / Run / *
+    values.update(read_run_element(elems.get('RTARunInfo/Run')))
+    return values
+
 
 class InteropMetadata(object):
     """Parser for sequencer's XML files describing a single run. Supply with directory to instantiate.
 
     CHANGES:
         
-        0.3 (in progress) Switching to xmltodict from ElementTree.
+        0.4     Each XML file read in a single iterparse pass for just the elements we use, and the
+                values read cached per process (by path, mtime and size). No more xmltodict.
+        0.3     Switching to xmltodict from ElementTree.
         0.2.2   runParameters supports both MiSeq and HiSeq formats.
         0.2.1   No longer prioritizing CompletedJobInfo.xml (not reliably present).
         0.2     Cleaner logical process for using the various XML files. No longer throws exceptions.
         0.1     First released version.
     """
     
-    __version = 0.3     # version of this parser.
+    __version = 0.4     # version of this parser.
 
-    def __init__(self, xmldir):
+    def __init__(self, xmldir, xml_paths=None):
         """Takes the absolute path of a sequencing run data directory as sole required variable.
            Attempts to parse CompletedJobInfo.xml (or viable alias). If not available, uses 
            runParameters.xml and/or runInfo.xml, which have some overlapping info (but not all).
            
            Individual parsers can be explicitly called via their respective methods.
            
-           Be aware that parsing methods are DESTRUCTIVE to existing instance data."""
+           Be aware that parsing methods are DESTRUCTIVE to existing instance data.
+
+           xml_paths (optional): dict of codename -> path of the XML files of the run (absent ones
+           left out), when already known; xmldir is then not searched for them."""
 
         self.xmldir = xmldir
+        self._xml_paths = xml_paths
         self.experiment_name = ""        # "RU1453:::/locus/data/run_data//1337/1453"
         self.investigator_name = ""      # "Locus:::Uncle_Jesse - 612 - MiSeq"
         self.runID = ""                  # cf CompletedJobInfo.xml / RTARunInfo / Run param "Id"
@@ -112,122 +258,58 @@ class InteropMetadata(object):
                 
     def get_xml_path(self, codename):
         "returns absolute path to XML file represented by data 'codename' or None if not available."
+        if self._xml_paths is not None:
+            return self._xml_paths.get(codename)
         result = select_file_from_aliases(codename, XML_FILEMAP, self.xmldir)
         return result
 
+    def _set_values(self, values):
+        "sets instance variables from dict of values read from XML."
+        for name, value in values.items():
+            setattr(self, name, value)
+
     def parse_Run_ET(self, run_ET):
         "parses chunk of XML associated with the RTA Run Info blocks in (at least) 2 xml files."
-
-        self.rta_run_info = { 'instrument': run_ET.find('Instrument').text,     # M00612
-                              'flowcell': run_ET.find('Flowcell').text,         # 000000000-A316T
-                              'date': run_ET.find('Date').text }                # 130208
-    
-        flowcell_ET = run_ET.find('FlowcellLayout')
-        self.flowcell_layout = { 'lanecount': int(flowcell_ET.attrib['LaneCount']),
-                        'surfacecount': int(flowcell_ET.attrib['SurfaceCount']),
-                        'swathcount': int(flowcell_ET.attrib['SwathCount']),
-                        'tilecount': int(flowcell_ET.attrib['TileCount']) }     
-        
-        # Run / Reads - describes number of cycles per read (and if read is an Index) in sequencing run.
-        
         # Because parsing is understood to be destructive, and Reads can be found in multiple files,
-        # we start by emptying out whatever's currently in the read_config array for this instance.
-        
-        self.read_config = []
-        read_num = 0
-        for item in run_ET.find("Reads"):
-            read_num += 1       # redundant safety assignment to read_num
-            self.read_config.append( {'read_num': read_num,
-                                      'cycles': int(item.attrib['NumCycles']), 
-                                      'is_index': True if item.attrib['IsIndexedRead']=='Y' else False } )      
+        # whatever's currently in the read_config array for this instance is replaced.
+        values = read_run_element(run_ET)
+        del values['runID']
+        self._set_values(values)
     
     def parse_ResequencingRunStats(self, filepath):    
         """Parses ResequencingRunStatistics.xml (or viable alias) to fill instance variables."""
-        
-        # TODO: xmltodict conversion 
-
-        tree = ET.parse(filepath)
-        root = tree.getroot()   # should be "StatisticsResequencing"
-        runstats_ET = root.find("RunStats")
-        
-        self.resequencing_stats = { 'clusters_raw': int(runstats_ET.find('NumberOfClustersRaw').text),
-                                    'clusters_pf': int(runstats_ET.find('NumberOfClustersPF').text),
-                                    'unindexed': int(runstats_ET.find('NumberOfUnindexedClusters').text),
-                                    'unindexed_pf': int(runstats_ET.find('NumberOfUnindexedClustersPF').text),
-                                    'unaligned': int(runstats_ET.find('NumberOfUnalignedClusters').text),
-                                    'unaligned_pf': int(runstats_ET.find('NumberOfUnalignedClustersPF').text),
-                                    'duplicate': int(runstats_ET.find('NumberOfDuplicateClusters').text) }
+        self._set_values(read_xml(filepath, read_ResequencingRunStats))
 
     def parse_RunInfo(self, filepath):
         "parses Reads, Date, Flowcell, Instrument out of runInfo.xml"
-        
-        #buf = open(filepath).read()
-        #root = xmltodict.parse(buf)['RunInfo']
-        
-        tree = ET.parse(filepath)
-        run_ET = tree.getroot().find('Run')     #little of use in this file except <Run> subelement. 
-        
-        self.runID = run_ET.attrib['Id']
-        
-        #? is runNumber useful information? if so, what for?
-        #self.runNumber = run_ET.attrib['Number'] 
-        
-        self.parse_Run_ET(run_ET)
+        self._set_values(read_xml(filepath, read_RunInfo))
 
+    def _parse_runparams(self, values):
+        # values: as returned by read_RunParameters.
         if not self.read_config:
-            buf = open(filepath).read()
-            root = xmltodict.parse(buf)['RunInfo']
-            try:
-                Reads = root.get('Run')['Reads']['Read']
-            except KeyError:
-                pass
-
-            for read in Reads:
-                self.read_config.append(
-                    {'read_num': int(read['@Number']),
-                     'cycles': int(read['@NumCycles']),
-                     'is_index': True if read['@IsIndexedRead'] == 'Y' else False
-                     })
-
-
-    def _parse_runparams(self, xml_dict):
-        # Different format from that in CompletedJobInfo.xml (contains read Number).
-        # And there are two possible keys to indicate the same datastructure. So fun.
+            self.read_config = values['Reads']
 
-        if not self.read_config:
-            try:
-                Reads = xml_dict.get('Reads')['Read']
-            except KeyError:
-                Reads = xml_dict.get('Reads')['RunInfoRead']
-
-            for read in Reads:
-                self.read_config.append(
-                    {'read_num': int(read['@Number']),
-                     'cycles': int(read['@NumCycles']),
-                     'is_index': True if read['@IsIndexedRead']=='Y' else False 
-                    } )
-
-        self.rta_version = xml_dict.get('RTAVersion', '')
+        self.rta_version = values['RTAVersion']
         
-        rawdate = xml_dict.get('RunStartDate', '')    # format: 130208 YYMMDD
+        rawdate = values['RunStartDate']    # format: 130208 YYMMDD
         if rawdate: 
             self.start_datetime = datetime.strptime(rawdate, '%y%m%d')
             
-        self.runID = xml_dict.get('RunID', '')
+        self.runID = values['RunID']
         # NovaSeq
         if self.runID == "":
-            self.runID = xml_dict.get('RunId', '')
-        self.experiment_name = xml_dict.get('ExperimentName', '')
-        self.flowcell_position = xml_dict.get('FCPosition', '')
-        self.flowcell_barcode = xml_dict.get('Barcode', '')
-        self.machine_id = xml_dict.get('ScannerID', '')
+            self.runID = values['RunId']
+        self.experiment_name = values['ExperimentName']
+        self.flowcell_position = values['FCPosition']
+        self.flowcell_barcode = values['Barcode']
+        self.machine_id = values['ScannerID']
 
         # NextSeq / NovaSeq
         if self.machine_id == '':
-            if "InstrumentName" in xml_dict:
-                self.machine_id = xml_dict.get('InstrumentName', '')  # NovaSeq
+            if values['InstrumentName']:
+                self.machine_id = values['InstrumentName']  # NovaSeq
             else:
-                self.machine_id = xml_dict.get('InstrumentID', '')  # NextSeq
+                self.machine_id = values['InstrumentID']  # NextSeq
             # Although there is no A/B position we can still read it out from the run folder name
             self.flowcell_position = self.runID.split('_')[-1][0]
             self.flowcell_barcode = self.rta_run_info['flowcell']
@@ -238,18 +320,7 @@ class InteropMetadata(object):
 
         Need to implement further since HiSeq output has no CompletedJobInfo.xml
         """
-        buf = open(filepath).read()
-        root = xmltodict.parse(buf)['RunParameters']
-
-        # a dirty hack to figure out which version of this file we're reading.
-        setup = root.get("Setup")
-        if setup and 'Reads' in setup:
-            self._parse_runparams(setup)                # HiSeq
-        elif 'Reads' in root:
-            self._parse_runparams(root)                 # MiSeq
-        else:
-            self._parse_runparams(root)                 # NextSeq / NovaSeq
-
+        self._parse_runparams(read_xml(filepath, read_RunParameters))
         self.model = self._get_model()
 
 
@@ -258,48 +329,7 @@ class InteropMetadata(object):
         
         Not all machines generate this file, so we avoid relying on it.
         """
-
-        # TODO: xmltodict conversion 
-
-        # comments show example data from a real MiSeq run (2013/02)
-        tree = ET.parse(filepath)
-        root = tree.getroot()       #should be "AnalysisJobInfo"
-    
-        # Something to be aware of: RTARunInfo contains a "version" attribute.
-        # (This parser knows how to deal with version 2.)
-        self.rta_version = root.find("RTARunInfo").attrib['Version']
-
-        # original location of data output from the sequencer.
-        self.output_folder = root.find("RTAOutputFolder").text 
-        
-        # TODO: xml_datetimes
-        self.start_datetime = root.find("StartTime").text           # 2013-02-09T15:51:50.0811937-08:00
-        self.end_datetime = root.find("CompletionTime").text        # 2013-02-09T16:06:44.0124452-08:00
-        
-        # dechunk all of the major sections we want to extract data from.
-        sheet_ET = root.find("Sheet")
-        header_ET = sheet_ET.find("Header")
-        run_ET = root.find("RTARunInfo").find("Run")
-        
-        # Sheet / *
-        # TODO: deprecate this attribute (can't get it from HiSeq XML)
-        try:
-            self.runtype = sheet_ET.find("Type").text       # MiSeq, HiSeq, etc.
-        except AttributeError:
-            #older (early 2012) XML files have no "Type" token.
-            self.runtype = ""
-                
-        # Sheet / Header / *
-        try:
-            self.investigator_name = header_ET.find("InvestigatorName").text
-            self.project_name = header_ET.find("ProjectName").text
-            self.experiment_name = header_ET.find("ExperimentName").text
-        except AttributeError:
-            pass
-
-        # RTARunInfo / Run / *          
-        self.runID = run_ET.attrib["Id"] 
-        self.parse_Run_ET(run_ET)
+        self._set_values(read_xml(filepath, read_CompletedJobInfo))
 
     def _get_model(self):
         """
@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 
-import pandas
+import numpy
 
-from .base_parser_class import InteropBinParser
+from .base_parser_class import InteropBinParser, count_records
 from .utils import set_column_sequence
 
 class InteropQualityMetrics(InteropBinParser):
@@ -18,6 +18,9 @@ class InteropQualityMetrics(InteropBinParser):
     # for v6
     number_of_quality_score_bins = 7
 
+    # the coordinate plane (.idf) and the quality cube are indexed by these.
+    required_columns = ('cycle', 'lane', 'tile')
+
     def _init_variables(self):
         self._setup_read_tiers()
 
@@ -57,13 +60,6 @@ class InteropQualityMetrics(InteropBinParser):
         for qual in range(1, self.number_of_quality_score_bins + 1):
             self.qcol_sequence.append('q' + str(qual))
 
-    def setup_data(self):
-        self.data = {'lane': [], 'cycle': [], 'tile': []}
-
-        for qual in self.qcol_sequence:
-            self.data[qual] = []
-
-
     def get_df_col_sequence(self):
         "returns array of column names in correct order for DataFrame (.df)"
         out = ['cycle', 'lane', 'tile']
@@ -82,39 +78,38 @@ class InteropQualityMetrics(InteropBinParser):
             if read['is_index']:
                 return self.get_qscore_percentage(target_qscore, read['read_num']-1)
 
-    def get_qscore_percentage(self, target_qscore=30, read_num=-1):
+    def get_read_cycles(self, read_num):
+        """Returns (start, end) slice of cycle indices (cycle number - 1) covered by read_num.
+        Let IndexError be raised for too-high read_num."""
+        # read_tiers example: [151,157,308] -> read 1 (0-based) covers cycles 152-157.
+        end = self.read_tiers[read_num]
+        start = self.read_tiers[read_num - 1] if read_num > 0 else 0
+        return start, end
+
+    def get_qscore_percentage(self, target_qscore=30, read_num=-1, lane=None, tile=None, surface=None, swath=None):
         """Returns PERCENTAGE of quality scores at or above target_qscore.
 
         Supplying read_num=-1 returns qscore percentage across all reads.
+        Supplying lane, tile, surface and/or swath restricts the percentage to those tiles.
 
         :param target_qscore: int designates target quality level (default: 30)
-        :param read_num: int specifies read number (default: -1)."
+        :param read_num: int specifies read number (default: -1).
+        :param lane: int lane number (default: None, meaning all lanes)
+        :param tile: int tile number (default: None, meaning all tiles)
+        :param surface: int surface number (default: None, meaning both surfaces)
+        :param swath: int swath number (default: None, meaning all swaths)
         """
 
-        q_upper_cols = [x for x in self.data.keys() if x[0]=='q' and int(x[1:]) > target_qscore-1 ]
-        q_upper_df = self.idf[q_upper_cols]
-
-        if read_num==-1:
-            # return %>=qn for entire data set.
-            q_upper_sum = q_upper_df.values.sum()
-            q_total_sum = self.idf.values.sum()
-
-        else:
-            # segment Qscores by read_num. Let IndexError be raised for too-high read_num.
-            # read_tiers example: [151,157,308]
-
-            cycle_start = 0 if read_num == 0 else self.read_tiers[read_num - 1] + 1
-            cycle_end = self.read_tiers[read_num]
-
-            tiles = self.flowcell_layout['tilecount']
-            lanes = self.flowcell_layout['lanecount']
-            surfaces = self.flowcell_layout['surfacecount']
-
-            i_start = 0 if read_num==0 else cycle_start * tiles * lanes * surfaces
-            i_end = cycle_end * tiles * lanes * surfaces
+        cube = self.qcube_ge
+        if read_num != -1:
+            start, end = self.get_read_cycles(read_num)
+            cube = cube[start:end]
+        cube = self.coords.select(cube, lane=lane, tile=tile, surface=surface, swath=swath)
 
-            q_upper_sum = q_upper_df[i_start:i_end].values.sum()
-            q_total_sum = self.idf[i_start:i_end].values.sum()
+        # first bin holding scores >= target_qscore; reverse cumsum makes its column the sum of the upper bins.
+        qbin = numpy.searchsorted(self.qcube_scores, target_qscore)
+        q_upper_sum = cube[..., qbin].sum() if qbin < len(self.qcube_scores) else 0
+        q_total_sum = cube[..., 0].sum() if len(self.qcube_scores) else 0
 
         # Return a percentage (like in Illumina SAV)
         if q_total_sum:
@@ -122,17 +117,51 @@ class InteropQualityMetrics(InteropBinParser):
         else:
             return 0
 
+    def make_qscore_cube(self):
+        """Builds the dense (cycle x lane x tile x qbin) cube of the number of clusters scoring at or above
+        each q-bin from self.data, as .qcube_ge (so qcube_ge[..., b] counts clusters scoring at or above
+        bin b, and qcube_ge[..., 0] all clusters). Counts per bin (.qcube) are derived from it when asked
+        for. The cube is laid out on .coords: lane and tile numbers along its axes are in .qcube_lanes
+        and .qcube_tiles, the Q-score of each bin in .qcube_scores. Cycles and tiles absent from the
+        data count 0. It is held as uint32 unless counts could exceed what that holds."""
+
+        if self.apparent_file_version == 6 and self.remapped_scores:
+            # binned v6 records have one column per bin, each standing for its remapped score.
+            self.qcube_scores = numpy.array(self.remapped_scores)
+        else:
+            self.qcube_scores = numpy.arange(1, len(self.qcol_sequence) + 1)
+
+        counts = numpy.column_stack([self.data[qual] for qual in self.qcol_sequence]).astype(numpy.uint64) \
+                    if self.qcol_sequence else numpy.zeros((count_records(self.data), 0), dtype=numpy.uint64)
+        # reverse cumulative sum per record, so only one cube is ever built.
+        counts_ge = counts[:, ::-1].cumsum(axis=1)[:, ::-1]
+        del counts
+
+        lanes, tiles, cycles = self.data['lane'], self.data['tile'], self.data['cycle']
+        per_slot = self.coords.count_per_slot(lanes, tiles, cycles)
+        if counts_ge.shape[1] and len(counts_ge) and \
+           int(counts_ge[:, 0].max()) * per_slot <= numpy.iinfo(numpy.uint32).max:
+            counts_ge = counts_ge.astype(numpy.uint32)
+        # add rather than assign only if a (cycle, lane, tile) was reported more than once.
+        self.qcube_ge = self.coords.make_array(lanes, tiles, cycles, counts_ge, fill=0, add=per_slot > 1)
+        self.qcube_lanes = self.coords.lanes
+        self.qcube_tiles = self.coords.tiles
+
+    @property
+    def qcube(self):
+        "Dense (cycle x lane x tile x qbin) cube of cluster counts per q-bin; computed from .qcube_ge on each access."
+        qcube = self.qcube_ge.copy()
+        qcube[..., :-1] -= self.qcube_ge[..., 1:]
+        return qcube
 
     def get_binning_stats(self):
         return {'upper_boundary': self.upper_boundary,
                 'lower_boundary': self.lower_boundary,
                 'remapped_scores': self.remapped_scores}
 
-    def parse_binary(self):
-        """ Do the work.  Important: set read_config appropriately, which is
-            needed to construct read_tiers to separate Q scores by Read."""
-
-        bs = self.bs
+    def parse_header(self):
+        """Reads version, record length and (v5/v6) Q-score binning header, then sets up the
+        q-score columns. Returns the length of the header in bytes."""
 
         # v4 QualityMetrics format of MiSeq and other HiSeq platforms according to ILMN specs:
         #
@@ -180,22 +209,23 @@ class InteropQualityMetrics(InteropBinParser):
 
         number_of_qual_bins = 0
 
-        self.apparent_file_version, recordlen = bs.readlist('2*uintle:8')
+        self.apparent_file_version, self.recordlen = self.read_bytes(0, 2)
         self.check_version(self.apparent_file_version)
+        header_len = 2
 
         if (self.apparent_file_version in [5, 6]):
-            self.binning_on = bs.read('uintle:8')
+            self.binning_on = self.read_bytes(header_len, 1)[0]
+            header_len += 1
             if (self.binning_on == 1):
-                number_of_qual_bins = bs.read('uintle:8')
-                # lower boundary of quality score bins
-                for lower in range(0, number_of_qual_bins):
-                    self.lower_boundary.append(bs.read('uintle:8'))
-                for upper in range(0, number_of_qual_bins):
-                    self.upper_boundary.append(bs.read('uintle:8'))
-                for remap in range(0, number_of_qual_bins):
-                    self.remapped_scores.append(bs.read('uintle:8'))
-                    # print("[%s] Info: Q-score binning was used with %s bins and these remapped scores: %s" \
-                    #     % (self.__class__.__name__, number_of_qual_bins, self.remapped_scores))
+                number_of_qual_bins = self.read_bytes(header_len, 1)[0]
+                header_len += 1
+                # lower boundary, upper boundary, and remapped scores of quality score bins
+                self.lower_boundary = self.read_bytes(header_len, number_of_qual_bins)
+                header_len += number_of_qual_bins
+                self.upper_boundary = self.read_bytes(header_len, number_of_qual_bins)
+                header_len += number_of_qual_bins
+                self.remapped_scores = self.read_bytes(header_len, number_of_qual_bins)
+                header_len += number_of_qual_bins
 
         if self.apparent_file_version == 6:
             self.number_of_quality_score_bins = number_of_qual_bins
@@ -203,24 +233,38 @@ class InteropQualityMetrics(InteropBinParser):
             self.number_of_quality_score_bins = self.num_quality_scores
 
         self.set_qcol_sequence()
-        self.setup_data()
-
-        #read records bytewise per specs in technote_rta_theory_operations.pdf from ILMN
-        for i in range(0,int((bs.len) / (recordlen * 8))):  # 206 * 8 = 1648 record length in bits
-
-            lane, tile, cycle = bs.readlist('3*uintle:16')
-            self.data['lane'].append(lane)
-            self.data['tile'].append(tile)
-            self.data['cycle'].append(cycle)
-
-            qual_list = bs.readlist(str(self.number_of_quality_score_bins) + '*uintle:32')
-            for qual in range(0, self.number_of_quality_score_bins):  # (50 entries of 4 bytes each)
-                self.data['q' + str(qual + 1)].append(qual_list[qual])
-
-        self.df = set_column_sequence(pandas.DataFrame(self.data), self.qcol_sequence)
+        return header_len
+
+    def get_record_layout(self):
+        "lane, tile, cycle (uint16) followed by one uint32 cluster count per Q-score (bin)."
+        layout = [('lane', '<u2'), ('tile', '<u2'), ('cycle', '<u2')]
+        layout.extend([(qual, '<u4') for qual in self.qcol_sequence])
+        return layout
+
+    def get_decode_columns(self):
+        "The quality cube needs every q-score column, whether or not they go into the DataFrame."
+        decode_columns = InteropBinParser.get_decode_columns(self)
+        if decode_columns is None:
+            return None
+        return decode_columns | set(self.qcol_sequence)
+
+    def make_dataframe(self, data):
+        "Returns a DataFrame built from data (restricted to the selected columns), with the q-score columns first."
+        df = InteropBinParser.make_dataframe(self, data)
+        return set_column_sequence(df, [qual for qual in self.qcol_sequence if qual in df.columns])
+
+    def make_index_frame(self):
+        "Returns the (flattened) coordinate plane of .df, served as .idf."
+        return self.make_coordinate_plane(self.df, flatten=True)
+
+    def _process_data(self):
+        """ Do the work.  Important: set read_config appropriately, which is
+            needed to construct read_tiers to separate Q scores by Read."""
 
-        self.idf = self.make_coordinate_plane(self.df, flatten=True)
+        self.make_qscore_cube()
 
+        # reset, since update() re-runs this method.
+        self.read_qscore_results = {'readnum': [], 'q30': [], 'q20': [] }
         for read_num in range(self.num_reads):
             q30 = self.get_qscore_percentage(30, read_num)
             q20 = self.get_qscore_percentage(20, read_num)
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+#
+# Persistent store of run summaries.
+#
+# SummaryStore keeps per-run, per-read, per-lane and per-index summaries of many runs in a SQLite
+# file, so fleet-level questions are answered from the store rather than by parsing binaries again.
+# Runs are summarized in worker processes (see batch.map_runs) and written by the parent, one
+# transaction per run. Each run's fingerprint (name, size and mtime of its XML files and binaries)
+# is stored with it, so ingesting the same runs again only summarizes those new or changed since.
+
+import hashlib, os, sqlite3, time
+from datetime import datetime
+
+import numpy
+
+from .batch import describe_error, map_runs, summarize_error, to_builtin
+from .exceptions import InteropFileNotFoundError
+from .filemaps import BIN_FILEMAP, BINFILE_DIR_NAME, XML_FILEMAP
+from .interop import InteropDataset
+from .inventory import get_instrument, iter_runs, list_dir, resolve_aliases
+
+SCHEMA_VERSION = 1          # kept in the file's user_version; bump when TABLES change.
+
+# table -> its columns (name, SQL type). Each table is keyed by the run's path (plus the column that
+# follows it, but for runs).
+TABLES = { 'runs': [ ('path', 'TEXT PRIMARY KEY'), ('fingerprint', 'TEXT'), ('ingested', 'REAL'),
+                     ('error', 'TEXT'), ('errors', 'TEXT'),
+                     ('run_id', 'TEXT'), ('run_date', 'TEXT'), ('model', 'TEXT'), ('machine_id', 'TEXT'),
+                     ('lanes', 'INTEGER'), ('tiles', 'INTEGER'), ('cycles', 'INTEGER'),
+                     ('cluster_density', 'REAL'), ('cluster_density_pf', 'REAL'),
+                     ('num_clusters', 'REAL'), ('num_clusters_pf', 'REAL'), ('percent_pf', 'REAL'),
+                     ('aligned', 'REAL'), ('q20', 'REAL'), ('q30', 'REAL'), ('error_rate', 'REAL') ],
+           'reads': [ ('path', 'TEXT'), ('read_num', 'INTEGER'), ('cycles', 'INTEGER'), ('is_index', 'INTEGER'),
+                      ('phasing', 'REAL'), ('prephasing', 'REAL'), ('q20', 'REAL'), ('q30', 'REAL'),
+                      ('error_rate', 'REAL') ],
+           'lanes': [ ('path', 'TEXT'), ('lane', 'INTEGER'), ('cluster_density', 'REAL'), ('cluster_density_pf', 'REAL'),
+                      ('num_clusters', 'REAL'), ('num_clusters_pf', 'REAL'), ('q20', 'REAL'), ('q30', 'REAL'),
+                      ('error_rate', 'REAL') ],
+           'indexes': [ ('path', 'TEXT'), ('index_str', 'TEXT'), ('project', 'TEXT'), ('name', 'TEXT'),
+                        ('clusters', 'INTEGER') ] }
+
+# reducers of SummaryStore.aggregate().
+AGGREGATES = { 'median': numpy.median, 'mean': numpy.mean, 'min': numpy.min, 'max': numpy.max,
+               'std': numpy.std, 'count': len }
+
+# formats of RunInfo.xml's <Date>: older instruments, then newer ones.
+RUN_DATE_FORMATS = ['%y%m%d', '%m/%d/%Y %I:%M:%S %p']
+
+
+def fingerprint_run(path):
+    """returns SHA1 (hex) of the names, sizes and mtimes of the XML files and InterOp binaries of the run
+    in path: it changes whenever any of them do."""
+    listing = list_dir(path)
+    files = [os.path.join(path, name) for name in resolve_aliases(XML_FILEMAP, listing).values()]
+    if listing.get(BINFILE_DIR_NAME):
+        bindir = os.path.join(path, BINFILE_DIR_NAME)
+        files += [os.path.join(bindir, name) for name in resolve_aliases(BIN_FILEMAP, list_dir(bindir)).values()]
+
+    sha1 = hashlib.sha1()
+    for filepath in sorted(files):
+        stat = os.stat(filepath)
+        sha1.update(('%s %i %r\n' % (os.path.basename(filepath), stat.st_size, stat.st_mtime)).encode('utf-8'))
+    return sha1.hexdigest()
+
+def parse_run_date(date):
+    "returns RunInfo.xml's <Date> as YYYY-MM-DD, or None if in no known format."
+    for fmt in RUN_DATE_FORMATS:
+        try:
+            return datetime.strptime(date, fmt).strftime('%Y-%m-%d')
+        except (TypeError, ValueError):
+            pass
+    return None
+
+def fill_tile(tile, summary):
+    "fills summary (as made by collect_run) from TileMetrics parser tile."
+    summary['run'].update({ 'cluster_density': tile.mean_cluster_density,
+                            'cluster_density_pf': tile.mean_cluster_density_pf,
+                            'num_clusters': tile.num_clusters,
+                            'num_clusters_pf': tile.num_clusters_pf,
+                            'percent_pf': tile.percent_pf_clusters,
+                            'aligned': tile.aligned })
+    for read, phasing, prephasing in zip(summary['reads'], tile.mean_phasing, tile.mean_prephasing):
+        read.update({ 'phasing': phasing, 'prephasing': prephasing })
+
+    lane_summaries = tile.lane_summaries
+    for lane in summary['lanes']:
+        if lane['lane'] in lane_summaries:
+            lane.update(dict((name, lane_summaries[lane['lane']][name]) for name in
+                             ('cluster_density', 'cluster_density_pf', 'num_clusters', 'num_clusters_pf')))
+
+def fill_quality(quality, summary):
+    "fills summary (as made by collect_run) from QualityMetrics parser quality."
+    summary['run'].update({ 'q20': quality.get_qscore_percentage(20), 'q30': quality.get_qscore_percentage(30) })
+    for num, read in enumerate(summary['reads']):
+        read.update({ 'q20': quality.get_qscore_percentage(20, num), 'q30': quality.get_qscore_percentage(30, num) })
+    for lane in summary['lanes']:
+        lane.update({ 'q20': quality.get_qscore_percentage(20, lane=lane['lane']),
+                      'q30': quality.get_qscore_percentage(30, lane=lane['lane']) })
+
+def fill_error(error, summary):
+    "fills summary (as made by collect_run) with mean error rates from ErrorMetrics parser error."
+    rates = summarize_error(error)
+    summary['run']['error_rate'] = rates['mean_rate']
+    for num, read in enumerate(summary['reads']):
+        read['error_rate'] = rates['reads'].get(num)
+    for lane in summary['lanes']:
+        lane['error_rate'] = rates['lanes'].get(lane['lane'])
+
+def fill_index(index, summary):
+    "fills summary (as made by collect_run) with the clusters of each index from IndexMetrics parser index."
+    summary['indexes'] = [ { 'index_str': index_str, 'project': result['project'], 'name': result['name'],
+                             'clusters': result['clusters'] }
+                           for index_str, result in sorted(index.results.items()) ]
+
+# (name for errors, InteropDataset accessor, function filling the summary from the parser).
+SUMMARIZERS = [ ('tile', 'TileMetrics', fill_tile),
+                ('quality', 'QualityMetrics', fill_quality),
+                ('error', 'ErrorMetrics', fill_error),
+                ('index', 'IndexMetrics', fill_index) ]
+
+def collect_run(path, fingerprint=None, **kwargs):
+    """Returns the summaries of the run in path that SummaryStore keeps, as a dict of plain python values:
+    'run' (a row of the runs table), 'reads', 'lanes' and 'indexes' (lists of rows of those tables).
+
+    Missing binaries leave their columns None; the errors of those failing to parse go into the run's
+    'errors'; if the run can't be read at all, its 'error' says why. Keyword arguments go to
+    InteropDataset (default: backend='numpy')."""
+    start = time.time()
+    run = { 'path': path, 'fingerprint': fingerprint, 'error': None, 'errors': None }
+    summary = { 'path': path, 'run': run, 'reads': [], 'lanes': [], 'indexes': [] }
+    try:
+        dataset = InteropDataset(path, **dict({ 'backend': 'numpy' }, **kwargs))
+        meta = dataset.meta
+        layout = meta.flowcell_layout
+        machine_id, model = get_instrument(meta)
+        run.update({ 'run_id': meta.runID,
+                     'run_date': parse_run_date(meta.rta_run_info['date']),
+                     'model': model,
+                     'machine_id': machine_id,
+                     'lanes': layout.get('lanecount'),
+                     'tiles': layout['surfacecount'] * layout['swathcount'] * layout['tilecount'] if layout else None,
+                     'cycles': sum(read['cycles'] for read in meta.read_config) })
+        summary['reads'] = [ { 'path': path, 'read_num': read['read_num'], 'cycles': read['cycles'],
+                               'is_index': int(read['is_index']) } for read in meta.read_config ]
+        summary['lanes'] = [ { 'path': path, 'lane': lane } for lane in range(1, (layout.get('lanecount') or 0) + 1) ]
+
+        errors = []
+        for name, accessor, summarize in SUMMARIZERS:
+            try:
+                summarize(getattr(dataset, accessor)(), summary)
+            except InteropFileNotFoundError:
+                pass
+            except Exception as e:
+                errors.append('%s: %s' % (name, describe_error(e)))
+        run['errors'] = '\n'.join(errors) or None
+    except (Exception, InteropFileNotFoundError) as e:
+        run['error'] = describe_error(e)
+    for row in summary['indexes']:
+        row['path'] = path
+    summary['seconds'] = time.time() - start
+    return to_builtin(summary)
+
+
+class SummaryStore(object):
+    """SQLite file of run summaries (see TABLES), filled by ingest() and read by query() / aggregate().
+
+        store = SummaryStore('runs.sqlite')
+        store.ingest_tree('/archive/runs', workers=8)
+        store.aggregate('q30', by='machine_id', how='median', since='2017-07-01')
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self._create_tables()
+
+    def _create_tables(self):
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version not in (0, SCHEMA_VERSION):
+            raise ValueError('%s holds a store of schema version %i, not %i' % (self.path, version, SCHEMA_VERSION))
+        with self.connection:
+            for table, columns in TABLES.items():
+                key = '' if table == 'runs' else ', PRIMARY KEY (path, %s)' % columns[1][0]
+                self.connection.execute('CREATE TABLE IF NOT EXISTS %s (%s%s)' % (table,
+                                        ', '.join('%s %s' % column for column in columns), key))
+            self.connection.execute('PRAGMA user_version = %i' % SCHEMA_VERSION)
+
+    def close(self):
+        self.connection.close()
+
+    def get_fingerprints(self):
+        "returns dict of path -> fingerprint of the runs in the store."
+        return dict(self.connection.execute('SELECT path, fingerprint FROM runs').fetchall())
+
+    def add(self, summary):
+        "writes summary of a run (as returned by collect_run), replacing what the store had of that run."
+        with self.connection:
+            self._delete(summary['path'])
+            summary['run']['ingested'] = time.time()
+            for table, rows in (('runs', [summary['run']]), ('reads', summary['reads']),
+                                ('lanes', summary['lanes']), ('indexes', summary['indexes'])):
+                names = [name for name, sqltype in TABLES[table]]
+                self.connection.executemany('INSERT INTO %s (%s) VALUES (%s)' % (table, ', '.join(names),
+                                            ', '.join('?' * len(names))),
+                                            [[row.get(name) for name in names] for row in rows])
+
+    def remove(self, path):
+        "removes run in path from the store."
+        with self.connection:
+            self._delete(path)
+
+    def _delete(self, path):
+        "deletes the rows of run in path, within the caller's transaction."
+        for table in TABLES:
+            self.connection.execute('DELETE FROM %s WHERE path = ?' % table, (path,))
+
+    def ingest(self, paths, workers=None, **kwargs):
+        """Summarizes the runs in paths that are new to the store or have changed since they were added
+        (their fingerprint differs), in a pool of `workers` processes (see batch.map_runs), and adds
+        them. Keyword arguments go to InteropDataset. Returns dict of counts of 'added', 'updated',
+        'unchanged' and 'failed' runs (failed ones are added too, with their error, and are tried
+        again on the next ingest whether or not they changed)."""
+        stored = self.get_fingerprints()
+        for (path,) in self.connection.execute('SELECT path FROM runs WHERE error IS NOT NULL'):
+            stored[path] = None         # stale: the failure may have been temporary.
+        counts = { 'added': 0, 'updated': 0, 'unchanged': 0, 'failed': 0 }
+        runs = []
+        for path in paths:
+            try:
+                fingerprint = fingerprint_run(path)
+            except OSError:
+                fingerprint = None      # collect_run says what's wrong.
+            if fingerprint is not None and stored.get(path) == fingerprint:
+                counts['unchanged'] += 1
+            else:
+                runs.append((path, fingerprint))
+
+        for summary in map_runs(collect_run, runs, workers, **kwargs):
+            if 'run' not in summary:        # its worker process died.
+                summary = { 'path': summary['path'], 'reads': [], 'lanes': [], 'indexes': [],
+                            'run': { 'path': summary['path'], 'error': summary['error'] } }
+            if summary['run']['error']:
+                counts['failed'] += 1
+            else:
+                counts['updated' if summary['path'] in stored else 'added'] += 1
+            self.add(summary)
+        return counts
+
+    def ingest_tree(self, rootdir, workers=None, prune=False, **kwargs):
+        """ingest() of every run directory under rootdir (see inventory.iter_runs). With prune=True, runs
+        stored under rootdir that are no longer found there are removed, and counted as 'removed'."""
+        paths = [path for path, listing in iter_runs(rootdir)]
+        counts = self.ingest(paths, workers, **kwargs)
+        if prune:
+            found = set(paths)
+            prefix = os.path.join(rootdir, '')
+            gone = [path for path in self.get_fingerprints()
+                    if (path == rootdir or path.startswith(prefix)) and path not in found]
+            with self.connection:
+                for path in gone:
+                    self._delete(path)
+            counts['removed'] = len(gone)
+        return counts
+
+    def query(self, sql, params=()):
+        "returns rows of SQL query on the store, as dicts of column -> value."
+        return [dict(zip(row.keys(), row)) for row in self.connection.execute(sql, params)]
+
+    def aggregate(self, column, by='machine_id', how='median', table='runs', since=None, until=None):
+        """Returns dict of value of runs column `by` -> `how` (one of AGGREGATES) of `column` of
+        `table`, over runs without an error whose run_date is within since - until (YYYY-MM-DD,
+        inclusive) if given. Rows where column is NULL don't count. E.g. the median Q30 of each
+        instrument's reads last quarter: aggregate('q30', table='reads', since='2017-07-01')."""
+        if column not in dict(TABLES[table]) or by not in dict(TABLES['runs']):
+            raise ValueError('no column %r in %s, or %r in runs' % (column, table, by))
+        sql = 'SELECT runs.%s, %s.%s FROM %s JOIN runs USING (path) WHERE runs.error IS NULL AND %s.%s IS NOT NULL' % (
+              by, table, column, table, table, column) if table != 'runs' else \
+              'SELECT %s, %s FROM runs WHERE error IS NULL AND %s IS NOT NULL' % (by, column, column)
+        params = []
+        if since is not None:
+            sql += ' AND runs.run_date >= ?'
+            params.append(since)
+        if until is not None:
+            sql += ' AND runs.run_date <= ?'
+            params.append(until)
+
+        groups = {}
+        for key, value in self.connection.execute(sql, params):
+            groups.setdefault(key, []).append(value)
+        reducer = AGGREGATES[how]
+        return dict((key, to_builtin(reducer(numpy.array(values)))) for key, values in groups.items())
@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""Writes synthetic InterOp binaries.
+
+Every binary format version the parsers support can be written, for any flowcell_layout and
+read_config, with cluster counts, densities, Q-scores, error rates etc. drawn around chosen
+values (see DEFAULT_STATS). Useful to load-test parsers at instrument scales we have no sample
+data for, and to check that parsers decode exactly what was written:
+
+    data = write_binary('QMetricsOut.bin', 'quality', version=6, flowcell_layout=layout, q30=0.9)
+    parser = InteropQualityMetrics('QMetricsOut.bin', flowcell_layout=layout)
+    # parser.data['q33'] == data['q33'], parser.read_qscore_results['q30'] ~ 90%, etc.
+
+Records are generated in the order instruments write them: by cycle (if the format has cycles),
+then lane, then tile. Generation is vectorized and seeded, so the same arguments give the same bytes.
+"""
+
+import os
+import struct
+
+import numpy
+
+from .base_parser_class import FLOWCELL_LAYOUT_DEFAULTS, READ_CONFIG_DEFAULTS, STRING, encode_records
+from .coordinates import get_tile_numbers
+from .extraction_metrics import DOTNET_TICKS_AT_EPOCH
+from .filemaps import BINFILE_DIR_NAME, BIN_FILEMAP
+from .interop import get_parser_class
+
+# Central values of generated metrics; override any of them as keyword arguments of make_binary() etc.
+DEFAULT_STATS = { 'clusters': 600000,       # raw clusters per tile
+                  'clusters_cv': 0.05,      # coefficient of variation of clusters across tiles
+                  'density': 1000000.,      # raw cluster density (per mm2) of a tile of 'clusters' clusters
+                  'pf': 0.85,               # fraction of clusters passing filter
+                  'q30': 0.85,              # fraction of base calls >= Q30
+                  'q30_sd': 0.02,           # standard deviation of that fraction across records
+                  'error_rate': 0.5,        # error rate (%) of aligned reads
+                  'phasing': 0.001,
+                  'prephasing': 0.002,
+                  'aligned': 2.0,           # percent of clusters aligned (to PhiX)
+                  'intensity': 1000.,       # mean raw intensity
+                  'fwhm': 2.7,              # mean focus (FWHM of spots)
+                  'noise_cv': 0.05,         # coefficient of variation of intensities, FWHM, phasing...
+                  'signoise': 10.,          # signal to noise ratio (CorrectedIntMetrics v2)
+                  'indexes': 4,             # samples (indexes) in Index and Control metrics
+                  'controls': 2,            # controls in Control metrics
+                  'start_time': 1400000000, # unix time of the extraction of cycle 1
+                  'cycle_seconds': 300,     # time between extractions of consecutive cycles
+                }
+
+# Q-score bins written to binned Quality metrics by default, as (lower, upper, remapped) scores.
+# This is the 7-bin scheme of HiSeq 2500 / HiSeq X.
+DEFAULT_QUALITY_BINS = ([2, 10, 20, 25, 30, 35, 40],
+                        [9, 19, 24, 29, 34, 39, 41],
+                        [6, 15, 22, 27, 33, 37, 40])
+
+# Q-scores of unbinned Quality metrics that get clusters (Q1 and Q41-Q50 stay empty, as in real runs).
+UNBINNED_SCORES = range(2, 41)
+
+
+#### Coordinates
+
+def make_grid(*axes):
+    "Returns list of arrays holding every combination of values of axes, the first axis varying slowest."
+    return [axis.ravel() for axis in numpy.meshgrid(*[numpy.asarray(axis) for axis in axes], indexing='ij')]
+
+def get_cycle_count(read_config):
+    return sum(read['cycles'] for read in read_config)
+
+
+#### Record generation
+
+def _noisy(rng, mean, cv, shape):
+    "Returns non-negative values around mean with coefficient of variation cv."
+    return numpy.clip(rng.normal(mean, abs(mean) * cv, shape), 0, None)
+
+def _split(totals, n):
+    "Splits each of totals (integers) into n nearly equal integer parts (columns) that sum to it exactly."
+    edges = (totals[:, None] * numpy.arange(n + 1)) // n
+    return numpy.diff(edges, axis=1)
+
+class RecordGenerator(object):
+    """Generates the columns of records of one binary. Per-tile values (clusters, passing filter)
+    are drawn first, so that different binaries of the same seed and layout describe the same tiles."""
+
+    def __init__(self, flowcell_layout, read_config, seed=0, **stats):
+        unknown = set(stats) - set(DEFAULT_STATS)
+        if unknown:
+            raise ValueError("unknown statistic(s): %s" % ', '.join(sorted(unknown)))
+        self.stats = dict(DEFAULT_STATS, **stats)
+        self.flowcell_layout = flowcell_layout
+        self.read_config = read_config
+        self.rng = numpy.random.RandomState(seed)
+
+        self.lanes = numpy.arange(1, flowcell_layout['lanecount'] + 1)
+        self.tiles = get_tile_numbers(flowcell_layout)
+        self.cycles = numpy.arange(1, get_cycle_count(read_config) + 1)
+
+        # per (lane, tile), in grid order.
+        n_tiles = len(self.lanes) * len(self.tiles)
+        self.tile_clusters = numpy.round(_noisy(self.rng, self.stats['clusters'], self.stats['clusters_cv'], n_tiles))
+        self.tile_pf = numpy.clip(self.rng.normal(self.stats['pf'], 0.02, n_tiles), 0, 1)
+
+    def cycle_grid(self):
+        "Returns (lane, tile, cycle) columns and per-record clusters / pf for one record per cycle, lane and tile."
+        cycle, lane, tile = make_grid(self.cycles, self.lanes, self.tiles)
+        n_cycles = len(self.cycles)
+        return lane, tile, cycle, numpy.tile(self.tile_clusters, n_cycles), numpy.tile(self.tile_pf, n_cycles)
+
+    def tile(self, version):
+        "TileMetrics: densities and cluster counts per tile, then phasing, prephasing and % aligned per read."
+        s = self.stats
+        n_tiles = len(self.tile_clusters)
+        density = self.tile_clusters * s['density'] / s['clusters']
+        columns = [(100, density), (101, density * self.tile_pf),
+                   (102, self.tile_clusters), (103, numpy.round(self.tile_clusters * self.tile_pf))]
+        for num, read in enumerate(self.read_config):
+            # index reads report 0 phasing and alignment.
+            scale = 0 if read['is_index'] else 1
+            columns.append((200 + num * 2, scale * _noisy(self.rng, s['phasing'], s['noise_cv'], n_tiles)))
+            columns.append((201 + num * 2, scale * _noisy(self.rng, s['prephasing'], s['noise_cv'], n_tiles)))
+            columns.append((300 + num, scale * _noisy(self.rng, s['aligned'], s['noise_cv'], n_tiles)))
+
+        lane, tile = make_grid(self.lanes, self.tiles)
+        codes = numpy.array([code for code, values in columns])
+        return { 'lane': numpy.repeat(lane, len(codes)),
+                 'tile': numpy.repeat(tile, len(codes)),
+                 'code': numpy.tile(codes, n_tiles),
+                 'value': numpy.column_stack([values for code, values in columns]).ravel() }
+
+    def quality(self, version, scores, binned_scores=None):
+        """QualityMetrics: clusters of each record spread over the columns of scores (one Q-score per
+        column), a fraction around q30 of them over those >= Q30. binned_scores restricts the scores
+        clusters go to (the remapped scores of v5 binning)."""
+        s = self.stats
+        lane, tile, cycle, clusters, pf = self.cycle_grid()
+        totals = numpy.round(clusters * pf).astype(numpy.int64)
+        q30 = numpy.clip(self.rng.normal(s['q30'], s['q30_sd'], len(totals)), 0, 1)
+        high = numpy.round(totals * q30).astype(numpy.int64)
+
+        used = list(binned_scores or [score for score in scores if score in UNBINNED_SCORES])
+        data = { 'lane': lane, 'tile': tile, 'cycle': cycle }
+        counts = dict((score, None) for score in scores)
+        for part, wanted in ((totals - high, [q for q in used if q < 30]), (high, [q for q in used if q >= 30])):
+            for score, column in zip(wanted, _split(part, max(len(wanted), 1)).T):
+                counts[score] = column
+        for num, score in enumerate(scores):
+            column = counts[score]
+            data['q%i' % (num + 1)] = column if column is not None else numpy.zeros(len(totals), dtype=numpy.int64)
+        return data
+
+    def error(self, version):
+        "ErrorMetrics: error rate around error_rate and reads with 0-4 errors, per cycle, lane and tile."
+        s = self.stats
+        lane, tile, cycle, clusters, pf = self.cycle_grid()
+        rate = _noisy(self.rng, s['error_rate'], s['noise_cv'] * 4, len(lane))
+        aligned = numpy.round(clusters * pf * s['aligned'] / 100).astype(numpy.int64)
+        one_err = numpy.round(aligned * rate / 100).astype(numpy.int64)
+        two_err, three_err, four_err = one_err // 10, one_err // 100, one_err // 1000
+        return { 'lane': lane, 'tile': tile, 'cycle': cycle, 'rate': rate,
+                 'perfect': aligned - one_err - two_err - three_err - four_err,
+                 'one_err': one_err, 'two_err': two_err, 'three_err': three_err, 'four_err': four_err }
+
+    def extraction(self, version):
+        "ExtractionMetrics: FWHM and intensity per channel, and the time of extraction, per cycle, lane and tile."
+        s = self.stats
+        lane, tile, cycle, clusters, pf = self.cycle_grid()
+        n = len(lane)
+        data = { 'lane': lane, 'tile': tile, 'cycle': cycle }
+        for base in 'ACGT':
+            data['fwhm_' + base] = _noisy(self.rng, s['fwhm'], s['noise_cv'], n)
+            data['intensity_' + base] = _noisy(self.rng, s['intensity'], s['noise_cv'], n)
+
+        # tiles of a cycle are extracted 10 ms apart; times are .NET ticks (0.1 us).
+        per_cycle = len(self.lanes) * len(self.tiles)
+        microseconds = (s['start_time'] + (cycle - 1) * s['cycle_seconds']) * 10**6 + (numpy.arange(n) % per_cycle) * 10**4
+        data['datetime'] = DOTNET_TICKS_AT_EPOCH + microseconds.astype(numpy.uint64) * 10
+        return data
+
+    def corint(self, version):
+        "CorrectedIntMetrics: corrected intensities and base calls per cycle, lane and tile (v2 adds averages and S/N)."
+        s = self.stats
+        lane, tile, cycle, clusters, pf = self.cycle_grid()
+        n = len(lane)
+        calls = clusters * pf
+        nocalls = numpy.round(calls * 0.001)
+        data = { 'lane': lane, 'tile': tile, 'cycle': cycle, 'num_nocalls': nocalls }
+        for base, num_calls in zip('ACGT', _split((calls - nocalls).astype(numpy.int64), 4).T):
+            data['avg_corint_called_' + base] = _noisy(self.rng, s['intensity'] * 0.8, s['noise_cv'], n)
+            data['num_calls_' + base] = num_calls
+        if version == 2:
+            data['avg_intensity'] = _noisy(self.rng, s['intensity'], s['noise_cv'], n)
+            for base in 'ACGT':
+                data['avg_corint_' + base] = _noisy(self.rng, s['intensity'] * 0.5, s['noise_cv'], n)
+            data['signoise_ratio'] = _noisy(self.rng, s['signoise'], s['noise_cv'], n)
+        return data
+
+    def get_samples(self):
+        "Returns lists of index sequences, sample names and fractions of PF clusters of each of 'indexes' samples."
+        count = self.stats['indexes']
+        length = max([read['cycles'] for read in self.read_config if read['is_index']] or [8])
+        sequences = [''.join(self.rng.choice(list('ACGT'), length)) for _ in range(count)]
+        names = ['Sample%i' % (num + 1) for num in range(count)]
+        fractions = self.rng.dirichlet(numpy.ones(count) * 10) if count else numpy.zeros(0)
+        return sequences, names, fractions
+
+    def get_index_read(self):
+        "Number of the first index read (as found in IndexMetrics), or 1 if there is none."
+        for read in self.read_config:
+            if read['is_index']:
+                return read['read_num']
+        return 1
+
+    def index(self, version):
+        "IndexMetrics: PF clusters of each sample, per lane and tile."
+        sequences, names, fractions = self.get_samples()
+        lane, tile, sample = make_grid(self.lanes, self.tiles, numpy.arange(len(sequences)))
+        pf_clusters = numpy.repeat(self.tile_clusters * self.tile_pf, len(sequences))
+        return { 'lane': lane, 'tile': tile, 'read': numpy.repeat(self.get_index_read(), len(lane)),
+                 'index_str': numpy.array(sequences, dtype=object)[sample],
+                 'clusters': numpy.round(pf_clusters * fractions[sample]),
+                 'name_str': numpy.array(names, dtype=object)[sample],
+                 'project_str': numpy.repeat('Project', len(lane)).astype(object) }
+
+    def control(self, version):
+        "ControlMetrics: clusters of each control of each sample, per lane and tile."
+        sequences, names, fractions = self.get_samples()
+        controls = ['CTA_%ibp' % (150 * (num + 1)) for num in range(self.stats['controls'])]
+        lane, tile, control, sample = make_grid(self.lanes, self.tiles, numpy.arange(len(controls)),
+                                                numpy.arange(len(sequences)))
+        return { 'lane': lane, 'tile': tile, 'read': numpy.repeat(self.get_index_read(), len(lane)),
+                 'control_str': numpy.array(controls, dtype=object)[control],
+                 'index_str': numpy.array(sequences, dtype=object)[sample],
+                 'clusters': self.rng.poisson(10, len(lane)) }
+
+
+#### Headers and binaries
+
+def _pack_bytes(values):
+    return struct.pack('<%iB' % len(values), *values)
+
+def make_header(codename, version, recordlen=0, bins=None):
+    """Returns the header bytes of a binary. bins is (lower, upper, remapped) for binned Quality metrics.
+    The record length is ignored by the formats of variable-length records (Index, Control)."""
+    if codename in ('index', 'control'):
+        return _pack_bytes([version])
+    values = [version, recordlen]
+    if codename == 'quality' and version in (5, 6):
+        if bins:
+            lower, upper, remapped = bins
+            values += [1, len(remapped)] + list(lower) + list(upper) + list(remapped)
+        else:
+            values += [0]
+    return _pack_bytes(values)
+
+def cast_to_layout(data, layout):
+    "Returns data with each column cast to its on-disk format (clipped to the range of integer formats)."
+    out = {}
+    for name, fmt in layout:
+        column = data[name]
+        if fmt == STRING:
+            out[name] = column
+            continue
+        dtype = numpy.dtype(fmt)
+        if dtype.kind in 'ui':
+            info = numpy.iinfo(dtype)
+            column = numpy.clip(numpy.round(column), info.min, info.max)
+        out[name] = numpy.asarray(column).astype(dtype.newbyteorder('='))
+    return out
+
+def make_binary(codename, version=None, flowcell_layout=None, read_config=None, seed=0, binned=None,
+                bins=DEFAULT_QUALITY_BINS, **stats):
+    """Returns (bytes of a binary of metrics codename, dict of the columns written to it).
+
+    :param codename: (required) metrics codename (e.g. 'tile', 'quality')
+    :param version: (optional) file version (default: the newest the parser supports)
+    :param flowcell_layout: (optional) dict as in base_parser_class (default: FLOWCELL_LAYOUT_DEFAULTS)
+    :param read_config: (optional) list of dicts as in base_parser_class (default: READ_CONFIG_DEFAULTS)
+    :param seed: (optional) seed of the random numbers drawn (default: 0)
+    :param binned: (optional) write binned Quality metrics v5 (v6 is always binned, v4 never)
+    :param bins: (optional) (lower, upper, remapped) Q-scores of bins (default: DEFAULT_QUALITY_BINS)
+    :param stats: (optional) central values of metrics, overriding DEFAULT_STATS
+
+    Columns are cast to their on-disk formats, so they compare equal to what parsers decode (except
+    that parsers widen floats to float64 and turn the .NET ticks of ExtractionMetrics into datetimes).
+    """
+    flowcell_layout = flowcell_layout or FLOWCELL_LAYOUT_DEFAULTS
+    read_config = read_config or READ_CONFIG_DEFAULTS
+    parser_class = get_parser_class(codename)
+    if version is None:
+        version = parser_class.supported_versions[-1]
+    if version not in parser_class.supported_versions:
+        raise ValueError("%s can't write %s metrics version %r (supported: %s)" %
+                         (__name__, codename, version, parser_class.supported_versions))
+
+    if codename != 'quality' or version == 4:
+        binned = False
+    elif binned is None:
+        binned = version == 6
+    elif version == 6 and not binned:
+        raise ValueError("Quality metrics v6 hold binned Q-scores only")
+
+    # the parser reading the header works out the record layout (quality columns depend on the bins).
+    header = make_header(codename, version, 0, bins if binned else None)
+    parser = parser_class(None, parse=False, flowcell_layout=flowcell_layout, read_config=read_config)
+    parser.buf = header
+    parser.parse_header()
+    layout = parser.get_record_layout()
+
+    recordlen = 0
+    if STRING not in [fmt for name, fmt in layout]:
+        recordlen = sum(numpy.dtype(fmt).itemsize for name, fmt in layout)
+        header = make_header(codename, version, recordlen, bins if binned else None)
+
+    generator = RecordGenerator(flowcell_layout, read_config, seed, **stats)
+    if codename == 'quality':
+        if version == 6:
+            data = generator.quality(version, bins[2], bins[2])
+        else:
+            data = generator.quality(version, range(1, 51), bins[2] if binned else None)
+    else:
+        data = getattr(generator, codename)(version)
+
+    data = cast_to_layout(data, layout)
+    return header + encode_records(layout, data, recordlen or None), data
+
+def write_binary(path, codename, **kwargs):
+    "Writes a binary made by make_binary(codename, **kwargs) to path. Returns the dict of columns written."
+    binary, data = make_binary(codename, **kwargs)
+    with open(path, 'wb') as fh:
+        fh.write(binary)
+    return data
+
+
+#### Runs
+
+RUNINFO_TEMPLATE = """<?xml version="1.0"?>
+<RunInfo Version="2">
+  <Run Id="%(run_id)s" Number="1">
+    <Flowcell>SYNTHETIC</Flowcell>
+    <Instrument>SYNTHETIC</Instrument>
+    <Date>000101</Date>
+    <Reads>
+%(reads)s
+    </Reads>
+    <FlowcellLayout LaneCount="%(lanecount)i" SurfaceCount="%(surfacecount)i" SwathCount="%(swathcount)i" TileCount="%(tilecount)i" />
+  </Run>
+</RunInfo>
+"""
+
+READ_TEMPLATE = '      <Read NumCycles="%(cycles)i" Number="%(read_num)i" IsIndexedRead="%(indexed)s" />'
+
+# binaries written by write_run() by default.
+RUN_CODENAMES = ['tile', 'quality', 'error', 'extraction', 'corint', 'index', 'control']
+
+def write_run(rundir, flowcell_layout=None, read_config=None, versions=None, codenames=RUN_CODENAMES, **kwargs):
+    """Writes a run into rundir: RunInfo.xml and a binary of each of codenames in InterOp, which
+    InteropDataset(rundir) can then read. versions is an optional dict of codename -> file version;
+    other keyword arguments go to make_binary(). Returns rundir."""
+    flowcell_layout = flowcell_layout or FLOWCELL_LAYOUT_DEFAULTS
+    read_config = read_config or READ_CONFIG_DEFAULTS
+    versions = versions or {}
+
+    bindir = os.path.join(rundir, BINFILE_DIR_NAME)
+    if not os.path.isdir(bindir):
+        os.makedirs(bindir)
+
+    reads = '\n'.join(READ_TEMPLATE % dict(read, indexed='Y' if read['is_index'] else 'N') for read in read_config)
+    with open(os.path.join(rundir, 'RunInfo.xml'), 'w') as fh:
+        fh.write(RUNINFO_TEMPLATE % dict(flowcell_layout, reads=reads, run_id=os.path.basename(os.path.abspath(rundir))))
+
+    for codename in codenames:
+        write_binary(os.path.join(bindir, BIN_FILEMAP[codename][0]), codename, version=versions.get(codename),
+                     flowcell_layout=flowcell_layout, read_config=read_config, **kwargs)
+    return rundir
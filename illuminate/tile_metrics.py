@@ -1,35 +1,158 @@
 # -*- coding: utf-8 -*-
 
-import pandas
+import numpy
 
 from .base_parser_class import InteropBinParser
+from .exceptions import InteropReadError
+
+# metric codes (see InteropTileMetrics) and the codes of read N's metrics: code + (N - 1) * step.
+CLUSTER_DENSITY, CLUSTER_DENSITY_PF, NUM_CLUSTERS, NUM_CLUSTERS_PF = 100, 101, 102, 103
+PHASING, PREPHASING, ALIGNED = (200, 2), (201, 2), (300, 1)
+
+def read_code(code, read_num):
+    "returns metric code of read read_num (numbered from 1) for a per-read code such as PHASING."
+    return code[0] + (read_num - 1) * code[1]
+
+
+class TileSummary(object):
+    """Aggregates of TileMetrics records at the level of the run, of each lane and of each tile.
+
+    Records are reduced once, grouped by (code, lane, tile), into the sum, count and latest value of
+    each group; every aggregate is then a bincount over those groups (a few per tile and code), so
+    no pass over the records is repeated, whatever is asked for.
+
+    For each level, cluster densities are the mean over its tiles of each tile's latest density (as
+    SAV shows them); cluster counts are sums, phasing, prephasing and % aligned means of all records.
+    Metrics without any record count 0."""
+
+    def __init__(self, data, read_config):
+        self.read_config = read_config
+        code = numpy.asarray(data['code'], dtype=numpy.int64)
+        lane = numpy.asarray(data['lane'], dtype=numpy.int64)
+        tile = numpy.asarray(data['tile'], dtype=numpy.int64)
+        value = numpy.asarray(data['value'], dtype=numpy.float64)
+
+        keys, inverse = numpy.unique((code << 32) | (lane << 16) | tile, return_inverse=True)
+        inverse = inverse.ravel()
+        self.counts = numpy.bincount(inverse, minlength=len(keys))
+        self.sums = numpy.bincount(inverse, weights=value, minlength=len(keys))
+        # a stable sort keeps each group's records in file order, so its last one is the latest.
+        order = numpy.argsort(inverse, kind='mergesort')
+        self.latest = value[order[numpy.cumsum(self.counts) - 1]] if len(keys) else value[:0]
+
+        self.codes = keys >> 32
+        self.lanes, lane_idx = numpy.unique((keys >> 16) & 0xffff, return_inverse=True)
+        tile_keys, tile_idx = numpy.unique(keys & 0xffffffff, return_inverse=True)
+        self.tiles = list(zip((tile_keys >> 16).tolist(), (tile_keys & 0xffff).tolist()))     # (lane, tile)
+        self._group_index = { 'run': numpy.zeros(len(keys), dtype=numpy.intp),
+                              'lane': lane_idx.ravel(), 'tile': tile_idx.ravel() }
+        self._level_size = { 'run': 1, 'lane': len(self.lanes), 'tile': len(self.tiles) }
+
+    def aggregate(self, code, how, level='run'):
+        """returns array of the aggregate of metric code for each group of level ('run', 'lane' or
+        'tile', in the order of [run], .lanes or .tiles): how is 'sum', 'mean' (of all records) or
+        'latest' (mean over tiles of each tile's latest value)."""
+        mask = self.codes == code
+        index = self._group_index[level][mask]
+        size = self._level_size[level]
+        if how == 'sum':
+            return numpy.bincount(index, weights=self.sums[mask], minlength=size)
+        if how == 'mean':
+            totals, counts = numpy.bincount(index, weights=self.sums[mask], minlength=size), \
+                             numpy.bincount(index, weights=self.counts[mask], minlength=size)
+        else:
+            totals, counts = numpy.bincount(index, weights=self.latest[mask], minlength=size), \
+                             numpy.bincount(index, minlength=size)
+        return numpy.where(counts > 0, totals / numpy.maximum(counts, 1), 0)
+
+    def summarize(self, level='run'):
+        """returns dict of name -> array (one value per group of level, see aggregate) of the
+        summaries of InteropTileMetrics.to_dict(), plus percent_pf_clusters and the per-read
+        lists as arrays of shape (reads, groups)."""
+        out = { 'cluster_density': self.aggregate(CLUSTER_DENSITY, 'latest', level),
+                'cluster_density_pf': self.aggregate(CLUSTER_DENSITY_PF, 'latest', level),
+                'num_clusters': self.aggregate(NUM_CLUSTERS, 'sum', level),
+                'num_clusters_pf': self.aggregate(NUM_CLUSTERS_PF, 'sum', level),
+                'aligned': self.aggregate(ALIGNED[0], 'mean', level) }
+        out['percent_pf_clusters'] = numpy.where(out['num_clusters'] > 0,
+                                                 100 * out['num_clusters_pf'] / numpy.maximum(out['num_clusters'], 1), 0)
+        for name, code in (('mean_phasing', PHASING), ('mean_prephasing', PREPHASING), ('mean_aligned', ALIGNED)):
+            out[name] = numpy.array([self.aggregate(read_code(code, read['read_num']), 'mean', level)
+                                     for read in self.read_config]).reshape(len(self.read_config), -1)
+        return out
+
+    def _breakdown(self, level, keys):
+        "returns dict of key -> dict of summaries (per-read ones as lists) for each group of level."
+        summary = self.summarize(level)
+        out = {}
+        for idx, key in enumerate(keys):
+            out[key] = dict((name, values[:, idx].tolist() if values.ndim == 2 else values[idx].item())
+                            for name, values in summary.items())
+        return out
+
+    def by_lane(self):
+        "returns dict of lane -> dict of its summaries (see summarize)."
+        return self._breakdown('lane', self.lanes.tolist())
+
+    def by_tile(self):
+        "returns dict of (lane, tile) -> dict of its summaries (see summarize)."
+        return self._breakdown('tile', self.tiles)
+
 
 class InteropTileMetrics(InteropBinParser):
     "ILMN Tile Metrics parser (child class of InteropBinParser)."
 
-    __version = 0.4                 # version of this parser class.
+    __version = 0.5                 # version of this parser class.
     supported_versions = [2]        # version(s) of binary file that this parser handles
     codename = 'tile'
 
+    # TileMetrics.bin / TileMetricsOut.bin, file version 2.
+    #
+    # Contains aggregate or read metrics by tile
+    # Format:
+    #   byte 0: file version number (2)
+    #   byte 1: length of each record
+    #   bytes (N * 10 + 2) - (N *10 + 11): record:      
+    #       2 bytes: lane number (uint16)
+    #       2 bytes: tile number (uint16)
+    #       2 bytes: metric code (uint16)
+    #       4 bytes: metric value (float)
+    # Where N is the record index and possible metric codes are:
+    #   code 100: cluster density (k/mm2)
+    #   code 101: cluster density passing filters (k/mm2)
+    #   code 102: number of clusters
+    #   code 103: number of clusters passing filters
+    #   code (200 + (N – 1) * 2): phasing for read N
+    #   code (201 + (N – 1) * 2): prephasing for read N
+    #   code (300 + N – 1): percent aligned for read N
+    #   code 400: control lane
+
+    record_layout = [('lane', '<u2'), ('tile', '<u2'), ('code', '<u2'), ('value', '<f4')]
+
+    # needed for the summaries.
+    required_columns = ('lane', 'tile', 'code', 'value')
+
     # given by __init__ (from InteropBinParser):  read_config {}, flowcell_layout {}
 
     def _init_variables(self):
         # Map of binary's "code" to what it means. Filled during parsing.
         self.codemap = { }
     
-        #filled during parsing. 'code' refers to the binary's arbitrary outcome codes for each record.
+        # filled during parsing (one numpy array per field of record_layout).
+        # 'code' refers to the binary's arbitrary outcome codes for each record.
+        self.data = {}
 
-        self.data = {'lane' : [], 
-                     'tile': [], 
-                     'code': [], 
-                     'value': [] }
-
-        # per-read calculations of average phasing and prephasing across all tiles.
-        # index reads (usually Read 2) almost always report 0.0 phasing and prephasing.
-        
-        self.mean_phasing = []
-        self.mean_prephasing = []
+        # TileSummary of self.data and summaries from it; built when first asked for.
+        self._process_data()
         
+    def check_version(self, version_num):
+        """Other versions' records (e.g. v3's, keyed by code and tile differently) have the same length
+        as v2's, so they would decode without complaint, as garbage: refuse them instead."""
+        if version_num not in self.supported_versions:
+            raise InteropReadError("[%s] File version %i is not supported (supported: %s)" %
+                                   (self.__class__.__name__, version_num,
+                                    ', '.join(str(version) for version in self.supported_versions)))
+
     def _make_codemap(self):
         self.codemap = { 100: "cluster density (k/mm2)",
                 101: "cluster density passing filters (k/mm2)",
@@ -42,111 +165,59 @@ class InteropTileMetrics(InteropBinParser):
             self.codemap[201 + (read['read_num']-1) * 2] = "prephasing for read %i" % read['read_num']
             self.codemap[300 + read['read_num']-1] = "percent aligned for read %i" % read['read_num']
 
-    def _get_mean_of_last_cycle(self, df):
-        if df.empty:
-            return 0
-        else:
-            return df[len(df)-self.num_tiles:].mean()['value']
-
-    def parse_binary(self):
-        "parses contents of TileMetrics.bin / TileMetricsOut.bin, file version 2."
-
-        # Contains aggregate or read metrics by tile
-        # Format:
-        #   byte 0: file version number (2)
-        #   byte 1: length of each record
-        #   bytes (N * 10 + 2) - (N *10 + 11): record:      
-        #       2 bytes: lane number (uint16)
-        #       2 bytes: tile number (uint16)
-        #       2 bytes: metric code (uint16)
-        #       4 bytes: metric value (float)
-        # Where N is the record index and possible metric codes are:
-        #   code 100: cluster density (k/mm2)
-        #   code 101: cluster density passing filters (k/mm2)
-        #   code 102: number of clusters
-        #   code 103: number of clusters passing filters
-        #   code (200 + (N – 1) * 2): phasing for read N
-        #   code (201 + (N – 1) * 2): prephasing for read N
-        #   code (300 + N – 1): percent aligned for read N
-        #   code 400: control lane
-
-        bs = self.bs    #convenience assignment
-
-        self.apparent_file_version, recordlen = bs.readlist('2*uintle:8')
-        self.check_version(self.apparent_file_version)
-
-        bs.pos = 16  # skip the following 16 bytes which are invariant here.
-
-        #read records bytewise per specs in technote_rta_theory_operations.pdf from ILMN
-        for i in range(0,int((bs.len - 16) / (recordlen * 8))):  # 80 == record length in bits
-
-            lane, tile, code, value = bs.readlist('3*uintle:16, floatle:32')
-            self.data['lane'].append(lane)  # lane number
-            self.data['tile'].append(tile)  # tile number
-            self.data['code'].append(code)  # metric code
-            self.data['value'].append(value)  # metric value
-
-        #make it fuzzy and mean.
-        self.df = pandas.DataFrame(self.data)
-
-        # INTERPRETATION: MOVE TO SEPARATE FUNCTION(S)
-            
-        pivot_sum = self.df.pivot_table('value', index='code', aggfunc='sum')
-        pivot_mean = self.df.pivot_table('value', index='code', aggfunc='mean')
-
-        # These try-except blocks allow TileMetrics to be processed even when data
-        # is still incomplete.
-        try:
-            self.aligned = pivot_mean[300]
-        except:
-            self.aligned = 0
-
-        try:
-            self.total_cluster_density = pivot_sum[100]
-        except:
-            self.total_cluster_density = 0    
-    
-        try:
-            self.total_cluster_density_pf = pivot_sum[101]
-        except:
-            self.total_cluster_density_pf = 0    
-
-        # SAV: "Total Reads"  
-        # ResequencingRunStatistics.xml: NumberOfClustersRaw
-        try:
-            self.num_clusters = pivot_sum[102]      
-        except:
-            self.num_clusters = 0
-
-        # SAV: "PF Reads"  
-        try:                                        
-            self.num_clusters_pf = pivot_sum[103]
-        except:
-            self.num_clusters_pf = 0             
-                                              
-        # Illumina SAV displays metrics only based on the latest-created cluster density (100)
-        # and cluster density passing filter (101) metrics output per tile. (The number of collections
-        # of tile metrics per sequencing run seems to be variable.)  So we select out the highest-index
-        # metrics encompassing all num_tiles tiles, and calculate our means based on that.
-    
-        self.mean_cluster_density = self._get_mean_of_last_cycle(self.df[self.df['code']==100])        
-        self.mean_cluster_density_pf = self._get_mean_of_last_cycle(self.df[self.df['code']==101])
+    def _process_data(self):
+        "drops summaries of earlier data; they're computed from self.data when first asked for."
+        self._summary = None
+        self._summaries = None
+        self._lane_summaries = None
+        self._tile_summaries = None
 
-        if self.num_clusters and self.num_clusters_pf:
-            self.percent_pf_clusters = 100 * float(self.num_clusters_pf / self.num_clusters)
-        else:
-            self.percent_pf_clusters = 0
-    
-        # Phasing and Prephasing averages per read
-        for read in self.read_config:
-            # There are only ever (lanes * tiles) entries per phasing and pre-phasing code, so 
-            # we don't need to do the "last cycle" trick as above.
-            try:    
-                self.mean_phasing.append(pivot_mean[200 + (read['read_num']-1) * 2])
-                self.mean_prephasing.append(pivot_mean[201 + (read['read_num']-1) * 2])
-            except:
-                self.mean_phasing.append(0)
-                self.mean_prephasing.append(0)
+    @property
+    def summary(self):
+        "TileSummary of self.data, built on first access."
+        if self._summary is None:
+            with self.phase('summarize'):
+                self._summary = TileSummary(self.data, self.read_config)
+        return self._summary
+
+    def _get_run_summary(self, name):
+        if self._summaries is None:
+            self._summaries = self.summary.summarize('run')
+        values = self._summaries[name]
+        return values[:, 0].tolist() if values.ndim == 2 else values[0].item()
+
+    # Illumina SAV displays metrics only based on the latest-created cluster density (100) and
+    # cluster density passing filter (101) metrics output per tile. (The number of collections of
+    # tile metrics per sequencing run seems to be variable.)
+    mean_cluster_density = property(lambda self: self._get_run_summary('cluster_density'))
+    mean_cluster_density_pf = property(lambda self: self._get_run_summary('cluster_density_pf'))
+
+    # SAV: "Total Reads" (ResequencingRunStatistics.xml: NumberOfClustersRaw) and "PF Reads"
+    num_clusters = property(lambda self: self._get_run_summary('num_clusters'))
+    num_clusters_pf = property(lambda self: self._get_run_summary('num_clusters_pf'))
+    percent_pf_clusters = property(lambda self: self._get_run_summary('percent_pf_clusters'))
+    total_cluster_density = property(lambda self: self.summary.aggregate(CLUSTER_DENSITY, 'sum')[0].item())
+    total_cluster_density_pf = property(lambda self: self.summary.aggregate(CLUSTER_DENSITY_PF, 'sum')[0].item())
+
+    # % aligned to PhiX of read 1, and per-read averages of phasing and prephasing across all tiles.
+    # Index reads (usually Read 2) almost always report 0.0 phasing and prephasing.
+    aligned = property(lambda self: self._get_run_summary('aligned'))
+    mean_phasing = property(lambda self: self._get_run_summary('mean_phasing'))
+    mean_prephasing = property(lambda self: self._get_run_summary('mean_prephasing'))
+
+    @property
+    def lane_summaries(self):
+        "dict of lane -> dict of its summaries (see TileSummary.summarize), built on first access."
+        if self._lane_summaries is None:
+            self._lane_summaries = self.summary.by_lane()
+        return self._lane_summaries
+
+    @property
+    def tile_summaries(self):
+        "dict of (lane, tile) -> dict of its summaries (see TileSummary.summarize), built on first access."
+        if self._tile_summaries is None:
+            self._tile_summaries = self.summary.by_tile()
+        return self._tile_summaries
 
     def __str__(self):
         out = '  Mean Cluster Density: %i' % self.mean_cluster_density
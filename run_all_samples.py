@@ -4,6 +4,8 @@ from illuminate.__main__ import main
 
 ARGS = {
   "--all": True, 
+  "--arrow": False, 
+  "--cache": None, 
   "--control": False, 
   "--corint": False, 
   "--csv": False, 
@@ -13,17 +15,33 @@ ARGS = {
   "--help": False, 
   "--index": False, 
   "--interactive": False, 
+  "--interval": "5", 
   "--json": False, 
+  "--jsonl": False, 
   "--meta": False, 
+  "--mmap": False, 
   "--name": "meta.runID", 
+  "--numpy": False, 
   "--outpath": None, 
+  "--parquet": False, 
+  "--processes": False, 
+  "--profile": False, 
+  "--prune": False, 
   "--quality": False, 
   "--quiet": False, 
   "--tile": False, 
   "--timestamp": False, 
   "--verbose": False, 
   "--version": False, 
-  "<datapath>": "/path/to/sample"
+  "--watch": False, 
+  "--workers": "4", 
+  "<datapath>": "/path/to/sample",
+  "<rootdir>": None,
+  "batch": False, 
+  "inventory": False, 
+  "ingest": False, 
+  "<storefile>": None, 
+  "--index-file": None
 }
 
 
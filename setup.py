@@ -16,9 +16,10 @@ setup (
            'illuminate = illuminate.__main__:collect_args',] }, 
        install_requires = ["bitstring>=3.1.0",
                            "docopt",
-                           "numpy>=1.6.2",
+                           "numpy>=1.8.0",
                            "pandas>=0.14",
                            "openpyxl>=1.8.6",
-                           "xmltodict",
+                           'futures; python_version < "3"',
                            ],
+       extras_require = { 'arrow': ["pyarrow"] },
      )
@@ -1,5 +1,9 @@
 import datetime
+import sqlite3
+import struct
+import os
 
+import numpy as np
 import pandas as pd
 import pytest
 from pandas.util.testing import assert_frame_equal
@@ -134,10 +138,11 @@ expected_tile_metrics = [({'cluster_density': 1069572.15625,
                            'cluster_density_pf': 1086435.6004464286, 'num_clusters': 23492144.0, 'aligned': 0.0,
                            'num_clusters_pf': 20406033.0},
                           interop_datasets['000000000-A7M8N']),
-                         ({'cluster_density': 195052.47520616319,
+                         # densities: mean of the latest of each of the 864 tiles (6 sections of 144 per lane).
+                         ({'cluster_density': 196104.07703993056,
                            'mean_phasing': [0.0011471727789285069, 0],
                            'mean_prephasing': [0.0017082951494052799, 0],
-                           'cluster_density_pf': 181926.53423394097,
+                           'cluster_density_pf': 182520.6474247685,
                            'num_clusters': 508836048.0,
                            'aligned': 0.29068558873539724,
                            'num_clusters_pf': 473590791.0},
@@ -146,7 +151,7 @@ expected_tile_metrics = [({'cluster_density': 1069572.15625,
 
 expected_quality_metrics = [
     ({1: 94.23642906099548, 2: 88.87470808353756, 3: 85.6593561482059}, interop_datasets['H8FW8ADXX']),
-    ({1: 95.98019801300919, 2: 70.747303995833}, interop_datasets['000000000-A7M8N']),
+    ({1: 95.98019801300919, 2: 70.26453810661451}, interop_datasets['000000000-A7M8N']),
     ({1: 97.53153966532963, 2: 97.24238176124162}, interop_datasets['HW37NBGXX'])
     ]
 
@@ -301,3 +306,555 @@ def test_control_metrics(setup):
     assert_frame_equal(interop_dataset.ControlMetrics().df[START_INDEX:STOP_INDEX], expected_comtrol_metrics_df)
 
 
+
+
+CHUNK_TEST_DIR = "sampledata/MiSeq-samples/2013-04_10_has_errors/InterOp"
+CHUNK_TEST_PARSERS = [
+    (illuminate.InteropTileMetrics, "TileMetricsOut.bin"),
+    (illuminate.InteropQualityMetrics, "QMetricsOut.bin"),
+    (illuminate.InteropErrorMetrics, "ErrorMetricsOut.bin"),
+    (illuminate.InteropExtractionMetrics, "ExtractionMetricsOut.bin"),
+    (illuminate.InteropCorrectedIntensityMetrics, "CorrectedIntMetricsOut.bin"),
+    (illuminate.InteropIndexMetrics, "IndexMetricsOut.bin"),
+    (illuminate.InteropControlMetrics, "ControlMetricsOut.bin")]
+
+
+@pytest.mark.parametrize("parser_class, filename", CHUNK_TEST_PARSERS)
+def test_iter_chunks(parser_class, filename):
+    path = os.path.join(CHUNK_TEST_DIR, filename)
+    parsed = parser_class(path)
+    chunks = list(parser_class(path, parse=False).iter_chunks(1000))
+
+    assert all(len(chunk['lane']) == 1000 for chunk in chunks[:-1])
+    for name in parsed.data:
+        streamed = [value for chunk in chunks for value in chunk[name]]
+        assert streamed == list(parsed.data[name])
+
+
+@pytest.mark.parametrize("parser_class, filename", CHUNK_TEST_PARSERS)
+def test_update(parser_class, filename, tmpdir):
+    path = os.path.join(CHUNK_TEST_DIR, filename)
+    with open(path, 'rb') as fh:
+        binary = fh.read()
+
+    # simulate a binary still being written: cut it off mid-record, then append the rest.
+    growing = str(tmpdir.join(filename))
+    with open(growing, 'wb') as fh:
+        fh.write(binary[:len(binary) // 2 + 1])
+    parser = parser_class(growing)
+    num_records = len(parser.data['lane'])
+
+    with open(growing, 'ab') as fh:
+        fh.write(binary[len(binary) // 2 + 1:])
+    parsed = parser_class(path)
+
+    assert parser.update() == len(parsed.data['lane']) - num_records
+    assert parser.offset == len(binary)
+    for name in parsed.data:
+        assert list(parser.data[name]) == list(parsed.data[name])
+    assert parser.update() == 0
+
+
+@pytest.mark.parametrize("parser_class, filename", CHUNK_TEST_PARSERS)
+def test_cache(parser_class, filename, tmpdir, monkeypatch):
+    path = os.path.join(CHUNK_TEST_DIR, filename)
+    cache_dir = str(tmpdir.join('cache'))
+    parsed = parser_class(path, cache_dir=cache_dir)
+
+    # a cache hit must not decode the binary again.
+    def fail(*args, **kwargs):
+        raise AssertionError('binary was decoded despite a fresh cache entry')
+    monkeypatch.setattr(parser_class, 'iter_chunks', fail)
+    cached = parser_class(path, cache_dir=cache_dir)
+
+    assert cached.apparent_file_version == parsed.apparent_file_version
+    assert_frame_equal(cached.df, parsed.df)
+
+
+@pytest.mark.parametrize("executor", ['thread', 'process'])
+def test_load_all(executor):
+    dataset = illuminate.InteropDataset(os.path.dirname(CHUNK_TEST_DIR))
+    loaded = dataset.load_all(executor, max_workers=2)
+
+    assert loaded == ['tile', 'quality', 'index', 'error', 'corint', 'extraction', 'control']
+    serial = illuminate.InteropDataset(os.path.dirname(CHUNK_TEST_DIR))
+    assert_frame_equal(dataset.QualityMetrics().df, serial.QualityMetrics().df)
+    assert dataset.IndexMetrics().to_dict().keys() == serial.IndexMetrics().to_dict().keys()
+
+
+
+def test_load_all_keeps_others_on_failure(monkeypatch):
+    def fail(self, *args, **kwargs):
+        raise ValueError("odd record")
+    monkeypatch.setattr(illuminate.InteropErrorMetrics, 'parse_binary', fail)
+    dataset = illuminate.InteropDataset(os.path.dirname(CHUNK_TEST_DIR))
+    loaded = dataset.load_all('thread')
+
+    assert 'error' not in loaded and 'quality' in loaded
+    assert isinstance(dataset.load_errors['error'], ValueError)
+    assert dataset.QualityMetrics() is not None
+
+def test_qscore_cube():
+    qm = illuminate.InteropQualityMetrics(os.path.join(CHUNK_TEST_DIR, "QMetricsOut.bin"))
+    df = qm.df[(qm.df.cycle > 151) & (qm.df.cycle <= 157) & (qm.df.tile == 1101)]
+    qcols = ['q%i' % qual for qual in range(1, 51)]
+    expected = 100 * float(df[qcols[29:]].values.sum()) / df[qcols].values.sum()
+
+    assert qm.get_qscore_percentage(30, 1, lane=1, tile=1101) == pytest.approx(expected)
+    assert qm.get_qscore_percentage(30, 1, tile=9999) == 0
+
+
+@pytest.mark.parametrize("parser_class, filename", CHUNK_TEST_PARSERS)
+def test_record_filters(parser_class, filename):
+    path = os.path.join(CHUNK_TEST_DIR, filename)
+    parsed = parser_class(path)
+    filtered = parser_class(path, lanes=1, tiles=[1101, 1102], cycles=range(1, 11))
+
+    wanted = (parsed.data['lane'] == 1) & ((parsed.data['tile'] == 1101) | (parsed.data['tile'] == 1102))
+    if 'cycle' in parsed.data:
+        wanted &= parsed.data['cycle'] <= 10
+    for name in parsed.data:
+        assert list(filtered.data[name]) == list(np.asarray(parsed.data[name])[wanted])
+
+
+def test_columns():
+    extraction = illuminate.InteropExtractionMetrics(os.path.join(CHUNK_TEST_DIR, "ExtractionMetricsOut.bin"),
+                                                     columns=['fwhm_A', 'fwhm_C'])
+    assert list(extraction.df.columns) == ['fwhm_A', 'fwhm_C']
+    assert 'datetime' not in extraction.data
+
+    path = os.path.join(CHUNK_TEST_DIR, "QMetricsOut.bin")
+    quality = illuminate.InteropQualityMetrics(path, columns=['q30'])
+    assert sorted(quality.df.columns) == ['cycle', 'lane', 'q30', 'tile']
+    assert quality.to_dict() == illuminate.InteropQualityMetrics(path).to_dict()
+
+
+def test_dotnet_ticks_to_datetime64():
+    from illuminate.extraction_metrics import dotnet_ticks_to_datetime64
+    ticks = 635277532508506226        # 2014-02-11 22:07:30.8506226, "kind" bits clear
+    kind_bits = 2 << 62
+    converted = dotnet_ticks_to_datetime64([ticks, ticks | kind_bits, 0])
+
+    assert converted.dtype == np.dtype('datetime64[ns]')
+    assert list(converted[:2]) == [np.datetime64('2014-02-11T22:07:30.850622')] * 2
+    assert np.isnat(converted[2])
+
+
+def test_scan_records():
+    from illuminate.base_parser_class import scan_records, STRING
+    layout = [('lane', '<u2'), ('name', STRING), ('clusters', '<u4')]
+    record = b'\x01\x00' + b'\x04\x00ACGT' + b'\x2a\x00\x00\x00'
+
+    data, end = scan_records(b'\x01' + record * 3 + record[:-1], 1, layout)
+
+    assert end == 1 + 3 * len(record)
+    assert list(data['lane']) == [1, 1, 1] and list(data['clusters']) == [42, 42, 42]
+    assert list(data['name']) == ['ACGT'] * 3
+    assert data['name'][0] is data['name'][2]
+
+
+@pytest.mark.parametrize("parser_class, filename", CHUNK_TEST_PARSERS)
+def test_encode_records(parser_class, filename):
+    from illuminate.base_parser_class import encode_records, STRING
+    parser = parser_class(os.path.join(CHUNK_TEST_DIR, filename), parse=False)
+    raw = parser.load()
+    header_len = parser.parse_header()
+    layout = parser.get_record_layout()
+
+    if STRING in [fmt for name, fmt in layout]:
+        encoded = encode_records(layout, next(parser._iter_records(raw, header_len)))
+    else:
+        encoded = encode_records(layout, parser.decode_records(header_len, parser.recordlen), parser.recordlen)
+    assert encoded == raw[header_len:]
+
+
+numpy_backend_cases = [(tile[0], index[0], tile[1].directory) for tile, index in
+                       zip(expected_tile_metrics, expected_index_metrics)]
+
+
+@pytest.mark.parametrize("expected_tile, expected_index, path", numpy_backend_cases, ids=id_list)
+def test_numpy_backend(expected_tile, expected_index, path):
+    dataset = illuminate.InteropDataset(path, backend='numpy')
+    tm = dataset.TileMetrics()
+    assert tm.data.dtype.names == ('lane', 'tile', 'code', 'value')
+    assert tm._df is None
+
+    tile = tm.to_dict()
+    for key, value in expected_tile.items():
+        assert tile[key] == pytest.approx(value), key
+    assert dataset.IndexMetrics().to_dict() == expected_index
+
+    assert_frame_equal(tm.df, illuminate.InteropTileMetrics(tm.filename).df)
+
+
+def test_tile_metrics_unsupported_version(tmpdir):
+    from illuminate.exceptions import InteropReadError
+    path = str(tmpdir.join('TileMetricsOut.bin'))
+    with open(path, 'wb') as fh:
+        fh.write(struct.pack('<BB', 3, 10) + b'\x01' * 20)
+    with pytest.raises(InteropReadError):
+        illuminate.InteropTileMetrics(path)
+
+
+@pytest.mark.parametrize("backend", ['pandas', 'numpy'])
+def test_tile_summaries(backend):
+    tm = illuminate.InteropDataset(interop_datasets['H8FW8ADXX'].directory, backend=backend).TileMetrics()
+    assert tm._summary is None
+
+    lanes, tiles = tm.lane_summaries, tm.tile_summaries
+    assert sorted(lanes) == [1, 2] and len(tiles) == 128
+    assert sum(lane['num_clusters'] for lane in lanes.values()) == pytest.approx(tm.num_clusters)
+    assert np.mean([tile['cluster_density'] for tile in tiles.values()]) == pytest.approx(tm.mean_cluster_density)
+    assert np.mean([lane['mean_phasing'][0] for lane in lanes.values()]) == pytest.approx(tm.mean_phasing[0])
+    assert tiles[(1, 1101)]['num_clusters_pf'] <= tiles[(1, 1101)]['num_clusters']
+
+
+def test_numpy_backend_quality():
+    path = os.path.join(CHUNK_TEST_DIR, "QMetricsOut.bin")
+    quality = illuminate.InteropQualityMetrics(path, backend='numpy')
+    parsed = illuminate.InteropQualityMetrics(path)
+
+    assert quality.to_dict() == parsed.to_dict()
+    assert_frame_equal(quality.idf, parsed.idf)
+
+
+def test_lazy_imports():
+    import subprocess
+    import sys
+    code = ("import sys, illuminate; illuminate.InteropDataset(%r); "
+            "print(sorted(name for name in ('numpy', 'pandas', 'bitstring') if name in sys.modules))"
+            % "sampledata/MiSeq-samples/2014-02_11_50kit_single_read")
+    assert subprocess.check_output([sys.executable, '-c', code]).strip() == b'[]'
+    assert illuminate.InteropTileMetrics.codename == 'tile'
+
+
+SYNTHETIC_LAYOUT = {'lanecount': 2, 'surfacecount': 2, 'swathcount': 2, 'tilecount': 3}
+SYNTHETIC_READS = [{'read_num': 1, 'cycles': 5, 'is_index': 0},
+                   {'read_num': 2, 'cycles': 4, 'is_index': 1},
+                   {'read_num': 3, 'cycles': 5, 'is_index': 0}]
+SYNTHETIC_FORMATS = [('tile', 2, None), ('quality', 4, None), ('quality', 5, False), ('quality', 5, True),
+                     ('quality', 6, None), ('error', 3, None), ('extraction', 2, None), ('corint', 2, None),
+                     ('corint', 3, None), ('index', 1, None), ('index', 2, None), ('control', 1, None)]
+
+
+@pytest.mark.parametrize("codename, version, binned", SYNTHETIC_FORMATS)
+@pytest.mark.parametrize("backend", ['pandas', 'numpy'])
+def test_synthetic_binary(codename, version, binned, backend, tmpdir):
+    from illuminate.extraction_metrics import dotnet_ticks_to_datetime64
+    from illuminate.interop import get_parser_class
+    from illuminate.synthetic import write_binary
+    path = str(tmpdir.join('%s.bin' % codename))
+    data = write_binary(path, codename, version=version, binned=binned,
+                        flowcell_layout=SYNTHETIC_LAYOUT, read_config=SYNTHETIC_READS)
+    parser = get_parser_class(codename)(path, flowcell_layout=SYNTHETIC_LAYOUT,
+                                        read_config=SYNTHETIC_READS, backend=backend)
+
+    assert parser.apparent_file_version == version
+    for name, column in data.items():
+        if name == 'datetime':
+            column = dotnet_ticks_to_datetime64(column)
+        elif column.dtype.kind == 'f':
+            column = column.astype(np.float64)
+        assert np.array_equal(parser.data[name], column), name
+
+
+def test_synthetic_run(tmpdir):
+    from illuminate.synthetic import write_run
+    rundir = write_run(str(tmpdir.join('run')), SYNTHETIC_LAYOUT, SYNTHETIC_READS, q30=0.7, q30_sd=0)
+    dataset = illuminate.InteropDataset(rundir, backend='numpy')
+
+    assert dataset.Metadata().read_config == SYNTHETIC_READS
+    quality = dataset.QualityMetrics()
+    assert quality.read_qscore_results['q30'] == pytest.approx([70, 70, 70], abs=0.01)
+    assert dataset.TileMetrics().num_tiles == 24
+    assert len(dataset.IndexMetrics().results) == 4
+
+
+def test_tile_coordinates(tmpdir):
+    from illuminate.coordinates import split_tile_numbers
+    from illuminate.synthetic import write_run
+    surfaces, swaths, positions = split_tile_numbers([1101, 2314, 11203])
+    assert surfaces.tolist() == [1, 2, 1] and swaths.tolist() == [1, 3, 1] and positions.tolist() == [1, 14, 203]
+
+    rundir = write_run(str(tmpdir.join('run')), SYNTHETIC_LAYOUT, SYNTHETIC_READS, codenames=['quality', 'extraction'])
+    dataset = illuminate.InteropDataset(rundir, backend='numpy')
+    extraction = dataset.ExtractionMetrics()
+    channels = ['intensity_A', 'intensity_C', 'intensity_G', 'intensity_T']
+    cube = extraction.get_cube(channels)
+    coords = extraction.coords
+    assert cube.shape == (14, 2, 12, 4)
+    assert coords.slots([1, 2], [1101, 2203]).tolist() == [0, 23]
+
+    data = extraction.data
+    for surface, swath in [(1, None), (2, 1), (None, 2)]:
+        keep = np.ones(len(data), dtype=bool)
+        if surface is not None:
+            keep &= data['tile'] // 1000 == surface
+        if swath is not None:
+            keep &= data['tile'] // 100 % 10 == swath
+        part = coords.select(cube, read_num=1, lane=2, surface=surface, swath=swath)
+        keep &= (data['lane'] == 2) & (data['cycle'] > 5) & (data['cycle'] <= 9)
+        assert part.sum() == pytest.approx(sum(data[name][keep].sum() for name in channels))
+
+    quality = dataset.QualityMetrics()
+    assert quality.qcube.shape[:3] == coords.shape
+    q30_bin = np.searchsorted(quality.qcube_scores, 30)
+    assert quality.get_qscore_percentage(30, surface=1, swath=2) == pytest.approx(
+        100.0 * quality.qcube_ge[:, :, coords.tile_indices(1, 2), q30_bin].sum() /
+        quality.qcube[:, :, coords.tile_indices(1, 2)].sum())
+
+    # NextSeq's 5-digit tile numbers aren't those of its flowcell_layout: the tile axis is those seen.
+    nextseq = illuminate.InteropDataset("sampledata/NextSeq-samples/2016-04-04", backend='numpy').ErrorMetrics()
+    assert len(nextseq.coords.tiles) == len(np.unique(nextseq.data['tile']))
+    assert (nextseq.coords.slots(nextseq.data['lane'], nextseq.data['tile']) >= 0).all()
+
+
+def test_metadata_cache(tmpdir):
+    from illuminate.synthetic import write_run
+    rundir = write_run(str(tmpdir.join('run')), SYNTHETIC_LAYOUT, SYNTHETIC_READS, codenames=[])
+    meta = illuminate.InteropMetadata(rundir)
+    meta.read_config.pop()
+    assert illuminate.InteropMetadata(rundir).read_config == SYNTHETIC_READS
+
+    runinfo = os.path.join(rundir, 'RunInfo.xml')
+    with open(runinfo) as fh:
+        xml = fh.read()
+    with open(runinfo, 'w') as fh:
+        fh.write(xml.replace('NumCycles="4"', 'NumCycles="8"'))
+    mtime = os.path.getmtime(runinfo) + 10
+    os.utime(runinfo, (mtime, mtime))
+    assert [read['cycles'] for read in illuminate.InteropMetadata(rundir).read_config] == [5, 8, 5]
+
+
+def test_make_test_data(tmpdir):
+    from illuminate.base_parser_class import make_test_data
+    for parser_class, filename in CHUNK_TEST_PARSERS:
+        outfile = make_test_data(parser_class.codename, os.path.join(CHUNK_TEST_DIR, filename),
+                                 str(tmpdir.join(filename)), n=3)
+        parsed = parser_class(outfile, backend='numpy')
+        assert len(parsed.data) == 3
+
+
+def test_parser_stats():
+    calls = []
+    path = os.path.join(CHUNK_TEST_DIR, "QMetricsOut.bin")
+    parser = illuminate.InteropQualityMetrics(path, backend='numpy',
+                                              stats_callback=lambda *args: calls.append(args[1:3]))
+    stats = parser.stats
+    assert stats['bytes'] == os.path.getsize(path)
+    assert stats['records'] == 8624
+    assert sorted(stats['phases']) == ['decode', 'read', 'summarize']
+    assert [phase for phase, seconds in calls] == ['read', 'decode', 'summarize']
+
+    parser.idf
+    assert stats['phases']['dataframe']['calls'] == 1
+    assert stats['phases']['index_frame']['calls'] == 1
+    # .df is built while building .idf, and its time isn't counted twice.
+    assert sum(seconds for phase, seconds in calls) == pytest.approx(
+        sum(phase['seconds'] for phase in stats['phases'].values()))
+
+
+def test_watch(tmpdir, monkeypatch, capsys):
+    from illuminate import __main__ as cli
+    from illuminate.synthetic import make_binary, write_run
+    rundir = write_run(str(tmpdir.join('run')), SYNTHETIC_LAYOUT, SYNTHETIC_READS, versions={'quality': 4},
+                       codenames=['tile', 'quality'])
+    path = os.path.join(rundir, 'InterOp', 'QMetricsOut.bin')
+    binary = open(path, 'rb').read()
+    written = 2 + 206 * 24 * 5      # the first 5 of 14 cycles.
+    with open(path, 'wb') as fh:
+        fh.write(binary[:written])
+
+    dataset = illuminate.InteropDataset(rundir, backend='numpy')
+    assert dataset.changed_binaries() == ['tile', 'quality']
+    assert dataset.changed_binaries() == []
+    assert len(dataset.QualityMetrics().data) == 24 * 5
+
+    def run_grows(seconds):
+        # the instrument appends cycles 6-14, then writes ErrorMetrics.
+        if len(open(path, 'rb').read()) < len(binary):
+            with open(path, 'ab') as fh:
+                fh.write(binary[written:])
+        elif not os.path.exists(os.path.join(rundir, 'InterOp', 'ErrorMetricsOut.bin')):
+            with open(os.path.join(rundir, 'InterOp', 'ErrorMetricsOut.bin'), 'wb') as fh:
+                fh.write(make_binary('error', flowcell_layout=SYNTHETIC_LAYOUT, read_config=SYNTHETIC_READS)[0])
+        else:
+            raise KeyboardInterrupt
+    monkeypatch.setattr(cli.time, 'sleep', run_grows)
+
+    args = dict((option, False) for codename, accessor, title, option in cli.METRICS)
+    args.update({'--interval': '1', '--all': False, '--quality': True, '--error': True,
+                 '--timestamp': False, '--csv': False, '--json': False})
+    quality = dataset.QualityMetrics()
+    capsys.readouterr()
+    cli.watch(dataset, args)
+    out = capsys.readouterr()[0]
+
+    assert out.count('changed: ') == 2
+    assert 'changed: quality' in out and 'changed: error' in out
+    assert dataset.QualityMetrics() is quality       # updated in place, not re-parsed.
+    assert len(quality.data) == 24 * 14
+    assert len(dataset.ErrorMetrics().data) == 24 * 14
+
+
+def test_summarize_runs(tmpdir):
+    from illuminate.batch import find_runs
+    from illuminate.synthetic import write_run
+    write_run(str(tmpdir.join('2017', 'run1')), SYNTHETIC_LAYOUT, SYNTHETIC_READS, q30=0.8, q30_sd=0)
+    write_run(str(tmpdir.join('2017', 'run2')), SYNTHETIC_LAYOUT, SYNTHETIC_READS, q30=0.9, q30_sd=0,
+              codenames=['tile', 'quality'])
+    tmpdir.join('2018', 'broken').ensure('RunInfo.xml').write('<RunInfo')
+
+    runs = find_runs(str(tmpdir))
+    assert [os.path.basename(path) for path in runs] == ['run1', 'run2', 'broken']
+
+    summaries = dict((os.path.basename(summary['path']), summary)
+                     for summary in illuminate.summarize_runs(runs, workers=2))
+    assert sorted(summaries) == ['broken', 'run1', 'run2']
+    assert summaries['broken']['error'] and 'run_id' not in summaries['broken']
+    assert summaries['run1']['error'] is None and summaries['run1']['errors'] == {}
+    assert summaries['run1']['quality'] == pytest.approx({1: 80, 2: 80, 3: 80}, abs=0.01)
+    assert summaries['run2']['quality'] == pytest.approx({1: 90, 2: 90, 3: 90}, abs=0.01)
+    assert summaries['run2']['index'] is None
+    assert summaries['run1']['error_rate']['mean_rate'] == pytest.approx(0.5, rel=0.1)
+    assert summaries['run1']['tile']['num_clusters'] > 0
+
+
+def exit_on_crash(path):
+    "map_runs function of test_map_runs: takes its worker process down on a run named 'crash'."
+    if os.path.basename(path) == 'crash':
+        os._exit(1)
+    return os.path.basename(path)
+
+def test_map_runs():
+    from illuminate.batch import map_runs
+    taken = []
+    def runs(names):
+        for name in names:
+            taken.append(name)
+            yield ('/runs/%s' % name,)
+
+    names = ['run%i' % num for num in range(20)]
+    results = map_runs(exit_on_crash, runs(names), workers=2)
+    first = next(results)
+    # a window of 2 x 2 runs, topped up as they complete: the rest are still in the generator.
+    assert len(taken) < len(names)
+    assert sorted([first] + list(results)) == sorted(names)
+
+    results = list(map_runs(exit_on_crash, runs(['crash'] + names[:5]), workers=2))
+    assert len(results) == 6
+    assert any(isinstance(result, dict) and result['path'] == '/runs/crash' for result in results)
+
+
+def test_inventory(tmpdir, monkeypatch):
+    import json
+    from illuminate import inventory
+    from illuminate.inventory import scan, write_index, query_index
+    from illuminate.synthetic import write_run
+    write_run(str(tmpdir.join('2017', 'run1')), SYNTHETIC_LAYOUT, SYNTHETIC_READS)
+    write_run(str(tmpdir.join('2017', 'run2')), SYNTHETIC_LAYOUT, SYNTHETIC_READS, codenames=['tile', 'quality'])
+    tmpdir.join('2018', 'broken').ensure('RunInfo.xml').write('<RunInfo')
+    tmpdir.join('2018', 'notes').ensure('README.txt')
+
+    for workers in (1, 2):
+        entries = dict((os.path.basename(entry['path']), entry) for entry in scan(str(tmpdir), workers=workers))
+        assert sorted(entries) == ['broken', 'run1', 'run2']
+        assert entries['broken']['error'] and entries['broken']['xml'] == {'runinfo': 'RunInfo.xml'}
+        assert entries['run1']['error'] is None
+        assert entries['run1']['run_id'] == 'run1'
+        assert entries['run1']['flowcell_layout'] == SYNTHETIC_LAYOUT
+        assert entries['run1']['read_config'] == SYNTHETIC_READS
+        assert entries['run2']['binaries'] == {'tile': 'TileMetricsOut.bin', 'quality': 'QMetricsOut.bin'}
+
+    index = str(tmpdir.join('runs.jsonl'))
+    assert write_index(scan(str(tmpdir), workers=1), index) == 3
+    assert [entry['run_id'] for entry in query_index(index, has=['index'])] == ['run1']
+    assert sorted(entry['run_id'] for entry in query_index(index, error=None)) == ['run1', 'run2']
+
+    # a run whose worker process crashed only has a path and an error.
+    with open(index, 'a') as fh:
+        fh.write(json.dumps({'path': str(tmpdir.join('crashed')), 'error': 'BrokenProcessPool: crashed'}) + '\n')
+    assert [entry['run_id'] for entry in query_index(index, has=['index'])] == ['run1']
+    assert len(list(query_index(index, error='BrokenProcessPool: crashed'))) == 1
+
+    monkeypatch.setattr(inventory, 'map_runs', lambda *args: iter([{'path': 'crashed', 'error': 'crashed'}]))
+    assert list(scan(str(tmpdir))) == [{'path': 'crashed', 'error': 'crashed', 'xml': {}, 'binaries': {}, 'seconds': None}]
+
+
+def test_summary_store(tmpdir):
+    from illuminate.store import SummaryStore
+    from illuminate.synthetic import write_run
+    run1 = write_run(str(tmpdir.join('runs', 'run1')), SYNTHETIC_LAYOUT, SYNTHETIC_READS, q30=0.8, q30_sd=0)
+    write_run(str(tmpdir.join('runs', 'run2')), SYNTHETIC_LAYOUT, SYNTHETIC_READS, q30=0.9, q30_sd=0,
+              codenames=['tile', 'quality'])
+    store = SummaryStore(str(tmpdir.join('runs.sqlite')))
+
+    assert store.ingest_tree(str(tmpdir.join('runs')), workers=1) == {'added': 2, 'updated': 0, 'unchanged': 0, 'failed': 0}
+    assert store.ingest_tree(str(tmpdir.join('runs')), workers=2) == {'added': 0, 'updated': 0, 'unchanged': 2, 'failed': 0}
+    reads = store.query('SELECT read_num, q30, error_rate FROM reads WHERE path = ? ORDER BY read_num', [run1])
+    assert [read['q30'] for read in reads] == pytest.approx([80, 80, 80], abs=0.01)
+    assert reads[0]['error_rate'] == pytest.approx(0.5, rel=0.1)
+    assert len(store.query('SELECT * FROM lanes')) == 4
+    assert len(store.query('SELECT * FROM indexes WHERE path = ?', [run1])) == 4
+    assert store.aggregate('q30', by='run_id') == pytest.approx({'run1': 80, 'run2': 90}, abs=0.01)
+    assert store.aggregate('q30', by='model', how='count', table='reads') == {'Unidentified': 6}
+
+    write_run(run1, SYNTHETIC_LAYOUT, SYNTHETIC_READS, q30=0.7, q30_sd=0, codenames=['quality'])
+    qmetrics = os.path.join(run1, 'InterOp', 'QMetricsOut.bin')
+    mtime = os.path.getmtime(qmetrics) + 10
+    os.utime(qmetrics, (mtime, mtime))
+    store.close()
+    store = SummaryStore(str(tmpdir.join('runs.sqlite')))
+    assert store.ingest_tree(str(tmpdir.join('runs')), workers=1) == {'added': 0, 'updated': 1, 'unchanged': 1, 'failed': 0}
+    assert store.aggregate('q30', by='run_id') == pytest.approx({'run1': 70, 'run2': 90}, abs=0.01)
+
+    # a run whose rows can't all be written keeps what the store had of it.
+    summary = { 'path': run1, 'run': { 'path': run1 }, 'lanes': [], 'indexes': [],
+                'reads': [{ 'path': run1, 'read_num': 1 }, { 'path': run1, 'read_num': 1 }] }
+    with pytest.raises(sqlite3.IntegrityError):
+        store.add(summary)
+    assert store.aggregate('q30', by='run_id') == pytest.approx({'run1': 70, 'run2': 90}, abs=0.01)
+
+    # failed runs are tried again; runs gone from the tree are pruned.
+    tmpdir.join('runs', 'broken').ensure('RunInfo.xml').write('<RunInfo')
+    runs = str(tmpdir.join('runs'))
+    assert store.ingest_tree(runs, workers=1) == {'added': 0, 'updated': 0, 'unchanged': 2, 'failed': 1}
+    assert store.ingest_tree(runs, workers=1) == {'added': 0, 'updated': 0, 'unchanged': 2, 'failed': 1}
+    tmpdir.join('runs', 'broken').remove()
+    assert store.ingest_tree(runs, workers=1, prune=True) == {'added': 0, 'updated': 0, 'unchanged': 2,
+                                                             'failed': 0, 'removed': 1}
+    assert sorted(run['path'] for run in store.query('SELECT path FROM runs')) == [run1, os.path.join(runs, 'run2')]
+
+
+@pytest.mark.parametrize("parser_class, filename", CHUNK_TEST_PARSERS)
+@pytest.mark.parametrize("backend", ['pandas', 'numpy'])
+def test_streaming_writers(parser_class, filename, backend):
+    import json
+    from io import StringIO
+    parser = parser_class(os.path.join(CHUNK_TEST_DIR, filename), backend=backend)
+    df = parser.df
+    for n_records in (1000, 100000):
+        for writer, expected in ((parser.write_csv, df.to_csv(index_label='line')), (parser.write_json, df.to_json())):
+            fh = StringIO()
+            writer(fh, n_records)
+            assert fh.getvalue() == expected
+        fh = StringIO()
+        parser.write_jsonl(fh, n_records)
+        rows = [json.loads(line) for line in fh.getvalue().splitlines()]
+        assert len(rows) == len(df)
+        assert list(rows[0]) == list(df.columns)
+
+
+@pytest.mark.parametrize("parser_class, filename", CHUNK_TEST_PARSERS)
+def test_columnar_export(parser_class, filename, tmpdir):
+    pytest.importorskip('pyarrow')
+    from pyarrow import feather, parquet
+    parser = parser_class(os.path.join(CHUNK_TEST_DIR, filename), backend='numpy')
+    parquet_table = parquet.read_table(parser.to_parquet(str(tmpdir.join('out.parquet'))))
+    parser.to_arrow(str(tmpdir.join('out.arrow')))
+    arrow_table = feather.read_table(str(tmpdir.join('out.arrow')))
+
+    for table in (parquet_table, arrow_table):
+        assert table.column_names == list(parser.data.dtype.names)
+        for name in table.column_names:
+            assert np.array_equal(table.column(name).to_numpy(), parser.data[name]), name